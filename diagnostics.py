@@ -0,0 +1,133 @@
+"""
+Memory diagnostics of the open bank.
+
+`memory_report` accounts the memory of the bank, its images and every cache kept next to it. Objects shared
+between them (question strings are referenced by the indexes and the undo history too) are counted once, in
+the first category that holds them. `MemoryTracker` wraps tracemalloc snapshots, for finding what grows
+between e.g. two import / export cycles. Pillow allocates pixel data outside of tracemalloc, so decoded images
+only show up in the report.
+"""
+import sys, tracemalloc
+
+from PySide6.QtWidgets import QLabel
+
+from project import ProjectImages, shared_images
+
+
+def deep_size(obj, seen: dict):
+    """Size of an object and the containers and strings it holds, objects already in `seen` are not counted again"""
+    # `seen` keeps the objects too, an id is only unique while its object lives
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen: continue
+        seen[id(obj)] = obj
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def image_size(image):
+    return len(image.getbands()) * image.width * image.height
+
+
+def pixmap_size(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8 if pixmap is not None and not pixmap.isNull() else 0
+
+
+def memory_report(window):
+    """
+    Returns:
+        list[tuple[str, int, int]]: (category, number of objects, bytes)
+    """
+    seen = {}
+    rows = []
+    questions_list = window.questions_list
+
+    # images first, so the objects holding them below only count their own size
+    images = window.images
+    loaded = images.loaded if isinstance(images, ProjectImages) else images
+    bank_images = {id(image): image for image in loaded.values() if image is not None}
+    seen.update(bank_images)
+    rows.append(("decoded images", len(bank_images), sum(image_size(image) for image in bank_images.values())))
+    if isinstance(images, ProjectImages):
+        rows.append(("images not loaded from the project yet", len(images.pending), 0))
+    held = [image for image in list(shared_images.images.values()) if id(image) not in seen]
+    seen.update((id(image), image) for image in held)
+    rows.append(("images only held by undo history / caches", len(held), sum(image_size(image) for image in held)))
+
+    rows.append(("question text", len(questions_list), sum(deep_size(question, seen) for question_data in questions_list.values() for question in question_data)))
+    rows.append(("answer lists", sum(len(answers) for question_data in questions_list.values() for answers in question_data.values()),
+                 sum(deep_size(answers, seen) for question_data in questions_list.values() for answers in question_data.values())))
+    rows.append(("bank dicts", len(questions_list), deep_size(questions_list, seen) + deep_size(loaded, seen)))
+
+    drop_area = window.image_drop_area
+    # the preview pixmap and its scaled copy the label shows, the attribute hides QLabel.pixmap()
+    rows.append(("pixmaps", 2, pixmap_size(drop_area.pixmap) + pixmap_size(QLabel.pixmap(drop_area))))
+    # Qt keeps item texts and tooltips as UTF-16, roughly 2 bytes a character and a bit of overhead
+    items = [window.question_list.item(i) for i in range(window.question_list.count())]
+    rows.append(("list items and tooltips", len(items), sum(100 + 2 * (len(item.text()) + len(item.toolTip())) for item in items)))
+
+    rows.append(("similarity index", len(window.similarity.entries), deep_size([window.similarity.postings, window.similarity.entries, window.similarity.short], seen)))
+    rows.append(("search index", len(window.search.entries), deep_size([window.search.postings, window.search.entries, window.search.sorted_words], seen)))
+    history = window.history
+    rows.append(("undo history", len(history.undo_steps) + len(history.redo_steps), deep_size([history.undo_steps, history.redo_steps, history.known], seen)))
+    cache = window.prefetcher.cache
+    rows.append(("prefetched answers", len(cache), deep_size(cache, seen)))
+    rows.append(("journal image hashes", len(window.journal.image_hashes), deep_size([window.journal.image_hashes, window.journal.object_hashes], seen)))
+    if window.project:
+        rows.append(("project image hashes", len(window.project.known_hashes), deep_size([window.project.known_hashes, window.project.object_hashes], seen)))
+    return rows
+
+
+def format_report(rows):
+    lines = [f"{'':42} {'objects':>9} {'MB':>9}"]
+    lines += [f"{name:42} {count:>9} {size / 2**20:>9.2f}" for name, count, size in rows]
+    lines.append(f"{'total':42} {'':>9} {sum(size for _, _, size in rows) / 2**20:>9.2f}")
+    return "\n".join(lines)
+
+
+
+class MemoryTracker():
+    """tracemalloc snapshots, `diff` lists what grew since `snapshot` by source line"""
+    def __init__(self):
+        self.baseline = None
+
+
+    @staticmethod
+    def tracing():
+        return tracemalloc.is_tracing()
+
+
+    @staticmethod
+    def start():
+        # the line that allocated is enough for statistics by line, more frames make snapshots several times slower
+        if not tracemalloc.is_tracing(): tracemalloc.start()
+
+
+    @staticmethod
+    def traced():
+        current, peak = tracemalloc.get_traced_memory()
+        return f"traced Python allocations: {current / 2**20:.1f} MB now, {peak / 2**20:.1f} MB at peak"
+
+
+    def snapshot(self, limit=15):
+        """Takes the snapshot `diff` compares to, returns its biggest lines"""
+        self.baseline = tracemalloc.take_snapshot()
+        lines = [self.traced() + ", biggest lines:"]
+        lines += [str(stat) for stat in self.baseline.statistics('lineno')[:limit]]
+        return "\n".join(lines)
+
+
+    def diff(self, limit=15):
+        if self.baseline is None: return "No snapshot taken yet"
+        stats = tracemalloc.take_snapshot().compare_to(self.baseline, 'lineno')
+        growth = sum(stat.size_diff for stat in stats)
+        lines = [f"{growth / 2**20:+.2f} MB since the snapshot, biggest changes:"]
+        lines += [str(stat) for stat in stats[:limit]]
+        return "\n".join(lines)
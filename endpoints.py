@@ -0,0 +1,179 @@
+"""
+Routing of LLM requests over several OpenAI compatible endpoints.
+
+The endpoint expected to answer fastest gets a request first. When it takes longer than the hedge
+delay a backup request goes to the next one, and when it fails the next one is tried straight away.
+The first good answer wins, the slower request is left to finish in the background.
+"""
+import threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+default_hedge_delay = {'single': 3.0, 'batch': 20.0}  # seconds, until the latency of an endpoint is known
+hedge_factor = 2.0        # backup request once a call takes this many times the usual latency of its endpoint
+min_hedge_delay = 0.5
+latency_weight = 0.3      # of the last call in the moving average
+
+
+
+class FinalError(ValueError):
+    """An answer that another endpoint would not improve on, e.g. cut off at max_tokens, so there is no failover"""
+    pass
+
+
+
+class Endpoint():
+    """One endpoint with what was observed of it, latency is kept per request kind since batches take much longer"""
+    def __init__(self, url, key, model, weight=1.0):
+        self.url = url
+        self.key = key
+        self.model = model
+        self.weight = weight
+        self.latency = {}          # kind -> moving average of seconds per successful call
+        self.in_flight = 0
+        self.failures = 0          # in a row
+        self.blocked_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0              # requests this endpoint answered first as a backup
+        self.clients = {}
+
+
+    def client(self, max_retries):
+        # the client keeps its connections open, so it is made once per endpoint
+        import openai
+        if max_retries not in self.clients:
+            self.clients[max_retries] = openai.Client(api_key=self.key, base_url=self.url, max_retries=max_retries)
+        return self.clients[max_retries]
+
+
+    def cost(self, kind):
+        """Expected wait for a new request, endpoints not measured yet look fast so they get tried"""
+        return self.latency.get(kind, 0.0) * (1 + self.in_flight) / self.weight
+
+
+    def succeeded(self, kind, seconds):
+        self.failures = 0
+        old = self.latency.get(kind)
+        self.latency[kind] = seconds if old is None else (1 - latency_weight) * old + latency_weight * seconds
+
+
+    def failed(self, error):
+        self.failures += 1
+        self.errors += 1
+        # a rate limited or failing endpoint is skipped for a while, longer the more it fails
+        self.blocked_until = time.monotonic() + min(60, 2 ** self.failures)
+
+
+    def describe(self):
+        latency = ", ".join(f"{kind} {seconds:.2f} s" for kind, seconds in self.latency.items()) or "no latency yet"
+        return f"{self.model or 'default model'} at {self.url or 'default url'}: {self.calls} calls, {self.errors} failed, {self.wins} won as backup, {latency}"
+
+
+
+class Router():
+    """Endpoints are kept by url, key and model, so what was observed of them survives changes of the settings"""
+    def __init__(self, workers=16):
+        self.lock = threading.Lock()
+        self.endpoints = {}   # (url, key, model) -> Endpoint
+        self.executor = None
+        self.workers = workers
+        self.hedges = 0
+        self.failovers = 0
+
+
+    def endpoint(self, url, key, model, weight=1.0):
+        with self.lock:
+            endpoint = self.endpoints.get((url, key, model))
+            if endpoint is None:
+                endpoint = self.endpoints[(url, key, model)] = Endpoint(url, key, model)
+            endpoint.weight = max(float(weight), 0.01)
+            return endpoint
+
+
+    def pick(self, candidates: list[Endpoint], kind):
+        """Takes the best endpoint out of `candidates` and counts the request it is about to get"""
+        now = time.monotonic()
+        with self.lock:
+            # chosen and counted in one go, so concurrent requests spread over endpoints not measured yet
+            endpoint = min(candidates, key=lambda endpoint: (endpoint.blocked_until > now, endpoint.cost(kind), endpoint.in_flight, -endpoint.weight))
+            candidates.remove(endpoint)
+            endpoint.in_flight += 1
+            endpoint.calls += 1
+            return endpoint
+
+
+    def hedge_delay(self, endpoint: Endpoint, kind):
+        latency = endpoint.latency.get(kind)
+        if latency is None: return default_hedge_delay.get(kind, default_hedge_delay['single'])
+        return max(min_hedge_delay, hedge_factor * latency)
+
+
+    def call(self, kind, endpoints: list[Endpoint], request):
+        """
+        `request(endpoint)` on the best endpoint, hedged and failed over to the others.
+        It should raise on a bad answer too, so another endpoint gets a chance.
+        """
+        candidates = list(endpoints)
+        if len(candidates) == 1: return self.run(self.pick(candidates, kind), kind, request)
+
+        with self.lock:
+            if self.executor is None: self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='llm')
+        pending = {}   # future -> endpoint
+        error = None
+        last_launch = 0.0
+
+        def launch():
+            nonlocal last_launch
+            endpoint = self.pick(candidates, kind)
+            pending[self.executor.submit(self.run, endpoint, kind, request)] = endpoint
+            last_launch = time.monotonic()
+            return endpoint
+
+        first = newest = launch()
+        while pending:
+            timeout = max(0.0, last_launch + self.hedge_delay(newest, kind) - time.monotonic()) if candidates else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                with self.lock: self.hedges += 1
+                newest = launch()
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except FinalError:
+                    raise
+                except Exception as e:
+                    error = e
+                    continue
+                if endpoint is not first:
+                    with self.lock: endpoint.wins += 1
+                return result
+            if not pending and candidates:
+                with self.lock: self.failovers += 1
+                newest = launch()
+        raise error
+
+
+    def run(self, endpoint: Endpoint, kind, request):
+        """Request on an endpoint from `pick`"""
+        started = time.perf_counter()
+        try:
+            result = request(endpoint)
+        except Exception as e:
+            with self.lock:
+                endpoint.in_flight -= 1
+                if not isinstance(e, FinalError): endpoint.failed(e)
+            raise
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.succeeded(kind, time.perf_counter() - started)
+        return result
+
+
+    def summary(self):
+        with self.lock:
+            lines = [endpoint.describe() for endpoint in self.endpoints.values()]
+        lines.append(f"{self.hedges} backup requests, {self.failovers} failovers")
+        return "\n".join(lines)
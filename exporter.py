@@ -0,0 +1,621 @@
+"""
+Export of question banks to Testownik ZIP and web Testownik JSON, one or several formats from a single pass over the bank.
+
+Kept free of Qt, so exports can run on worker threads. Every export writes a
+temporary file next to the target and renames it at the end, so a cancelled or
+failed export never leaves a half written file behind.
+"""
+import io, json, os, shutil, threading, time, zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
+
+from project import StoredImage, peek_image
+
+
+image_size_limits = [600, 600]
+
+# tEXt chunks of captioned images, so an import can cut the caption off exactly
+caption_height_key = 'testownik:caption-height'
+image_size_key = 'testownik:image-size'    # "WxH" of the image below the caption
+source_size_key = 'testownik:source-size'  # "WxH" of the image before it was scaled for export
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+
+class ExportProgress():
+    """Per-stage timings and progress reporting of one export"""
+    def __init__(self, job=None, total=0):
+        self.job = job
+        self.total = total
+        self.done = 0
+        self.timings = {}
+        self.image_uses = 0
+        self.unique_images = set()
+
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+    def check(self):
+        """Raises ExportCancelled if the job was cancelled"""
+        if self.job and self.job.cancelled: raise ExportCancelled()
+
+
+    def step(self, stage=''):
+        """Mark one question as done, raises ExportCancelled if the job was cancelled"""
+        self.advance(1, stage)
+
+
+    def advance(self, count, stage=''):
+        self.check()
+        self.done += count
+        if self.job: self.job.report(self.done, self.total, stage)
+
+
+    def image(self, image):
+        """Count an image written for a question, True the first time this picture comes up"""
+        key = image_identity(image)
+        self.image_uses += 1
+        if key in self.unique_images: return False
+        self.unique_images.add(key)
+        return True
+
+
+    def summary(self):
+        summary = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.timings.items())
+        if self.image_uses:
+            summary += f"; {self.image_uses} images, {len(self.unique_images)} distinct"
+        return summary
+
+
+
+def upload_image_to_imgbb(image_data, api_key):
+    """
+    Uploads an image to imgbb.com and retrieves its URL.
+
+    Args:
+        image_data (bytes): The raw image data (byte stream).
+        api_key (str): Your imgbb.com API key. You can get one from https://api.imgbb.com/.
+
+    Returns:
+        str: The URL of the uploaded image if successful, None otherwise.
+    """
+    import requests
+    url = "https://api.imgbb.com/1/upload"
+
+    try:
+        files = {'image': ('image.png', image_data, 'image/png')}
+        data = {'key': api_key}
+
+        response = requests.post(url, files=files, data=data)
+        response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
+
+        result = response.json()
+
+        if result and result.get('success'):
+            image_url = result['data']['url']
+            print(f"Image uploaded successfully. URL: {image_url}")
+            return image_url
+        else:
+            print(f"Image upload failed. Response: {result}")
+            return None
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred during the request: {e}")
+        return None
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return None
+
+
+def wrap_text(text):
+    lines = []
+    words = text.split()
+    current_line = ""
+    for word in words:
+        if len(current_line) + len(word) + 1 > 40:
+            lines.append(current_line.strip())
+            current_line = word
+        else:
+            current_line += " " + word if current_line else word
+    lines.append(current_line.strip())
+    return lines
+
+
+def calculate_text_height(text, img_width):
+    """Calculate the height needed for text area based on image width and text content"""
+    try:
+        # Calculate font size based on image dimensions
+        font_size = max(20, min(img_width // 20, 60))
+        font = ImageFont.truetype("arial.ttf", font_size)
+
+        # Calculate height needed for text
+        return int(max(100, len(wrap_text(text)) * font_size * 1.3))
+    except Exception:
+        return 100  # Default height if calculation fails
+
+
+def scale_image(image):
+    """Copy of the image scaled into `image_size_limits`"""
+    img = image.copy()
+
+    if img.width < image_size_limits[0] or img.height < image_size_limits[0]:
+        scale_factor = max(image_size_limits[0] / img.width, image_size_limits[0] / img.height)
+        new_width = int(img.width * scale_factor)
+        new_height = int(img.height * scale_factor)
+        img = img.resize((new_width, new_height))
+
+    if img.width > image_size_limits[1] or img.height > image_size_limits[1]:
+        scale_factor = min(image_size_limits[1] / img.width, image_size_limits[1] / img.height)
+        new_width = int(img.width * scale_factor)
+        new_height = int(img.height * scale_factor)
+        img = img.resize((new_width, new_height))
+
+    return img
+
+
+def add_text_to_image(image, text, scaled=None):
+    """
+    Returns PNG data of the image scaled into `image_size_limits`, with the question written above it.
+
+    `scaled` is the result of `scale_image`, for images used by several questions.
+    """
+    img = scaled if scaled is not None else scale_image(image)
+    source_size = image.size
+
+    # Calculate font size and text height
+    font_size = max(20, min(img.width // 20, img.height // 10))
+    font = ImageFont.truetype("arial.ttf", font_size)
+    text_height = calculate_text_height(text, img.width)
+
+    # Create a new image with extra space at the top for text
+    total_height = img.height + text_height
+    new_img = Image.new('RGB', (img.width, total_height), color='white')
+    new_img.paste(img, (0, text_height))
+
+    # Create a drawing context
+    draw = ImageDraw.Draw(new_img)
+
+    # Draw text
+    margin = 10
+    x = margin
+    y = margin
+    for line in wrap_text(text):
+        draw.text((x, y), line, fill=(0, 0, 0), font=font)
+        y += font.size + 5
+
+    # Save the modified image, with what remove_text_area needs to undo it
+    metadata = PngInfo()
+    metadata.add_text(caption_height_key, str(text_height))
+    metadata.add_text(image_size_key, f"{img.width}x{img.height}")
+    metadata.add_text(source_size_key, f"{source_size[0]}x{source_size[1]}")
+    buffer = io.BytesIO()
+    new_img.save(buffer, format="PNG", pnginfo=metadata)
+    return buffer.getvalue()
+
+
+def caption_height(image):
+    """Caption height stored by add_text_to_image, None for images from older exports or edited since"""
+    try:
+        height = int(image.info[caption_height_key])
+        width, image_height = (int(value) for value in image.info[image_size_key].split('x'))
+    except (KeyError, ValueError):
+        return None
+    if image.width != width or image.height != height + image_height: return None
+    return height
+
+
+def source_size(image):
+    """Size of the image before the export scaled it, None if add_text_to_image did not store it"""
+    try:
+        width, height = (int(value) for value in image.info[source_size_key].split('x'))
+    except (KeyError, ValueError):
+        return None
+    return width, height
+
+
+def remove_text_area(image, text):
+    """
+    Remove the text area from an image that was previously added with add_text_to_image.
+
+    Images the export scaled up to `image_size_limits` are scaled back to their size from before,
+    shrunk ones stay as they are, scaling them up again would not bring the detail back.
+    """
+    height = caption_height(image)
+    if height is not None:
+        size = source_size(image)
+        image = image.crop((0, height, image.width, image.height))
+        if size and size[0] < image.width and size[1] < image.height:
+            image = image.resize(size, Image.LANCZOS)
+        return image
+    try:
+        # Calculate the height of text area that was added
+        text_height = calculate_text_height(text, image.width)
+
+        # Crop the image to remove the text area
+        return image.crop((0, text_height, image.width, image.height))
+    except Exception as e:
+        print(f"Error removing text area: {str(e)}")
+        return image
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def copy_zip_entry(source: zipfile.ZipFile, target: zipfile.ZipFile, name):
+    """Copy an entry between archives, it is inflated and deflated again, but not rendered again"""
+    info = source.getinfo(name)
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.external_attr = info.external_attr
+    new_info.file_size = info.file_size  # so zipfile knows up front whether the entry needs zip64
+    with source.open(info) as source_file, target.open(new_info, 'w') as target_file:
+        shutil.copyfileobj(source_file, target_file, 1 << 20)
+
+
+def snapshot_bank(questions_list: dict, images):
+    """
+    Copy of the bank that an export can read on a worker thread while the user keeps editing.
+
+    Images of a project that were not opened yet stay in the project file as `StoredImage`,
+    the worker decodes its own copy with `open_image`.
+
+    Returns:
+        list[tuple[int, str, list, Image | StoredImage]]: (question id, question, answers, image or None)
+    """
+    bank = []
+    for question_id, question_data in questions_list.items():
+        question, answers = list(question_data.items())[0]
+        bank.append((question_id, question, list(answers), peek_image(images, question_id)))
+    return bank
+
+
+def open_image(image):
+    return image.load() if isinstance(image, StoredImage) else image
+
+
+def image_identity(image):
+    """Same for every question sharing a picture: the stored hash, or the shared image object"""
+    return image.hash if isinstance(image, StoredImage) else id(image)
+
+
+
+class SharedImages():
+    """Work done once per distinct image of an export, kept only while questions using it are still ahead"""
+    def __init__(self, bank):
+        self.remaining = {}
+        for _, _, _, image in bank:
+            if image is not None:
+                key = image_identity(image)
+                self.remaining[key] = self.remaining.get(key, 0) + 1
+        self.results = {}
+
+
+    def get(self, image, function):
+        key = image_identity(image)
+        if key not in self.results:
+            self.results[key] = function(image)
+        self.remaining[key] -= 1
+        return self.results.pop(key) if self.remaining[key] <= 0 else self.results[key]
+
+
+def file_state(filename):
+    """What a later export compares against to tell whether the file was touched since"""
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+
+def open_previous_zip(filename, previous_state):
+    """Archive from the last export, if it is still exactly what we wrote there"""
+    if not previous_state or not os.path.exists(filename): return None
+    if file_state(filename) != previous_state: return None
+    try:
+        return zipfile.ZipFile(filename, 'r')
+    except zipfile.BadZipFile:
+        return None
+
+
+def question_text_file(question_id, question, answers, image_name=''):
+    num_answers = 0
+    for answer, _ in answers:
+        if answer.strip() != '':
+            num_answers += 1
+
+    content = []
+    correct_answers = [i for i, (_, is_correct) in enumerate(answers) if is_correct]
+    if len(correct_answers) == 0:
+        raise ValueError(f'Question [{question_id}] ({question}) contains no correct answers!')
+
+    correct_line = f"X{''.join(str(int(i in correct_answers)) for i in range(num_answers))}"
+    content.append(correct_line + "\n")  # Correct answers line
+    if image_name != '':
+        content.append(f'[img]{image_name}[/img] ')
+    content.append(f"{question}\n")  # The question itself
+
+    # Process answers
+    for answer, _ in answers:
+        if answer.strip() != '':
+            content.append(f"{answer}\n")
+
+    # Join the content and encode it
+    return "".join(content).encode('utf-8')
+
+
+class ImageAssets():
+    """Encodings of one picture, made the first time a target asks for them and shared by all targets of an export"""
+    def __init__(self, image):
+        self.image = image
+        self._source = None
+        self._scaled = None
+        self._png = None
+        self.lock = threading.Lock()  # the PNG is also asked for on upload threads
+
+
+    def source(self):
+        if self._source is None: self._source = open_image(self.image)
+        return self._source
+
+
+    def scaled(self):
+        if self._scaled is None: self._scaled = scale_image(self.source())
+        return self._scaled
+
+
+    def png(self):
+        """PNG of the image as it is, a stored image is not even decoded for it"""
+        with self.lock:
+            if self._png is None:
+                self._png = self.image.data() if isinstance(self.image, StoredImage) else encode_png(self.source())
+            return self._png
+
+
+
+class ExportTarget():
+    """
+    One file written by `export_bank`, into a temporary file next to it.
+
+    `add` gets every question of the bank together with the shared ImageAssets of its image,
+    `finish` completes the temporary file and `commit` puts it in place and returns the result.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.progress = None
+
+
+    def begin(self, progress: ExportProgress):
+        self.progress = progress
+
+
+    def add(self, question_number, question, answers, image, assets: ImageAssets):
+        pass
+
+
+    def finish(self):
+        pass
+
+
+    def commit(self):
+        with self.progress.stage('finalize'):
+            os.replace(self.filename + '.tmp', self.filename)
+
+
+    def abort(self):
+        if os.path.exists(self.filename + '.tmp'): os.remove(self.filename + '.tmp')
+
+
+
+class ZipTarget(ExportTarget):
+    """
+    Testownik ZIP.
+
+    When `previous_state` still matches the file on disk, questions not in `dirty`
+    are copied over from the previous archive instead of being rendered again.
+    """
+    def __init__(self, filename, previous_state=None, dirty=()):
+        super().__init__(filename)
+        self.previous_state = previous_state
+        self.dirty = dirty
+        self.folder_name = os.path.basename(filename).split('.')[0]
+        self.previous = None
+        self.zipf = None
+        self.reused = 0
+
+
+    def begin(self, progress):
+        super().begin(progress)
+        self.previous = open_previous_zip(self.filename, self.previous_state)
+        self.zipf = zipfile.ZipFile(self.filename + '.tmp', 'w', zipfile.ZIP_DEFLATED)
+
+
+    def add(self, question_number, question, answers, image, assets):
+        progress = self.progress
+        # skip if question is empty or there are no answers, unless there is an image
+        if (len(question) < 2 and image is None) or len(answers) < 1: return
+
+        text_name = os.path.join(self.folder_name, f"{question_number}.txt")
+        if self.previous and question_number not in self.dirty and text_name in self.previous.NameToInfo:
+            with progress.stage('copy'):
+                image_entry = os.path.join(self.folder_name, f"{question_number}.png")
+                if image_entry in self.previous.NameToInfo:
+                    copy_zip_entry(self.previous, self.zipf, image_entry)
+                copy_zip_entry(self.previous, self.zipf, text_name)
+            self.reused += 1
+            return
+
+        image_name = ''
+        if image is not None:
+            image_name = f"{question_number}.png"
+            with progress.stage('images'):
+                # Only add text if the question is not empty
+                image_data = add_text_to_image(assets.source(), question, assets.scaled()) if question.strip() != '' else assets.png()
+            with progress.stage('write'):
+                self.zipf.writestr(os.path.join(self.folder_name, image_name), image_data)
+
+        with progress.stage('text'):
+            file_content = question_text_file(question_number, question, answers, image_name)
+        with progress.stage('write'):
+            self.zipf.writestr(text_name, file_content)
+
+
+    def finish(self):
+        self.close()
+
+
+    def commit(self):
+        """Returns the new file state and the number of reused questions"""
+        super().commit()
+        return file_state(self.filename), self.reused
+
+
+    def close(self):
+        if self.zipf:
+            self.zipf.close()
+            self.zipf = None
+        if self.previous:
+            self.previous.close()
+            self.previous = None
+
+
+    def abort(self):
+        self.close()
+        super().abort()
+
+
+
+class JsonTarget(ExportTarget):
+    """
+    Web Testownik JSON, images are encoded and uploaded to imgbb on `upload_workers` threads while the bank is walked.
+    Pillow lets go of the GIL while encoding, so that runs next to the rendering of other targets.
+    """
+    def __init__(self, filename, imgbb_api_key, upload_workers=4):
+        super().__init__(filename)
+        self.imgbb_api_key = imgbb_api_key
+        self.upload_workers = upload_workers
+        self.executor = None
+        self.uploads = {}     # image identity -> future of the url, a picture used by several questions is uploaded once
+        self.questions = []   # (question data, image identity or None)
+
+
+    def begin(self, progress):
+        super().begin(progress)
+        self.executor = ThreadPoolExecutor(self.upload_workers, thread_name_prefix='imgbb')
+
+
+    def add(self, question_number, question, answers, image, assets):
+        if len(question) < 2 or len(answers) < 1: return
+
+        question_data = {
+            "question": question,
+            "answers": [],
+            "multiple": True
+        }
+
+        key = None
+        if image is not None:
+            key = image_identity(image)
+            if key not in self.uploads:
+                self.uploads[key] = self.executor.submit(self.upload, assets)
+
+        for ans, corr in answers:
+            if ans.strip() != "":
+                answer_data = {"answer": ans, "correct": corr}
+                question_data["answers"].append(answer_data)
+
+        self.questions.append((question_data, key))
+
+
+    def upload(self, assets: ImageAssets):
+        return upload_image_to_imgbb(assets.png(), self.imgbb_api_key)
+
+
+    def finish(self):
+        # uploads still running once every target went through the bank
+        with self.progress.stage('upload'):
+            pending = set(self.uploads.values())
+            while pending:
+                self.progress.check()
+                _, pending = wait(pending, timeout=0.2)
+        self.executor.shutdown()
+
+        quiz_data = {
+            "title": os.path.basename(self.filename).split('.')[0],
+            "description": "Made with Testownik Creator by *Matszwe02*",
+            "questions": []
+        }
+        for question_data, key in self.questions:
+            question_image_url = self.uploads[key].result() if key is not None else None
+            if question_image_url:
+                question_data["image"] = question_image_url
+            quiz_data["questions"].append(question_data)
+
+        with self.progress.stage('write'):
+            with open(self.filename + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(quiz_data, f, ensure_ascii=False, indent=4)
+
+
+    def abort(self):
+        if self.executor: self.executor.shutdown(wait=False, cancel_futures=True)
+        super().abort()
+
+
+def export_bank(bank, targets: list[ExportTarget], progress: ExportProgress = None):
+    """
+    Write several files walking the bank once, every image is decoded, scaled and encoded
+    once for all targets. The files are only put in place once all of them were written.
+
+    Returns:
+        list: results of the targets' `commit`, in order
+    """
+    progress = progress or ExportProgress()
+    # the assets of a picture used by several questions are kept until its last question
+    shared = SharedImages(bank)
+    started = []
+    try:
+        for target in targets:
+            target.begin(progress)
+            started.append(target)
+
+        for question_number, question, answers, image in bank:
+            progress.step('export')
+            assets = None
+            if image is not None:
+                progress.image(image)
+                assets = shared.get(image, ImageAssets)
+            for target in targets:
+                target.add(question_number, question, answers, image, assets)
+
+        for target in targets:
+            target.finish()
+        return [target.commit() for target in targets]
+    finally:
+        for target in started:
+            target.abort()
+
+
+def export_zip(filename, bank, previous_state=None, dirty=(), progress: ExportProgress = None):
+    """
+    Write the bank as a Testownik ZIP, see ZipTarget.
+
+    Returns:
+        tuple[tuple, int]: the new file state and the number of reused questions
+    """
+    return export_bank(bank, [ZipTarget(filename, previous_state, dirty)], progress)[0]
+
+
+def export_json(filename, bank, imgbb_api_key, progress: ExportProgress = None):
+    """Write the bank as web Testownik JSON, images are uploaded to imgbb"""
+    export_bank(bank, [JsonTarget(filename, imgbb_api_key)], progress)
@@ -0,0 +1,164 @@
+"""
+Latency of typing, ticking answers and moving through the question list in the real window.
+
+Runs TestownikCreator without a screen (QT_QPA_PLATFORM=offscreen) on generated banks, sends it key
+presses and mouse clicks and measures every event from sending it until the window handled it, including
+repainting and the deferred deletes of replaced widgets:
+
+    python gui_benchmark.py --sizes 1000 5000 10000
+
+Runs in a temporary folder, so the autosave journal and config.json of the app are not touched.
+"""
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import argparse, random, sys, tempfile, time
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QCoreApplication, QEvent, Qt, qInstallMessageHandler
+from PySide6.QtTest import QTest
+
+
+typed_text = "which of the following statements about the topic are true "
+
+
+def quiet_offscreen(mode, context, message):
+    # the offscreen platform warns about every window feature it lacks
+    if "This plugin does not support" not in message:
+        print(message, file=sys.stderr)
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def sample_bank(count, image_share, distinct_images=20, seed=1):
+    """Questions of random words, texts this alike would make the similarity check compare every question"""
+    from PIL import Image
+    rng = random.Random(seed)
+    # letters weighted like English text, so texts share about as many trigrams as real ones
+    letters = 'etaoinshrdlcumwfgypbvkjxqz'
+    weights = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8, 2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1]
+    vocabulary = [''.join(rng.choices(letters, weights, k=rng.randint(2, 10))) for _ in range(3000)]
+
+    def sentence(words):
+        return ' '.join(rng.choices(vocabulary, k=words)).capitalize()
+
+    questions = {i: {sentence(rng.randint(6, 18)) + '?': [(sentence(rng.randint(1, 6)), rng.random() < 0.4) for _ in range(4)]}
+                 for i in range(1, count + 1)}
+    pictures = [Image.effect_noise((640, 480), 30 + n).convert('RGB') for n in range(distinct_images)]
+    step = round(1 / image_share) if image_share > 0 else 0
+    images = {i: pictures[i % distinct_images] for i in range(1, count + 1, step)} if step else {}
+    return questions, images
+
+
+
+class EventTimer():
+    def __init__(self, app):
+        self.app = app
+
+
+    def settle(self):
+        """Handles everything the last event caused, like the event loop would before waiting for the next one"""
+        self.app.processEvents()
+        QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+        self.app.processEvents()
+
+
+    def time(self, send):
+        start = time.perf_counter()
+        send()
+        self.settle()
+        return time.perf_counter() - start
+
+
+
+def run_navigation(window, timer, events):
+    """Down arrow in the question list, every press loads the next question into the editor"""
+    window.question_list.setCurrentRow(0)
+    window.question_list.setFocus()
+    timer.settle()
+    latencies = []
+    for n in range(events):
+        if window.question_list.currentRow() == window.question_list.count() - 1:
+            window.question_list.setCurrentRow(0)
+            timer.settle()
+        latencies.append(timer.time(lambda: QTest.keyClick(window.question_list, Qt.Key_Down)))
+    return latencies
+
+
+def run_typing(window, timer, events):
+    """Typing at the end of the question text"""
+    window.question_list.setCurrentRow(window.question_list.count() // 2)
+    window.question_input.setFocus()
+    window.question_input.end(False)
+    timer.settle()
+    return [timer.time(lambda: QTest.keyClick(window.question_input, typed_text[n % len(typed_text)])) for n in range(events)]
+
+
+def run_checkboxes(window, timer, events):
+    """Clicking the correct-answer checkboxes of one question in turn"""
+    window.question_list.setCurrentRow(window.question_list.count() // 3)
+    timer.settle()
+    latencies = []
+    for n in range(events):
+        # the last field is the empty one for a new answer, and fields are replaced when the answers change
+        fields = [field for field in window.answer_fields if field.text_edit.text().strip()]
+        checkbox = fields[n % len(fields)].checkbox
+        latencies.append(timer.time(lambda: QTest.mouseClick(checkbox, Qt.LeftButton, pos=checkbox.rect().center())))
+    return latencies
+
+
+def report(name, latencies, frame_ms):
+    slow = sum(1 for latency in latencies if latency * 1000 > frame_ms)
+    print(f"  {name:12} p50 {percentile(latencies, 50) * 1000:6.1f} ms   p90 {percentile(latencies, 90) * 1000:6.1f} ms   "
+          f"p99 {percentile(latencies, 99) * 1000:6.1f} ms   max {max(latencies, default=0) * 1000:6.1f} ms   "
+          f"over {frame_ms:.0f} ms: {slow}/{len(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI interaction latency benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000], help="bank sizes to run")
+    parser.add_argument('--events', type=int, default=200, help="events of every kind per bank")
+    parser.add_argument('--images', type=float, default=0.2, help="share of questions with an image")
+    parser.add_argument('--frame-ms', type=float, default=16.7, help="latency counted as a missed frame")
+    parser.add_argument('--mode', choices=['navigate', 'type', 'check', 'all'], default='all')
+    args = parser.parse_args()
+
+    qInstallMessageHandler(quiet_offscreen)
+    app = QApplication(sys.argv)
+    import main as app_main
+    modes = {'navigate': run_navigation, 'type': run_typing, 'check': run_checkboxes}
+    modes = modes if args.mode == 'all' else {args.mode: modes[args.mode]}
+    start_folder = os.getcwd()
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            try:
+                setup_start = time.perf_counter()
+                window = app_main.TestownikCreator(restore=False)
+                window.show()
+                questions, images = sample_bank(size, args.images)
+                window.questions_list.update(questions)
+                window.images = images
+                window.bank_replaced()
+                window.update_question_list()
+                timer = EventTimer(app)
+                timer.settle()
+                print(f"\n{size} questions, {len(images)} with an image (set up in {time.perf_counter() - setup_start:.1f} s)")
+
+                for name, run in modes.items():
+                    report(name, run(window, timer, args.events), args.frame_ms)
+
+                window.close()
+                timer.settle()
+            finally:
+                os.chdir(start_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import time
+from contextlib import contextmanager
+
+from project import ProjectImages, StoredImage
+
+
+merge_seconds = 1.0  # edits of one question closer together than this are undone together, e.g. typing
+
+
+def image_ref(images, key):
+    """Image of a question for the history: the stored row of a project image that was not replaced since loading, else the image object"""
+    if isinstance(images, ProjectImages):
+        if key in images.pending:
+            return StoredImage(images.project.path, images.pending[key])
+        known = images.project.known_hashes.get(key)
+        if known and key in images.loaded and known[0] is images.loaded[key]:
+            return StoredImage(images.project.path, known[1])
+    return images[key] if key in images else None
+
+
+def same_image(a, b):
+    if isinstance(a, StoredImage) and isinstance(b, StoredImage):
+        return a.path == b.path and a.hash == b.hash
+    return a is b
+
+
+def same_state(a, b):
+    if a is None or b is None: return a is b
+    return a[0] == b[0] and a[1] == b[1] and same_image(a[2], b[2])
+
+
+def restore_image(images, key, image):
+    """Put a history image back into the bank, a stored row of the open project without decoding it"""
+    if image is None:
+        images.pop(key, None)
+    elif isinstance(image, StoredImage):
+        if isinstance(images, ProjectImages) and images.project.path == image.path:
+            images.loaded.pop(key, None)
+            images.pending[key] = image.hash
+        else:
+            images[key] = image.load()
+    else:
+        images[key] = image
+
+
+
+class EditHistory():
+    """
+    Undo and redo of question edits.
+
+    Every step keeps the states before and after of only the questions it changed. A state is
+    (question, answers, image) referencing the strings and image objects of the bank, images of
+    a project by their stored hash, so the history never copies the bank: it grows with the edits,
+    and undoing a step only touches the questions in it.
+    """
+    def __init__(self):
+        self.known = {}          # id -> state as of the last change seen, what the next change is undone to
+        self.undo_steps = []     # [{id: [before, after]}]
+        self.redo_steps = []
+        self.grouping = 0
+        self.group_step = None
+        self.last_change = 0.0
+
+
+    def state(self, questions_list: dict, images, key):
+        if key not in questions_list: return None
+        question, answers = list(questions_list[key].items())[0]
+        # answers lists are appended to in place, the tuple only copies the references to their strings
+        return (question, tuple(answers), image_ref(images, key))
+
+
+    def reset(self, questions_list: dict, images):
+        """Start over from this bank, e.g. after an import"""
+        self.known = {key: self.state(questions_list, images, key) for key in questions_list}
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+        self.group_step = None
+
+
+    @contextmanager
+    def group(self):
+        """All changes made inside are undone as one step"""
+        self.grouping += 1
+        try:
+            yield
+        finally:
+            self.grouping -= 1
+            if not self.grouping: self.group_step = None
+
+
+    def changed(self, key, questions_list: dict, images):
+        """Call after a question was changed, added or removed"""
+        after = self.state(questions_list, images, key)
+        before = self.known.get(key)
+        if same_state(before, after): return
+        self.known[key] = after
+        self.redo_steps.clear()
+
+        now = time.monotonic()
+        if self.grouping:
+            if self.group_step is None:
+                self.group_step = {}
+                self.undo_steps.append(self.group_step)
+            step = self.group_step
+        elif self.undo_steps and self.undo_steps[-1].keys() == {key} and now - self.last_change < merge_seconds:
+            step = self.undo_steps[-1]
+        else:
+            step = {}
+            self.undo_steps.append(step)
+        self.last_change = now
+
+        if key in step:
+            step[key][1] = after
+        else:
+            step[key] = [before, after]
+
+
+    def stored_hashes(self, path):
+        """Hashes of images of the project at `path` that undo or redo may still put back"""
+        return {state[2].hash for step in self.undo_steps + self.redo_steps for states in step.values() for state in states
+                if state and isinstance(state[2], StoredImage) and state[2].path == path}
+
+
+    def undo(self):
+        """States to put back, None when there is nothing to undo"""
+        if not self.undo_steps: return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        self.last_change = 0.0
+        return self._move(step, 0)
+
+
+    def redo(self):
+        if not self.redo_steps: return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        self.last_change = 0.0
+        return self._move(step, 1)
+
+
+    def _move(self, step, side):
+        states = {key: states[side] for key, states in step.items()}
+        self.known.update(states)
+        return states
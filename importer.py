@@ -0,0 +1,615 @@
+"""
+Import of Testownik ZIP and web Testownik JSON banks, plain text documents of questions,
+and merging of several banks into one.
+
+JSON files are parsed incrementally, one question object at a time, so huge banks are
+never held in memory as a single JSON document. Referenced images are downloaded
+concurrently while parsing continues, through one pooled HTTP session backed by an
+on-disk cache, so importing the same bank again does not hit the network.
+"""
+import hashlib, io, json, os, re, zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image
+
+from exporter import remove_text_area
+from project import ingest_image, shared_images
+from shards import file_digest, manifest_suffix, read_manifest
+from similarity import SimilarityIndex, string_similarity
+
+
+duplicate_limit = 0.95  # question similarity from which questions with the same answers are merged
+duplicate_dice = 0.75   # trigram overlap a question needs before its text is compared at all
+
+
+class JsonStream():
+    """Minimal incremental reader for the top level of a JSON document"""
+    whitespace = ' \t\r\n'
+    number_chars = '0123456789.eE+-'
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+
+    def fill(self):
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+
+    def peek(self):
+        """Next non-whitespace character, '' at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer): return self.buffer[self.pos]
+            if self.eof: return ''
+            self.fill()
+
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at position {self.pos} of the buffer, got '{self.peek()}'")
+        self.pos += 1
+
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number cut by the end of the chunk (like "1." or "1e") decodes as a shorter one,
+                # it is only complete when followed by something that can't continue it
+                if self.eof or (end < len(self.buffer) and self.buffer[end] not in self.number_chars):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof: raise
+            self.fill()
+
+
+    def iter_object(self):
+        """Yield the keys of the object at the current position, the caller has to consume each value"""
+        self.expect('{')
+        while self.peek() != '}':
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',': self.pos += 1
+        self.pos += 1
+
+
+    def iter_array(self):
+        self.expect('[')
+        while self.peek() != ']':
+            if self.peek() == '': raise ValueError("Unexpected end of file inside an array")
+            yield self.value()
+            if self.peek() == ',': self.pos += 1
+        self.pos += 1
+
+
+
+def iter_json_questions(fp):
+    """Yield the question objects of a web Testownik JSON file one by one"""
+    stream = JsonStream(fp)
+    for key in stream.iter_object():
+        if key == 'questions':
+            yield from stream.iter_array()
+        else:
+            stream.value()
+
+
+
+class ImageFetcher():
+    """Downloads images through one pooled HTTP session, with an on-disk cache"""
+    def __init__(self, cache_dir=os.path.join('cache', 'images'), workers=8, timeout=30):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(workers)
+        self.futures = {}  # url -> future of its image
+
+
+    def cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+
+    def fetch(self, url):
+        path = self.cache_path(url)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read()
+
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.content
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        return data
+
+
+    def fetch_image(self, url):
+        return shared_images.share(Image.open(io.BytesIO(self.fetch(url))))
+
+
+    def submit(self, url):
+        # questions reusing an image URL share one download
+        if url not in self.futures:
+            self.futures[url] = self.executor.submit(self.fetch_image, url)
+        return self.futures[url]
+
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+
+def import_json(filename, fetcher: ImageFetcher = None, job=None):
+    """
+    Read a web Testownik JSON bank.
+
+    Returns:
+        tuple[dict, dict, list[str]]: questions_list, images and error messages of images that failed to load
+    """
+    own_fetcher = fetcher is None
+    fetcher = fetcher or ImageFetcher()
+    questions_list = {}
+    downloads = {}
+    errors = []
+
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for question_data in iter_json_questions(f):
+                if job and job.cancelled: return {}, {}, []
+                if not isinstance(question_data, dict): continue
+
+                question_id = len(questions_list) + 1
+                answers = [(str(answer.get('answer', '')).strip(), bool(answer.get('correct', False)))
+                           for answer in question_data.get('answers', []) if isinstance(answer, dict)]
+                questions_list[question_id] = {str(question_data.get('question', '')).strip(): answers}
+
+                # downloads run while the rest of the file is parsed
+                if question_data.get('image'):
+                    downloads[question_id] = (question_data['image'], fetcher.submit(question_data['image']))
+                if job and question_id % 100 == 0: job.report(question_id, 0, 'parse')
+
+        images = {}
+        for done, (question_id, (url, future)) in enumerate(downloads.items(), 1):
+            if job and job.cancelled: return {}, {}, []
+            try:
+                images[question_id] = future.result()
+            except Exception as e:
+                errors.append(f"[{question_id}] {url}: {str(e)}")
+            if job: job.report(done, len(downloads), 'images')
+        return questions_list, images, errors
+    finally:
+        if own_fetcher: fetcher.close()
+
+
+
+def decode_text(content: bytes):
+    # Try to decode with utf-8 and fallback to iso-8859-1
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        try:
+            return content.decode('windows-1250')
+        except UnicodeDecodeError:
+            return content.decode('iso-8859-1')
+
+
+def parse_question_file(text: str):
+    """Question and answers of a Testownik .txt file, None if it is not one"""
+    lines = text.strip().split('\n')
+    if len(lines) < 3: return None
+    
+    # Extract correct answers
+    correct_answers = []
+    if lines[0].startswith('X'):
+        correct_answers = [int(x) for x in (lines[0][1:]).strip()]
+    
+    # Find the question line and check for image reference
+    question = lines[1].split('[/img]')[-1].strip()
+    
+    # Extract answers
+    answers = []
+    for i, line in enumerate(lines[2:]):
+        if line.strip():
+            answers.append((line.strip(), (correct_answers[i] == 1) if (len(correct_answers) >= i+1) else False))
+    return question, answers
+
+
+# "12." or "12)" starts a question, "a)", "b." or a bullet an answer, "[v]" / "[x]" marks it correct or not
+text_question = re.compile(r"^\s*\d+\s*[.)]\s+")
+text_answer = re.compile(r"^\s*(?:(?:[a-zA-Z][.)]|[•\-–*])\s+)?\[(?P<mark>[vVxX])\]\s*|^\s*(?:(?P<letter>[a-zA-Z])\.|[a-zA-Z]\)|[•\-–*])\s+")
+
+
+def clean_text(text: str):
+    return ' '.join(text.replace('•', '').split())
+
+
+def answer_marker(line, answers):
+    """Match of the answer marker of a line, `answers` is how many answers the question has so far"""
+    match = text_answer.match(line)
+    # "a." could as well be an abbreviation like "E. coli", so it only counts when the answers go a, b, c...
+    if match and match['letter'] and match['letter'].lower() != chr(ord('a') + answers): return None
+    return match
+
+
+def many_questions(lines):
+    """Whether pasted lines are a numbered document of questions rather than a single question and its answers"""
+    return sum(1 for line in lines if text_question.match(line)) > 1
+
+
+def parse_text_questions(lines):
+    """
+    Split a text document into questions, in one pass over its lines.
+
+    Numbered lines start a question and lines with a letter, bullet or [v] / [x] mark are its answers,
+    any other line continues the question or answer above it. A plain line after a blank line starts
+    a new question, so without numbering the questions are blocks separated by blank lines, where
+    every line after the first one is an answer, like in the multiline paste.
+
+    Yields:
+        tuple[str, list[tuple[str, bool]]]: question and answers
+    """
+    question = None
+    answers = []
+    numbered = False  # the question was numbered, so its text may go on over several lines
+    marked = False    # answers came with markers, so plain lines continue the last one
+    gap = False       # blank line after the question or its answers
+    for line in lines:
+        text = line.strip()
+        if not text:
+            gap = question is not None and (answers or not numbered)
+            continue
+
+        match = text_question.match(line)
+        if match:
+            if question is not None: yield question, answers
+            question, answers, numbered, marked, gap = clean_text(line[match.end():]), [], True, False, False
+            continue
+
+        match = answer_marker(line, len(answers))
+        if gap and not match:
+            yield question, answers
+            question = None
+        gap = False
+        if question is None:
+            question, answers, numbered, marked = clean_text(text), [], False, False
+        elif match:
+            answers.append((clean_text(line[match.end():]), (match['mark'] or '').lower() == 'v'))
+            marked = True
+        elif numbered and not answers:
+            question += ' ' + clean_text(text)
+        elif marked:
+            answers[-1] = (answers[-1][0] + ' ' + clean_text(text), answers[-1][1])
+        else:
+            answers.append((clean_text(text), False))
+    if question is not None: yield question, answers
+
+
+def import_text(filename, job=None):
+    """
+    Read a text document of questions, see `parse_text_questions`.
+
+    Returns:
+        tuple[dict, dict, list[str]]: questions_list, images (always none) and errors
+    """
+    with open(filename, 'rb') as f:
+        text = decode_text(f.read())
+    questions_list = {}
+    for question, answers in parse_text_questions(text.splitlines()):
+        if job and job.cancelled: return {}, {}, []
+        questions_list[len(questions_list) + 1] = {question: answers}
+    return questions_list, {}, []
+
+
+image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+
+def image_files(paths):
+    """Image files among the given files and folders (searched recursively), in natural name order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, names in os.walk(path):
+                files += [os.path.join(folder, name) for name in names if name.lower().endswith(image_extensions)]
+        elif path.lower().endswith(image_extensions):
+            files.append(path)
+    # "shot 2" before "shot 10"
+    return sorted(files, key=lambda path: [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', path)])
+
+
+def load_image_file(path, prepare=None):
+    image = shared_images.share(ingest_image(Image.open(path)))
+    if prepare: prepare(image)
+    return image
+
+
+def import_images(paths, job=None, workers=4, prepare=None):
+    """
+    Decode the images among the given files and folders in parallel, for one new question each.
+
+    `prepare` is called with every image on the worker that decoded it.
+
+    Returns:
+        tuple[list[tuple[str, Image]], list[str]]: (path, image) in name order and error messages
+    """
+    files = image_files(paths)
+    loaded = []
+    errors = []
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(load_image_file, path, prepare) for path in files]
+        for done, (path, future) in enumerate(zip(files, futures), 1):
+            if job and job.cancelled:
+                executor.shutdown(wait=False, cancel_futures=True)
+                return [], []
+            try:
+                loaded.append((path, future.result()))
+            except Exception as e:
+                errors.append(f"{os.path.basename(path)}: {str(e)}")
+            if job: job.report(done, len(files), 'images')
+    return loaded, errors
+
+
+def import_zip(filename, job=None):
+    """
+    Read a Testownik ZIP, images get the question text added by the export cut off again.
+
+    Returns:
+        tuple[dict, dict, list[str]]: questions_list, images and error messages of files that failed to load
+    """
+    questions_list = {}
+    images = {}
+    errors = []
+
+    with zipfile.ZipFile(filename, 'r') as zip_ref:
+        # First pass: Process text files to get questions and answers
+        for file_info in zip_ref.infolist():
+            if job and job.cancelled: return {}, {}, []
+            if file_info.filename.endswith('.txt'):
+                try:
+                    # Get question ID from filename (assuming format like "1.txt")
+                    question_id = int(os.path.splitext(os.path.basename(file_info.filename))[0])
+                    with zip_ref.open(file_info) as file:
+                        parsed = parse_question_file(decode_text(file.read()))
+                    if parsed:
+                        question, answers = parsed
+                        questions_list[question_id] = {question: answers}
+                except Exception as e:
+                    errors.append(f"{file_info.filename}: {str(e)}")
+
+        # Second pass: Process image files
+        for file_info in zip_ref.infolist():
+            if job and job.cancelled: return {}, {}, []
+            if file_info.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+                try:
+                    # Get question ID from filename (assuming format like "1.png")
+                    question_id = int(os.path.splitext(os.path.basename(file_info.filename))[0])
+                    with zip_ref.open(file_info) as image_file:
+                        image = Image.open(io.BytesIO(image_file.read()))
+                        image.load()
+
+                    # If this question has text, remove the text area from the image
+                    if question_id in questions_list:
+                        question = list(questions_list[question_id].keys())[0]
+                        if question.strip():
+                            image = remove_text_area(image, question)
+
+                    images[question_id] = shared_images.share(image)
+                except Exception as e:
+                    errors.append(f"{file_info.filename}: {str(e)}")
+
+    return questions_list, images, errors
+
+
+def import_manifest(filename, job=None):
+    """
+    Read the shards listed in a manifest of `shards.export_sharded` back into one bank. Questions keep their ids
+    where the shards have them (ZIP), the others are numbered on after the last one.
+
+    Returns:
+        tuple[dict, dict, list[str]]: questions_list, images and error messages, of missing or changed shards too
+    """
+    manifest = read_manifest(filename)
+    folder = os.path.dirname(os.path.abspath(filename))
+    questions_list = {}
+    images = {}
+    errors = []
+    for shard in manifest.get('shards', []):
+        if job and job.cancelled: return {}, {}, []
+        files = shard.get('files', {})
+        # the ZIP has the images itself and the ids of the questions, JSON images would have to be downloaded
+        kind = 'zip' if 'zip' in files else 'json'
+        if kind not in files: continue
+        path = os.path.join(folder, os.path.basename(files[kind]))
+        if not os.path.exists(path):
+            errors.append(f"{files[kind]}: missing")
+            continue
+        expected = shard.get('sha256', {}).get(kind)
+        if expected and file_digest(path) != expected:
+            errors.append(f"{files[kind]}: changed since the export, imported anyway")
+        try:
+            shard_questions, shard_images, shard_errors = import_bank(path, job)
+        except Exception as e:
+            errors.append(f"{files[kind]}: {str(e)}")
+            continue
+        errors += [f"{files[kind]}: {error}" for error in shard_errors]
+        next_id = max(questions_list.keys(), default=0) + 1
+        for question_id in sorted(shard_questions):
+            new_id = question_id
+            if new_id in questions_list:
+                new_id = next_id
+            next_id = max(next_id, new_id + 1)
+            questions_list[new_id] = shard_questions[question_id]
+            if question_id in shard_images: images[new_id] = shard_images[question_id]
+    return questions_list, images, errors
+
+
+def import_bank(filename, job=None):
+    if filename.lower().endswith(manifest_suffix):
+        return import_manifest(filename, job)
+    if filename.lower().endswith('.json'):
+        return import_json(filename, job=job)
+    if filename.lower().endswith('.txt'):
+        return import_text(filename, job)
+    return import_zip(filename, job)
+
+
+
+def normalize(text: str):
+    return ' '.join(text.lower().split())
+
+
+def answers_key(answers):
+    return tuple(sorted((normalize(answer), bool(correct)) for answer, correct in answers if answer.strip()))
+
+
+def question_key(question, answers):
+    return hashlib.blake2b(repr((normalize(question), answers_key(answers))).encode('utf-8'), digest_size=16).digest()
+
+
+
+class BankMerger():
+    """
+    Adds questions from other banks under new ids, collapsing duplicates on the way.
+
+    Exact duplicates (same question and answers, ignoring case, whitespace and answer
+    order) are found with one hash lookup. Near duplicates need the same answers and a
+    question text similarity of `duplicate_limit`, and only questions found through the
+    trigram index are compared. Two questions that both have an image are never merged,
+    as the image may be what tells them apart.
+    """
+    def __init__(self, existing=(), existing_images=(), next_id=1):
+        """`existing` holds (id, question, answers, trigrams or None) of the bank merged into"""
+        self.index = SimilarityIndex()
+        self.exact = {}        # question key -> id
+        self.answers = {}      # id -> answers key
+        self.by_answers = {}   # answers key -> ids, near duplicates can only be found among these
+        self.with_image = set(existing_images)
+        self.next_id = next_id
+        self.questions_list = {}
+        self.images = {}       # images of new questions, and of existing ones that had none
+        self.duplicates = []   # (source, source id, question, kept id, similarity)
+        self.errors = []
+        for question_id, question, answers, grams in existing:
+            self.remember(question_id, question, answers, grams)
+
+
+    def remember(self, question_id, question, answers, grams=None):
+        self.exact.setdefault(question_key(question, answers), question_id)
+        key = answers_key(answers)
+        self.answers[question_id] = key
+        if normalize(question):
+            self.by_answers.setdefault(key, []).append(question_id)
+            self.index.set(question_id, question, grams)
+
+
+    def find_duplicate(self, question, answers, has_image):
+        """(id, similarity) of the question the given one duplicates, or None"""
+        if not normalize(question): return None
+        usable = lambda question_id: not (has_image and question_id in self.with_image)
+
+        question_id = self.exact.get(question_key(question, answers))
+        if question_id is not None and usable(question_id): return question_id, 1.0
+
+        # only questions with the same answers count, for generic answers (true / false...) the trigram index narrows them down
+        key = answers_key(answers)
+        candidates = self.by_answers.get(key, [])
+        if len(candidates) > 64:
+            candidates = [question_id for question_id in self.index.candidates(question, duplicate_limit, dice=duplicate_dice)
+                          if self.answers[question_id] == key]
+
+        best = None
+        for question_id in candidates:
+            if not usable(question_id): continue
+            other = self.index.entries[question_id][0]
+            # upper bound of the similarity from the lengths alone
+            if 2 * min(len(question), len(other)) / (len(question) + len(other)) < duplicate_limit: continue
+            similarity = string_similarity(question, other)
+            if similarity >= duplicate_limit and (best is None or similarity > best[1]):
+                best = (question_id, similarity)
+        return best
+
+
+    def add(self, source, source_id, question, answers, image=None):
+        duplicate = self.find_duplicate(question, answers, image is not None)
+        if duplicate:
+            question_id, similarity = duplicate
+            self.duplicates.append((source, source_id, question, question_id, similarity))
+            if image is not None and question_id not in self.with_image:
+                self.images[question_id] = image
+                self.with_image.add(question_id)
+            return question_id
+
+        question_id = self.next_id
+        self.next_id += 1
+        self.questions_list[question_id] = {question: answers}
+        if image is not None:
+            self.images[question_id] = image
+            self.with_image.add(question_id)
+        self.remember(question_id, question, answers)
+        return question_id
+
+
+    def add_bank(self, source, questions_list: dict, images: dict, job=None):
+        for done, (source_id, question_data) in enumerate(questions_list.items(), 1):
+            question, answers = list(question_data.items())[0]
+            self.add(source, source_id, question, answers, images.get(source_id))
+            if job and done % 500 == 0:
+                if job.cancelled: return
+                job.report(done, len(questions_list), 'merge')
+
+
+    def report(self):
+        lines = [f"{len(self.questions_list)} questions added, {len(self.duplicates)} duplicates merged"]
+        for source, source_id, question, question_id, similarity in self.duplicates:
+            lines.append(f"{os.path.basename(source)} [{source_id}] -> [{question_id}] ({similarity:.0%}): {question}")
+        lines += self.errors
+        return "\n".join(lines)
+
+
+
+def merge_banks(filenames, existing=(), existing_images=(), next_id=1, job=None, workers=4):
+    """
+    Read several banks in parallel and merge them, in the given order, into one.
+
+    Returns:
+        BankMerger: the new questions and images, and the report of what was merged
+    """
+    merger = BankMerger(existing, existing_images, next_id)
+    with ThreadPoolExecutor(max(1, min(workers, len(filenames)))) as executor:
+        futures = [executor.submit(import_bank, filename) for filename in filenames]
+        for done, (filename, future) in enumerate(zip(filenames, futures), 1):
+            try:
+                questions_list, images, errors = future.result()
+            except Exception as e:
+                merger.errors.append(f"{os.path.basename(filename)}: {str(e)}")
+                continue
+            if job and job.cancelled:
+                for future in futures: future.cancel()
+                return merger
+            merger.errors += [f"{os.path.basename(filename)}: {error}" for error in errors]
+            merger.add_bank(filename, questions_list, images, job)
+            if job: job.report(done, len(filenames), 'files')
+    return merger
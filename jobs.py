@@ -0,0 +1,126 @@
+import traceback
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+
+
+class JobSignals(QObject):
+    finished = Signal(object, object)          # job, result
+    failed = Signal(object, str)               # job, traceback
+    progress = Signal(object, int, int, str)   # job, done, total, stage
+
+
+class Job(QRunnable):
+    """Runs `function(*args, **kwargs)` on a pool thread and reports back through signals"""
+    def __init__(self, key, function, *args, **kwargs):
+        super().__init__()
+        # the manager keeps a reference until the job reports back
+        self.setAutoDelete(False)
+        self.key = key
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = JobSignals()
+
+
+    def report(self, done, total, stage=''):
+        """Can be called from inside `function` to publish progress"""
+        if not self.cancelled:
+            self.signals.progress.emit(self, done, total, stage)
+
+
+    def run(self):
+        try:
+            result = self.function(*self.args, **self.kwargs)
+        except Exception:
+            self.signals.failed.emit(self, traceback.format_exc())
+            return
+        self.signals.finished.emit(self, result)
+
+
+
+class JobManager(QObject):
+    """
+    Keeps track of background jobs by key (e.g. question id).
+
+    Callbacks are always invoked on the GUI thread, so they may freely touch widgets
+    and the question bank. A cancelled job still runs to completion (a blocking network
+    call cannot be interrupted), but its result is silently dropped.
+    """
+    def __init__(self, parent=None, max_threads=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self.jobs = {}
+        self.callbacks = {}  # also keeps cancelled jobs alive until their thread is done with them
+
+
+    def start(self, key, function, *args, on_finished=None, on_failed=None, on_progress=None, priority=0, pass_job=False, cancellable=True, **kwargs):
+        """
+        Start `function` in the pool, `pass_job` hands the Job to it as `job=` for progress and cancellation checks.
+
+        Jobs started with `cancellable=False` are left alone by `cancel_all`, for work that must not be dropped.
+        """
+        self.cancel(key)
+        job = Job(key, function, *args, **kwargs)
+        job.cancellable = cancellable
+        if pass_job: job.kwargs['job'] = job
+        job.signals.finished.connect(self._finished)
+        job.signals.failed.connect(self._failed)
+        job.signals.progress.connect(self._progress)
+        self.jobs[key] = job
+        self.callbacks[job] = (on_finished, on_failed, on_progress)
+        self.pool.start(job, priority)
+        return job
+
+
+    def is_running(self, key):
+        return key in self.jobs
+
+
+    def cancel(self, key):
+        job = self.jobs.pop(key, None)
+        if job is None: return False
+        job.cancelled = True
+        # drop it from the queue if it did not start yet
+        if self.pool.tryTake(job):
+            self.callbacks.pop(job, None)
+        return True
+
+
+    def wait(self, timeout_ms=-1):
+        return self.pool.waitForDone(timeout_ms)
+
+
+    def cancel_all(self):
+        for key, job in list(self.jobs.items()):
+            if job.cancellable: self.cancel(key)
+
+
+    def _release(self, job):
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        callbacks = self.callbacks.pop(job, (None, None, None))
+        if job.cancelled: return (None, None, None)
+        return callbacks
+
+
+    @Slot(object, object)
+    def _finished(self, job, result):
+        on_finished, _, _ = self._release(job)
+        if on_finished: on_finished(job.key, result)
+
+
+    @Slot(object, str)
+    def _failed(self, job, error):
+        _, on_failed, _ = self._release(job)
+        if on_failed: on_failed(job.key, error)
+        elif not job.cancelled: print(f"Background job {job.key} failed:\n{error}")
+
+
+    @Slot(object, int, int, str)
+    def _progress(self, job, done, total, stage):
+        if job.cancelled: return
+        on_progress = self.callbacks.get(job, (None, None, None))[2]
+        if on_progress: on_progress(job.key, done, total, stage)
@@ -0,0 +1,279 @@
+import hashlib, io, json, os, threading
+
+from project import StoredImage, peek_image, shared_images
+
+
+class EditJournal():
+    """
+    Crash-safe autosave.
+
+    Every committed edit appends one line to `journal.jsonl`, so the cost of a save
+    depends on the size of the edit, not on the size of the bank. From time to time
+    the journal is compacted into `snapshot.json`. Images are stored once per content
+    hash in `images/` and only referenced from the journal and snapshot.
+
+    Compaction runs in two steps, so the slow part can run on a worker thread: `capture`
+    copies the bank and moves the journal aside to `journal.old.jsonl`, `write_snapshot`
+    writes the snapshot and then drops the old journal. Entries hold the whole state of a
+    question, so replaying an old journal again on top of a newer snapshot is harmless.
+
+    A clean exit leaves a `clean` marker, so only a crash makes the next start ask
+    whether to restore the session.
+
+    When editing a project file, the snapshot only holds the questions changed since
+    the project was last saved, and names the project as its base.
+    """
+    def __init__(self, folder='autosave'):
+        self.folder = folder
+        self.journal_path = os.path.join(folder, 'journal.jsonl')
+        self.old_journal_path = os.path.join(folder, 'journal.old.jsonl')
+        self.snapshot_path = os.path.join(folder, 'snapshot.json')
+        self.clean_path = os.path.join(folder, 'clean')
+        self.images_folder = os.path.join(folder, 'images')
+        self.file = None
+        self.entries = 0
+        self.image_hashes = {}  # question id -> (image object, hash), avoids encoding unchanged images again
+        self.object_hashes = {}  # id(image) -> (image object, hash), for images shared between questions
+        self.replayed_ids = set()
+        self.lock = threading.Lock()
+        self.compacting = False
+
+
+    def has_session(self):
+        for path in (self.snapshot_path, self.old_journal_path, self.journal_path):
+            if os.path.exists(path) and os.path.getsize(path) > 0: return True
+        return False
+
+
+    def was_clean(self):
+        return os.path.exists(self.clean_path)
+
+
+    def set_clean(self, clean=True):
+        if clean:
+            os.makedirs(self.folder, exist_ok=True)
+            open(self.clean_path, 'w').close()
+        elif os.path.exists(self.clean_path):
+            os.remove(self.clean_path)
+
+
+    def store_image(self, question_id, image):
+        if image is None: return None
+        with self.lock:
+            for cached in (self.image_hashes.get(question_id), self.object_hashes.get(id(image))):
+                if cached and cached[0] is image:
+                    self.image_hashes[question_id] = cached
+                    return cached[1]
+
+        data = None
+        if isinstance(image, StoredImage):
+            # project images are hashed the same way, the file only has to be copied if it is missing
+            image_hash = image.hash
+        else:
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            data = buffer.getvalue()
+            image_hash = hashlib.sha256(data).hexdigest()
+
+        path = os.path.join(self.images_folder, f"{image_hash}.png")
+        if not os.path.exists(path):
+            if data is None: data = image.data()
+            os.makedirs(self.images_folder, exist_ok=True)
+            with open(f"{path}.{threading.get_ident()}.tmp", 'wb') as f:
+                f.write(data)
+            os.replace(f"{path}.{threading.get_ident()}.tmp", path)
+        with self.lock:
+            self.object_hashes[id(image)] = (image, image_hash)
+            if question_id is not None: self.image_hashes[question_id] = (image, image_hash)
+        return image_hash
+
+
+    def prepare_image(self, image):
+        """Write an image before its question is journaled, so a worker thread does the encoding instead of the GUI"""
+        self.store_image(None, image)
+
+
+    def append(self, entries: list[dict]):
+        if not entries: return
+        with self.lock:
+            if self.file is None:
+                os.makedirs(self.folder, exist_ok=True)
+                self.file = open(self.journal_path, 'a', encoding='utf-8')
+            self.file.write("".join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.entries += len(entries)
+
+
+    def capture(self, questions_list: dict, images, question_ids):
+        """Copy of the given questions to journal with `entries_for`, without touching any image data"""
+        captured = []
+        for question_id in question_ids:
+            if question_id in questions_list:
+                question, answers = list(questions_list[question_id].items())[0]
+                captured.append((question_id, question, list(answers), peek_image(images, question_id)))
+            else:
+                captured.append((question_id, None, None, None))
+        return captured
+
+
+    def entries_for(self, captured):
+        entries = []
+        for question_id, question, answers, image in captured:
+            if question is not None:
+                entries.append({"op": "set", "id": question_id, "question": question, "answers": answers, "image": self.store_image(question_id, image)})
+            else:
+                with self.lock:
+                    self.image_hashes.pop(question_id, None)
+                entries.append({"op": "remove", "id": question_id})
+        return entries
+
+
+    def record(self, questions_list: dict, images, question_ids):
+        """Append the current state of the given questions (or their removal) to the journal"""
+        self.append(self.entries_for(self.capture(questions_list, images, question_ids)))
+
+
+    def start_compaction(self, questions_list: dict, images, question_ids=None):
+        """
+        First, quick part of compacting: copy the bank (or only `question_ids`) and move the journal aside.
+
+        Returns:
+            list: what `write_snapshot` needs, which may run on another thread
+        """
+        with self.lock:
+            self.compacting = True
+            if self.file:
+                self.file.close()
+                self.file = None
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.old_journal_path):
+                    # left over from a compaction that never finished, keep both in order
+                    with open(self.journal_path, 'r', encoding='utf-8') as source, open(self.old_journal_path, 'a', encoding='utf-8') as target:
+                        target.write(source.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.old_journal_path)
+            self.entries = 0
+        return self.capture(questions_list, images, questions_list.keys() if question_ids is None else sorted(question_ids))
+
+
+    def write_snapshot(self, captured, question_no=0, base=None):
+        """Compact the journal into a fresh snapshot of a `start_compaction` copy, on top of the `base` project if given"""
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            snapshot = {
+                "base": base,
+                "question_no": question_no,
+                "questions": self.entries_for(captured)
+            }
+            with open(self.snapshot_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+
+            with self.lock:
+                # everything in the old journal is part of the snapshot now
+                if os.path.exists(self.old_journal_path): os.remove(self.old_journal_path)
+                # images of edits journaled since the copy was taken are still needed
+                used = {entry["image"] for entry in snapshot["questions"] if entry.get("image")}
+                used |= {image_hash for _, image_hash in self.image_hashes.values()}
+                # and let go of images no question uses anymore
+                self.object_hashes = {id(image): (image, image_hash) for image, image_hash in self.image_hashes.values()}
+
+            # drop images nobody refers to anymore
+            if os.path.isdir(self.images_folder):
+                for name in os.listdir(self.images_folder):
+                    if name.endswith('.png') and name[:-4] not in used:
+                        os.remove(os.path.join(self.images_folder, name))
+        finally:
+            self.compacting = False
+
+
+    def replay(self, open_base=None):
+        """
+        Rebuild the bank from the snapshot and the journal.
+
+        Args:
+            open_base (callable): opens the base project of the snapshot, returns (questions_list, images)
+
+        Returns:
+            tuple[dict, dict, int, str]: questions_list, images, the selected question id and the base project path
+        """
+        questions_list = {}
+        images = {}
+        image_hashes = {}
+        question_no = 0
+        base = None
+
+        self.replayed_ids = set()
+
+        def apply(entry):
+            question_id = int(entry["id"])
+            self.replayed_ids.add(question_id)
+            images.pop(question_id, None)
+            image_hashes.pop(question_id, None)
+            if entry["op"] == "remove":
+                questions_list.pop(question_id, None)
+            elif entry["op"] == "set":
+                questions_list[question_id] = {entry["question"]: [(answer, bool(correct)) for answer, correct in entry["answers"]]}
+                if entry.get("image"): image_hashes[question_id] = entry["image"]
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            question_no = snapshot.get("question_no", 0)
+            base = snapshot.get("base")
+            if base and open_base:
+                questions_list, images = open_base(base)
+            for entry in snapshot.get("questions", []):
+                apply(entry)
+
+        for path in (self.old_journal_path, self.journal_path):
+            if not os.path.exists(path): continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be cut short by a crash
+                        print(f"Skipping damaged journal entry: {line[:80]!r}")
+                        continue
+                    apply(entry)
+                    self.entries += 1
+
+        from PIL import Image
+        decoded = {}  # hash -> image, questions sharing a picture share the image
+        for question_id, image_hash in image_hashes.items():
+            if question_id not in questions_list: continue
+            if image_hash not in decoded:
+                try:
+                    decoded[image_hash] = shared_images.share(Image.open(os.path.join(self.images_folder, f"{image_hash}.png")))
+                except Exception as e:
+                    print(f"Failed to restore image of question {question_id}: {str(e)}")
+                    continue
+            images[question_id] = image = decoded[image_hash]
+            self.image_hashes[question_id] = self.object_hashes[id(image)] = (image, image_hash)
+
+        if question_no not in questions_list and questions_list:
+            question_no = list(questions_list.keys())[0]
+        return questions_list, images, question_no, base
+
+
+    def discard(self):
+        self.close()
+        self.entries = 0
+        self.image_hashes.clear()
+        for path in (self.journal_path, self.old_journal_path, self.snapshot_path, self.clean_path):
+            if os.path.exists(path): os.remove(path)
+        if os.path.isdir(self.images_folder):
+            for name in os.listdir(self.images_folder):
+                os.remove(os.path.join(self.images_folder, name))
+
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
@@ -1,6 +1,103 @@
 import json
-import openai
 import os
+import threading
+import time
+
+from endpoints import FinalError, Router
+
+
+answer_tokens = 25  # rough guess of the tokens one generated answer takes
+prompt_token_budget = 1500   # question and answers of one question in a prompt, the rest is left out
+question_token_limit = 500   # longer questions are cut in the middle
+answer_token_limit = 100     # and longer answers at the end
+
+
+def estimate_tokens(text: str):
+    """Rough token count, good enough for packing batches"""
+    return len(text) // 4 + 1
+
+
+def format_answers(input_answers: list[tuple[str, bool]]):
+    return "".join(f"[{'v' if answer[1] else 'x'}] {answer[0]}\n" for answer in input_answers)
+
+
+def shorten(text: str, tokens: int, keep_end=False):
+    """Text cut to about `tokens` tokens at a space, keeping the end too if `keep_end`, questions tend to end with the actual question"""
+    if estimate_tokens(text) <= tokens: return text
+    chars = tokens * 4
+    if not keep_end:
+        return text[:chars].rsplit(' ', 1)[0] + " …"
+    head = text[:chars * 2 // 3].rsplit(' ', 1)[0]
+    tail = text[-(chars // 3):].split(' ', 1)[-1]
+    return f"{head} … {tail}"
+
+
+def fit_prompt(question: str, input_answers: list[tuple[str, bool]], budget=prompt_token_budget):
+    """
+    Question and answers shortened to fit into `budget` tokens. Correct answers always go in, shortened
+    further when they do not fit otherwise, incorrect ones while they fit, in their original order.
+
+    Returns:
+        tuple[str, list, int]: question, answers, number of incorrect answers left out
+    """
+    question = shorten(question, question_token_limit, keep_end=True)
+    answers = [(shorten(answer, answer_token_limit), correct) for answer, correct in input_answers]
+    used = estimate_tokens(question)
+    correct = [i for i, (_, is_correct) in enumerate(answers) if is_correct]
+    # correct answers all go in, cut shorter when together they do not fit
+    if sum(estimate_tokens(answers[i][0]) + 2 for i in correct) > budget - used:
+        share = max(8, (budget - used) // max(len(correct), 1) - 2)
+        for i in correct: answers[i] = (shorten(answers[i][0], share), True)
+    kept = set(correct)
+    used += sum(estimate_tokens(answers[i][0]) + 2 for i in correct)
+    for i in range(len(answers)):
+        if i in kept: continue
+        cost = estimate_tokens(answers[i][0]) + 2
+        if used + cost > budget: continue
+        kept.add(i)
+        used += cost
+    return question, [answer for i, answer in enumerate(answers) if i in kept], len(answers) - len(kept)
+
+
+def output_tokens(input_answers: list[tuple[str, bool]], count, observed=None):
+    """
+    max_tokens for `count` new answers: typical length of the existing answers, or of the answers generated
+    so far if they came out longer, plus the "[x] " and line break, with room for twice that
+    """
+    lengths = sorted(estimate_tokens(answer) for answer, _ in input_answers if answer.strip())
+    per_answer = min(lengths[len(lengths) // 2], answer_token_limit) if lengths else answer_tokens
+    if observed: per_answer = max(per_answer, observed)
+    return int(2 * count * (per_answer + 4)) + 40
+
+
+
+class CallStats():
+    """Tokens and latency of every API call, for seeing what filling answers costs"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []            # (kind, prompt tokens, completion tokens, max_tokens, seconds, answers)
+        self.answer_tokens = None  # running average of completion tokens per generated answer
+
+
+    def record(self, kind, response, prompt, max_tokens, seconds, answers):
+        # usage is optional for OpenAI compatible servers
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) or estimate_tokens(prompt)
+        completion_tokens = getattr(usage, 'completion_tokens', None) or estimate_tokens(response.choices[0].message.content or '')
+        with self.lock:
+            self.calls.append((kind, prompt_tokens, completion_tokens, max_tokens, seconds, answers))
+            if answers:
+                per_answer = completion_tokens / answers
+                self.answer_tokens = per_answer if self.answer_tokens is None else 0.8 * self.answer_tokens + 0.2 * per_answer
+
+
+    def summary(self, since=0):
+        with self.lock:
+            calls = self.calls[since:]
+        if not calls: return "no calls"
+        seconds = sorted(call[4] for call in calls)
+        return (f"{len(calls)} call{'s' if len(calls) != 1 else ''}, {sum(call[1] for call in calls)} prompt + "
+                f"{sum(call[2] for call in calls)} completion tokens, latency p50 {seconds[len(seconds) // 2]:.1f} s, max {seconds[-1]:.1f} s")
 
 
 class LLM():
@@ -9,6 +106,14 @@ class LLM():
         self.key = ''
         self.model = ''
         self.count = '0'
+        self.batch_tokens = '3000'
+        self.max_retries = 2  # retries of the OpenAI client on 429 and 5xx
+        self.extra_endpoints = []  # [{"url", "key", "model", "weight"}] from config.json, tried besides the one above
+        self.weight = 1.0
+        self.prefetch = False          # generate answers of edited questions while idle
+        self.prefetch_tokens = '20000' # per session
+        self.router = Router()
+        self.stats = CallStats()
 
 
     def load_json(self):
@@ -19,6 +124,11 @@ class LLM():
             self.key = config.get('key', '')
             self.model = config.get('model', '')
             self.count = config.get('count', '0')
+            self.batch_tokens = config.get('batch_tokens', '3000')
+            self.weight = config.get('weight', 1.0)
+            self.prefetch = bool(config.get('prefetch', False))
+            self.prefetch_tokens = config.get('prefetch_tokens', '20000')
+            self.extra_endpoints = [endpoint for endpoint in config.get('endpoints', []) if isinstance(endpoint, dict) and endpoint.get('url')]
         except: pass
 
 
@@ -39,51 +149,202 @@ class LLM():
                 config['key'] = self.key
                 config['model'] = self.model
                 config['count'] = self.count
+                config['batch_tokens'] = self.batch_tokens
+                config['prefetch'] = self.prefetch
+                config['prefetch_tokens'] = self.prefetch_tokens
                 json.dump(config, f, indent=2)
         except Exception as e:
             raise RuntimeError(f"Failed to save configuration: {str(e)}")
 
 
-    def generate_answers(self, question, input_answers: list[tuple[str, bool]]):
-        # Initialize OpenAI client
-        client = openai.Client(api_key=self.key, base_url=self.url)
-        
-        # Create system prompt
-        system_prompt = f"""You are a helpful assistant helping user to create a quiz. Respond in the same language as the user's question. User will provide to you quiz question and a list of answers marked as [v] correct and [x] incorrect. Provide a list of incorrect answers to add to the quiz. Make all of the answers believable, keep all of them in topic. Format your answers as a list of items, each starting with "[x] ", and enclose all answers within triple backticks (```). Generate {self.count} new answers"""
-        
-        # Create user prompt
+    def endpoints(self):
+        configs = [(self.url, self.key, self.model, self.weight)]
+        configs += [(endpoint['url'], endpoint.get('key', ''), endpoint.get('model', self.model), endpoint.get('weight', 1.0)) for endpoint in self.extra_endpoints]
+        return [self.router.endpoint(*config) for config in configs]
+
+
+    def complete(self, kind, messages, max_tokens, parse):
+        """
+        Chat completion on the endpoints, `parse(response)` returns the answers and raises on a bad response,
+        FinalError when asking another endpoint would not help.
+        """
+        endpoints = self.endpoints()
+        # with other endpoints to go to, failing over beats the client retrying with backoff
+        max_retries = self.max_retries if len(endpoints) == 1 else 0
+        # clients are made here, so importing openai does not count into the latency of the first request
+        clients = {id(endpoint): endpoint.client(max_retries) for endpoint in endpoints}
+
+        def request(endpoint):
+            started = time.perf_counter()
+            response = clients[id(endpoint)].chat.completions.create(
+                model=endpoint.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                n=0,
+                stop=None
+            )
+            seconds = time.perf_counter() - started
+            answers = None
+            try:
+                answers = parse(response)
+            finally:
+                count = 0 if answers is None else sum(map(len, answers.values())) if isinstance(answers, dict) else len(answers)
+                self.stats.record(kind, response, messages[-1]['content'], max_tokens, seconds, count)
+            return answers
+
+        return self.router.call(kind, endpoints, request)
+
+
+    def single_prompt(self, question, input_answers: list[tuple[str, bool]], count):
+        """
+        Returns:
+            tuple[list, int]: messages and max_tokens of a request for one question
+        """
+        system_prompt = f"""You are a helpful assistant helping user to create a quiz. Respond in the same language as the user's question. User will provide to you quiz question and a list of answers marked as [v] correct and [x] incorrect. Provide a list of incorrect answers to add to the quiz. Make all of the answers believable, keep all of them in topic. Format your answers as a list of items, each starting with "[x] ", and enclose all answers within triple backticks (```). Generate {count} new answers"""
         
+        question, answers, left_out = fit_prompt(question, input_answers)
         user_prompt = f"# {question}\n\n```\n"
-        for answer in input_answers:
-            user_prompt += f"[{'v' if answer[1] else 'x'}] {answer[0]}\n"
+        user_prompt += format_answers(answers)
         user_prompt += "\n```\n"
+        if left_out: user_prompt += f"({left_out} more incorrect answers not shown)\n"
         
-        # Generate answers using API
-        answers = []
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000,
-            n=0,
-            stop=None
-        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        return messages, output_tokens(input_answers, count, self.stats.answer_tokens)
+
+
+    def generate_answers(self, question, input_answers: list[tuple[str, bool]], count=None):
+        count = int(count or self.count)
+        messages, max_tokens = self.single_prompt(question, input_answers, count)
         
-        # Extract and process answers
-        answer_text = response.choices[0].message.content.strip()
+        def parse(response):
+            # Extract and process answers
+            answer_text = (response.choices[0].message.content or '').strip()
+            
+            # Check if response is properly encapsulated
+            if answer_text.count('```') != 2:
+                if response.choices[0].finish_reason == 'length': raise FinalError("Response was cut off at max_tokens")
+                raise ValueError("Response is not enclosed in ```")
+            
+            inner_content = answer_text.split('```')[1]
+            
+            # Split answers by lines starting with "- "
+            answers = []
+            for line in inner_content.split('\n'):
+                line = line.strip()
+                if line.startswith('[x]'):
+                    answers.append(line[3:].strip().strip('"”„\'`'))
+            return answers
         
-        # Check if response is properly encapsulated
-        if answer_text.count('```') != 2: raise ValueError
+        # Generate answers using API, with more room once if the answers came out longer than expected
+        try:
+            return self.complete('single', messages, max_tokens, parse)
+        except FinalError:
+            return self.complete('single', messages, max_tokens * 2, parse)
+
+
+    def plan_batches(self, questions: dict):
+        """Split {id: (question, answers, count)} into batches that fit into the batch token budget"""
+        try:
+            budget = int(self.batch_tokens)
+        except ValueError:
+            budget = 3000
+        batches = []
+        batch = {}
+        used = 0
+        for question_id, (question, answers, count) in questions.items():
+            # prompt tokens plus the room left for the generated answers
+            fitted, fitted_answers, _ = fit_prompt(question, answers)
+            cost = estimate_tokens(fitted + format_answers(fitted_answers)) + output_tokens(answers, count, self.stats.answer_tokens) // 2
+            if batch and used + cost > budget:
+                batches.append(batch)
+                batch = {}
+                used = 0
+            batch[question_id] = (question, answers, count)
+            used += cost
+        if batch: batches.append(batch)
+        return batches
+
+
+    def generate_answers_batch(self, questions: dict):
+        """
+        Generate incorrect answers for many questions in a single request.
+
+        Args:
+            questions (dict): {id: (question, answers, count)}
+
+        Returns:
+            dict: {id: [answers]} for every question the model answered properly
+        """
+        system_prompt = """You are a helpful assistant helping user to create a quiz. Respond in the same language as each question. User will provide to you several quiz questions, each with an id, the number of answers to generate and a list of answers marked as [v] correct and [x] incorrect. For every question provide new incorrect answers to add to the quiz. Make all of the answers believable, keep all of them in topic. Respond only with a JSON object mapping each question id (as a string) to a list of new answers (strings), enclosed within triple backticks (```)."""
+        
+        user_prompt = ""
+        for question_id, (question, answers, count) in questions.items():
+            question, fitted_answers, left_out = fit_prompt(question, answers)
+            user_prompt += f"# id: {question_id}, generate {count} answers\n{question}\n\n```\n{format_answers(fitted_answers)}```\n"
+            if left_out: user_prompt += f"({left_out} more incorrect answers not shown)\n"
+            user_prompt += "\n"
         
-        inner_content = answer_text.split('```')[1]
+        # room for the planned answers, plus the quotes and ids of the JSON around them
+        max_tokens = sum(output_tokens(answers, count, self.stats.answer_tokens) + 4 * count + 10 for _, answers, count in questions.values()) + 60
         
-        # Split answers by lines starting with "- "
-        for line in inner_content.split('\n'):
-            line = line.strip()
-            if line.startswith('[x]'):
-                answers.append(line[3:].strip().strip('"”„\'`'))
+        def parse(response):
+            answer_text = (response.choices[0].message.content or '').strip()
             
-        return answers
+            # Accept the JSON object with or without the code fence around it
+            start = answer_text.find('{')
+            end = answer_text.rfind('}')
+            if start < 0 or end < start:
+                if response.choices[0].finish_reason == 'length': raise FinalError("Response was cut off at max_tokens")
+                raise ValueError("Response does not contain a JSON object")
+            parsed = json.loads(answer_text[start:end + 1])
+            if not isinstance(parsed, dict): raise ValueError("Response is not a JSON object")
+            
+            results = {}
+            for question_id, (_, _, count) in questions.items():
+                answers = parsed.get(str(question_id))
+                if not isinstance(answers, list): continue
+                answers = [str(answer).strip().strip('"”„\'`') for answer in answers if isinstance(answer, (str, int, float))]
+                answers = [answer for answer in answers if answer][:count]
+                if answers: results[question_id] = answers
+            return results
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        return self.complete('batch', messages, max_tokens, parse)
+
+
+    def fill_many(self, questions: dict, job=None):
+        """
+        Batched answer generation with per-question fallback.
+
+        Batches that fail to parse, and questions missing from a batch response,
+        are retried one by one with `generate_answers`.
+
+        Returns:
+            tuple[dict, dict]: ({id: [answers]}, {id: error message})
+        """
+        results = {}
+        errors = {}
+        done = 0
+        for batch in self.plan_batches(questions):
+            if job and job.cancelled: break
+            try:
+                results.update(self.generate_answers_batch(batch) if len(batch) > 1 else {})
+            except Exception as e:
+                print(f"Batch of {len(batch)} questions failed, falling back to single requests: {e}")
+            for question_id, (question, answers, count) in batch.items():
+                if question_id in results: continue
+                if job and job.cancelled: break
+                try:
+                    results[question_id] = self.generate_answers(question, answers, count)
+                except Exception as e:
+                    errors[question_id] = str(e) or type(e).__name__
+            done += len(batch)
+            if job: job.report(done, len(questions), 'llm')
+        return results, errors
@@ -0,0 +1,213 @@
+"""
+Load test for LLM answer filling.
+
+By default starts the local mock server (mock_server.py), so nothing is paid for:
+
+    python llm_loadtest.py --requests 200 --concurrency 8 --latency 0.2 --error-rate 0.05
+
+Client retries are off by default so server errors show up as failed calls, use --retries
+to measure with the retrying the app does. --mode stream exercises the streaming responses.
+
+--endpoints 2 starts more mock servers and routes between them, with --slow-rate some
+of their answers stall, which the backup requests should keep out of the tail latency.
+
+Use --url/--key/--model to point it at a real endpoint instead.
+"""
+import argparse, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from llm import LLM
+from mock_server import MockOptions, start_server
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def sample_questions(count):
+    return {
+        i: (f"Sample question number {i} about the topic of the quiz?", [(f"Correct answer {i}", True), (f"Wrong answer {i}", False)], 3)
+        for i in range(1, count + 1)
+    }
+
+
+def report(name, wall_time, latencies, calls, failures, questions, first_tokens=None):
+    print(f"\n{name}")
+    print(f"  calls:         {calls} ({failures} failed)")
+    print(f"  questions:     {questions} in {wall_time:.2f} s ({questions / wall_time:.1f} questions/s)")
+    print(f"  requests/s:    {calls / wall_time:.1f}")
+    print(f"  latency p50:   {percentile(latencies, 50) * 1000:.0f} ms")
+    print(f"  latency p99:   {percentile(latencies, 99) * 1000:.0f} ms")
+    print(f"  latency max:   {max(latencies, default=0) * 1000:.0f} ms")
+    if first_tokens is not None:
+        print(f"  first token:   p50 {percentile(first_tokens, 50) * 1000:.0f} ms, p99 {percentile(first_tokens, 99) * 1000:.0f} ms")
+
+
+class TimedLLM(LLM):
+    """LLM recording the latency and outcome of every API call"""
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.first_tokens = []
+        self.calls = 0
+        self.failures = 0
+
+
+    def timed(self, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        except Exception:
+            with self.lock: self.failures += 1
+            raise
+        finally:
+            with self.lock:
+                self.calls += 1
+                self.latencies.append(time.perf_counter() - start)
+
+
+    def generate_answers(self, question, input_answers, count=None):
+        return self.timed(super().generate_answers, question, input_answers, count)
+
+
+    def generate_answers_batch(self, questions):
+        return self.timed(super().generate_answers_batch, questions)
+
+
+    def stream_answers(self, question, input_answers, count):
+        """Streamed request with the single question prompt, records the time to the first content chunk"""
+        client = openai.Client(api_key=self.key, base_url=self.url, max_retries=self.max_retries)
+        messages, max_tokens = self.single_prompt(question, input_answers, count)
+        start = time.perf_counter()
+        stream = client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        text = ""
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not text:
+                    with self.lock: self.first_tokens.append(time.perf_counter() - start)
+                text += chunk.choices[0].delta.content
+        if text.count('```') != 2: raise ValueError("Incomplete streamed response")
+        return text
+
+
+def run_single(llm: TimedLLM, questions, concurrency):
+    """One request per question, like clicking ✨ on many questions at once"""
+    def fill(item):
+        question, answers, count = item
+        try:
+            llm.generate_answers(question, answers, count)
+        except Exception:
+            pass
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(fill, questions.values()))
+    return time.perf_counter() - start
+
+
+def run_stream(llm: TimedLLM, questions, concurrency):
+    """One streamed request per question"""
+    def fill(item):
+        question, answers, count = item
+        try:
+            llm.timed(llm.stream_answers, question, answers, count)
+        except Exception:
+            pass
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(fill, questions.values()))
+    return time.perf_counter() - start
+
+
+def run_bulk(llm: TimedLLM, questions, concurrency):
+    """Batched filling (✨ All), the bank is split between `concurrency` workers"""
+    ids = list(questions.keys())
+    chunks = [{i: questions[i] for i in ids[n::concurrency]} for n in range(concurrency)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(llm.fill_many, [chunk for chunk in chunks if chunk]))
+    wall_time = time.perf_counter() - start
+    missing = sum(len(errors) for _, errors in results)
+    return wall_time, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM answer filling load test")
+    parser.add_argument('--requests', type=int, default=100, help="number of questions to fill")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mode', choices=['single', 'bulk', 'stream', 'both', 'all'], default='both', help="both runs single and bulk")
+    parser.add_argument('--retries', type=int, default=0, help="retries of the OpenAI client on 429 and 5xx")
+    parser.add_argument('--batch-tokens', default='3000', help="token budget of a batched request")
+    parser.add_argument('--url', help="use a real endpoint instead of the mock server")
+    parser.add_argument('--key', default='mock')
+    parser.add_argument('--model', default='mock')
+    parser.add_argument('--latency', type=float, default=0.1, help="mock server base latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.05, help="mock server random extra latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="mock server HTTP 500 rate")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="mock server requests per second, 0 disables")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="fraction of mock completions taking --slow-latency longer")
+    parser.add_argument('--slow-latency', type=float, default=3.0)
+    parser.add_argument('--endpoints', type=int, default=1, help="mock servers to route between, with hedging when more than one")
+    args = parser.parse_args()
+
+    servers = []
+    url = args.url
+    extra_endpoints = []
+    if not url:
+        options = MockOptions(args.latency, args.jitter, args.error_rate, args.rate_limit, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+        servers = [start_server(options=options) for _ in range(max(1, args.endpoints))]
+        url = servers[0].url
+        extra_endpoints = [{'url': server.url, 'key': args.key, 'model': args.model} for server in servers[1:]]
+        print(f"Using mock server{'s' if len(servers) > 1 else ''} at {', '.join(server.url for server in servers)}")
+
+    questions = sample_questions(args.requests)
+
+    modes = {'both': ['single', 'bulk'], 'all': ['single', 'bulk', 'stream']}.get(args.mode, [args.mode])
+    for mode in modes:
+        llm = TimedLLM()
+        llm.url, llm.key, llm.model, llm.count = url, args.key, args.model, '3'
+        llm.batch_tokens = args.batch_tokens
+        llm.max_retries = args.retries
+        llm.extra_endpoints = extra_endpoints
+        served_before = sum(server.stats.requests for server in servers)
+
+        if mode == 'single':
+            wall_time = run_single(llm, questions, args.concurrency)
+            report("Single question requests", wall_time, llm.latencies, llm.calls, llm.failures, len(questions))
+        elif mode == 'stream':
+            wall_time = run_stream(llm, questions, args.concurrency)
+            report("Streamed requests", wall_time, llm.latencies, llm.calls, llm.failures, len(questions), llm.first_tokens)
+        else:
+            wall_time, missing = run_bulk(llm, questions, args.concurrency)
+            report("Batched requests", wall_time, llm.latencies, llm.calls, llm.failures, len(questions))
+            print(f"  unfilled:      {missing} questions after fallback")
+        if llm.stats.calls:
+            print(f"  tokens:        {llm.stats.summary()}")
+        if extra_endpoints:
+            print("  endpoints:     " + llm.router.summary().replace("\n", "\n                 "))
+
+        if servers:
+            # with --retries the OpenAI client retries 429 and 5xx by itself, so the server sees more requests than we make
+            print(f"  server:        {sum(server.stats.requests for server in servers) - served_before} HTTP requests served")
+
+    for server in servers:
+        stats = server.stats
+        print(f"\nMock server totals ({server.url}): {stats.requests} requests, {stats.errors} errors, {stats.rate_limited} rate limited, {stats.streamed} streamed")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,65 +1,35 @@
-import os, sys, subprocess, shlex, zipfile, traceback, requests
+import time
+startup_started = time.perf_counter()
 
-from PySide6.QtWidgets import *
-from PySide6.QtCore import Qt, QBuffer, QTimer
-from PySide6.QtGui import QIcon, QPixmap
+import os, sys, subprocess, shlex, traceback
+
+from PySide6.QtWidgets import (QApplication, QCheckBox, QComboBox, QDialog, QFileDialog, QGroupBox, QHBoxLayout, QLabel, QLineEdit,
+                               QListWidget, QListWidgetItem, QMainWindow, QMessageBox, QProgressDialog, QPushButton,
+                               QTextBrowser, QVBoxLayout, QWidget)
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QIcon, QImage, QPixmap, QKeySequence, QShortcut
 
-from PIL import Image, ImageDraw, ImageFont
 import io
 
-import math
-import json
+# PIL, openai and requests (through exporter and importer) are imported where they are first used,
+# importing them here made starting the app several times slower
 from llm import LLM
+from prefetch import Prefetcher
+from history import EditHistory, restore_image
+from jobs import JobManager
+from journal import EditJournal
+from project import ProjectFile, ProjectImages, image_usage, ingest_image, peek_image, project_extension, shared_images
+from search import SearchIndex
+from similarity import SimilarityIndex
 import resources_rc
 # pyside6-rcc resources.qrc -o resources_rc.py
-from threading import Thread
-from difflib import SequenceMatcher
 import re
 
 
-image_size_limits = [600, 600]
 similarity_limit = 0.6
-
-
-def upload_image_to_imgbb(image_data, api_key):
-    """
-    Uploads an image to imgbb.com and retrieves its URL.
-
-    Args:
-        image_data (bytes): The raw image data (byte stream).
-        api_key (str): Your imgbb.com API key. You can get one from https://api.imgbb.com/.
-
-    Returns:
-        str: The URL of the uploaded image if successful, None otherwise.
-    """
-    url = "https://api.imgbb.com/1/upload"
-    
-    try:
-        files = {'image': ('image.png', image_data, 'image/png')}
-        data = {'key': api_key}
-        
-        response = requests.post(url, files=files, data=data)
-        response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
-        
-        result = response.json()
-        
-        if result and result.get('success'):
-            image_url = result['data']['url']
-            print(f"Image uploaded successfully. URL: {image_url}")
-            return image_url
-        else:
-            print(f"Image upload failed. Response: {result}")
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred during the request: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return None
-
-
-def string_similarity(a, b):
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+journal_delay_ms = 500              # edits are coalesced for this long before being journaled
+journal_compact_entries = 1000      # journal length that triggers writing a fresh snapshot
+journal_compact_interval_ms = 5 * 60 * 1000
 
 
 def strip_str(string: str):
@@ -72,6 +42,21 @@ def strip_answers_list(answers_list: list[tuple[str, bool]]):
             answers_list.remove(answers_list[-1])
 
 
+def qimage_to_pil(qimage):
+    """PIL copy of a QImage read straight from its pixel buffer, instead of going through PNG"""
+    from PIL import Image
+    mode = 'RGBA' if qimage.hasAlphaChannel() else 'RGB'
+    qimage = qimage.convertToFormat(QImage.Format_RGBA8888 if mode == 'RGBA' else QImage.Format_RGB888)
+    # frombuffer only maps the QImage memory, which is gone with the QImage, so keep a copy
+    return Image.frombuffer(mode, (qimage.width(), qimage.height()), qimage.constBits(), 'raw', mode, qimage.bytesPerLine(), 1).copy()
+
+
+def pil_to_qimage(image):
+    image = image.convert('RGBA')
+    qimage = QImage(image.tobytes(), image.width, image.height, image.width * 4, QImage.Format_RGBA8888)
+    return qimage.copy()  # the QImage above does not own the bytes
+
+
 class ImageDropArea(QLabel):
     def __init__(self):
         super().__init__()
@@ -82,6 +67,8 @@ class ImageDropArea(QLabel):
         self.default_style = "QLabel { border: 2px dashed gray; }"
         
         self.update_image = lambda: None
+        self.files_dropped = lambda paths: None
+        self.image_added = lambda image: None
         self.reset()
         
         # Enable focus to receive key events
@@ -96,19 +83,11 @@ class ImageDropArea(QLabel):
             if mime_data.hasImage():
                 qimage = clipboard.image()
                 if not qimage.isNull():
-                    # Convert QImage to PIL Image
-                    buffer = QBuffer()
-                    buffer.open(QBuffer.ReadWrite)
-                    qimage.save(buffer, "PNG")
-                    buffer.seek(0)
                     try:
-                        self.pil_image = Image.open(io.BytesIO(buffer.data()))
-                        self.load_image()
+                        self.set_image(qimage_to_pil(qimage))
                         self.update_image()
                     except Exception as e:
                         print(f"Failed to convert clipboard image: {str(e)}")
-                    finally:
-                        buffer.close()
 
     def dragEnterEvent(self, event):
         mime_data = event.mimeData()
@@ -118,49 +97,58 @@ class ImageDropArea(QLabel):
             event.ignore()
 
     def dropEvent(self, event):
+        from PIL import Image
         mime_data = event.mimeData()
         
         if mime_data.hasUrls():
+            paths = [url.toLocalFile() for url in mime_data.urls() if url.isLocalFile()]
+            if len(paths) > 1 or any(os.path.isdir(path) for path in paths):
+                # several files or a folder make one new question per image
+                event.accept()
+                self.files_dropped(paths)
+                return
             for url in mime_data.urls():
                 file_path = url.toLocalFile()
                 try:
-                    self.pil_image = Image.open(file_path)
-                    self.load_image()
+                    self.set_image(Image.open(file_path))
                     break
                 except Exception as e:
                     print(f"Failed to load image from URL: {str(e)}")
         elif mime_data.hasImage():
             qimage = mime_data.imageData()
             if qimage:
-                buffer = QBuffer()
-                buffer.open(QBuffer.ReadWrite)
-                qimage.save(buffer, "PNG")
-                buffer.seek(0)
                 try:
-                    self.pil_image = Image.open(io.BytesIO(buffer.data()))
-                    self.load_image()
+                    self.set_image(qimage_to_pil(qimage))
                 except Exception as e:
                     print(f"Failed to convert QImage to PIL Image: {str(e)}")
         elif mime_data.hasFormat('image/png') or mime_data.hasFormat('image/jpeg'):
             image_data = mime_data.data('image/png') if mime_data.hasFormat('image/png') else mime_data.data('image/jpeg')
             try:
-                self.pil_image = Image.open(io.BytesIO(image_data))
-                self.load_image()
+                self.set_image(Image.open(io.BytesIO(image_data)))
             except Exception as e:
                 print(f"Failed to load image from raw data: {str(e)}")
         
         event.accept()
         self.update_image()
 
-    def load_image(self):
+    def set_image(self, image):
+        """Dropped or pasted image, `image_added` gets to share it with the questions that already use the same picture"""
+        self.pil_image = ingest_image(image)
+        self.load_image()
+        self.image_added(self.pil_image)
+
+
+    def load_image(self, thumbnail=None):
         if self.pil_image:
-            # Convert PIL image to QPixmap
-            img_byte_arr = io.BytesIO()
-            self.pil_image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            self.pixmap = QPixmap()
-            self.pixmap.loadFromData(img_byte_arr)
+            if thumbnail:
+                # Stored thumbnail, no need to decode the full image
+                self.pixmap = QPixmap()
+                self.pixmap.loadFromData(thumbnail)
+            else:
+                # only the preview size is converted, straight from the pixels instead of through PNG
+                preview = self.pil_image.copy()
+                preview.thumbnail((200, 800))
+                self.pixmap = QPixmap.fromImage(pil_to_qimage(preview))
             
             if not self.pixmap.isNull():
                 scaled_pixmap = self.pixmap.scaledToWidth(200)
@@ -179,104 +167,6 @@ class ImageDropArea(QLabel):
         self.pil_image = None
 
 
-    def calculate_text_height(self, text, img_width):
-        """Calculate the height needed for text area based on image width and text content"""
-        try:
-            # Calculate font size based on image dimensions
-            font_size = max(20, min(img_width // 20, 60))
-            font = ImageFont.truetype("arial.ttf", font_size)
-            
-            # Wrap text if it's too long
-            lines = []
-            words = text.split()
-            current_line = ""
-            for word in words:
-                if len(current_line) + len(word) + 1 > 40:
-                    lines.append(current_line.strip())
-                    current_line = word
-                else:
-                    current_line += " " + word if current_line else word
-            lines.append(current_line.strip())
-            
-            # Calculate height needed for text
-            return int(max(100, len(lines) * font_size * 1.3))
-        except Exception:
-            return 100  # Default height if calculation fails
-
-    def add_text_to_image(self, text):
-        try:
-            img = self.pil_image.copy()
-            
-            if img.width < image_size_limits[0] or img.height < image_size_limits[0]:
-                scale_factor = max(image_size_limits[0] / img.width, image_size_limits[0] / img.height)
-                new_width = int(img.width * scale_factor)
-                new_height = int(img.height * scale_factor)
-                img = img.resize((new_width, new_height))
-                
-            if img.width > image_size_limits[1] or img.height > image_size_limits[1]:
-                scale_factor = min(image_size_limits[1] / img.width, image_size_limits[1] / img.height)
-                new_width = int(img.width * scale_factor)
-                new_height = int(img.height * scale_factor)
-                img = img.resize((new_width, new_height))
-            
-            # Calculate font size and text height
-            font_size = max(20, min(img.width // 20, img.height // 10))
-            font = ImageFont.truetype("arial.ttf", font_size)
-            text_height = self.calculate_text_height(text, img.width)
-            
-            # Create a new image with extra space at the top for text
-            total_height = img.height + text_height
-            new_img = Image.new('RGB', (img.width, total_height), color='white')
-            new_img.paste(img, (0, text_height))
-            
-            # Create a drawing context
-            draw = ImageDraw.Draw(new_img)
-            
-            # Wrap and draw text
-            lines = []
-            words = text.split()
-            current_line = ""
-            for word in words:
-                if len(current_line) + len(word) + 1 > 40:
-                    lines.append(current_line.strip())
-                    current_line = word
-                else:
-                    current_line += " " + word if current_line else word
-            lines.append(current_line.strip())
-            
-            # Draw text
-            margin = 10
-            x = margin
-            y = margin
-            for line in lines:
-                draw.text((x, y), line, fill=(0, 0, 0), font=font)
-                y += font.size + 5
-            
-            # Save the modified image
-            buffer = io.BytesIO()
-            new_img.save(buffer, format="PNG")
-            buffer.seek(0)
-            
-            return buffer.getvalue()
-        
-        except Exception as e:
-            error_message = f"Error adding text to image: {str(e)}"
-            QMessageBox.critical(self.parent(), "Image Processing Error", error_message)
-            return None
-
-    def remove_text_area(self, image, text):
-        """Remove the text area from an image that was previously added with add_text_to_image"""
-        try:
-            # Calculate the height of text area that was added
-            text_height = self.calculate_text_height(text, image.width)
-            
-            # Crop the image to remove the text area
-            return image.crop((0, text_height, image.width, image.height))
-        except Exception as e:
-            print(f"Error removing text area: {str(e)}")
-            return image
-
-
 
 class ExportDialog(QDialog):
     def __init__(self, parent=None):
@@ -303,6 +193,105 @@ class ExportDialog(QDialog):
         return None
 
 
+class ShardDialog(QDialog):
+    """How to split a sharded export"""
+    splits = [("Questions per shard", 'count', '1000'), ("Megabytes per shard (estimated)", 'size', '50'), ("One shard per #tag of the question", 'tag', '')]
+    formats = [("ZIP", ('zip',)), ("JSON", ('json',)), ("ZIP and JSON", ('zip', 'json'))]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Sharded Export")
+        self.layout = QVBoxLayout()
+        self.setLayout(self.layout)
+
+        self.split_input = QComboBox()
+        self.split_input.addItems([name for name, _, _ in self.splits])
+        self.value_input = QLineEdit(self.splits[0][2])
+        self.format_input = QComboBox()
+        self.format_input.addItems([name for name, _ in self.formats])
+        self.split_input.currentIndexChanged.connect(self.split_changed)
+
+        self.layout.addWidget(QLabel("Split by:"))
+        self.layout.addWidget(self.split_input)
+        self.layout.addWidget(self.value_input)
+        self.layout.addWidget(QLabel("Shards as:"))
+        self.layout.addWidget(self.format_input)
+
+        self.button_box = QHBoxLayout()
+        self.ok_button = QPushButton("OK")
+        self.cancel_button = QPushButton("Cancel")
+        self.button_box.addWidget(self.ok_button)
+        self.button_box.addWidget(self.cancel_button)
+        self.layout.addLayout(self.button_box)
+
+        self.ok_button.clicked.connect(self.accept)
+        self.cancel_button.clicked.connect(self.reject)
+
+    def split_changed(self, index):
+        self.value_input.setText(self.splits[index][2])
+        self.value_input.setEnabled(self.splits[index][1] != 'tag')
+
+    def options(self):
+        """(split, value, kinds), raises ValueError on a bad number"""
+        split = self.splits[self.split_input.currentIndex()][1]
+        value = float(self.value_input.text()) if split != 'tag' else None
+        if value is not None and value <= 0: raise ValueError("The shard size has to be above 0")
+        return split, value, self.formats[self.format_input.currentIndex()][1]
+
+
+class MemoryDialog(QDialog):
+    def __init__(self, window):
+        super().__init__(window)
+        from diagnostics import MemoryTracker
+        self.setWindowTitle("Memory")
+        self.main_window = window
+        self.tracker = MemoryTracker()
+        self.layout = QVBoxLayout()
+        self.setLayout(self.layout)
+        self.resize(900, 600)
+
+        self.report_view = QTextBrowser()
+        self.report_view.setLineWrapMode(QTextBrowser.NoWrap)
+        self.report_view.setStyleSheet("font-family: monospace;")
+        self.layout.addWidget(self.report_view)
+
+        self.button_layout = QHBoxLayout()
+        self.refresh_button = QPushButton("Refresh")
+        self.snapshot_button = QPushButton("Take snapshot")
+        self.diff_button = QPushButton("Compare with snapshot")
+        self.diff_button.setEnabled(False)
+        self.button_layout.addWidget(self.refresh_button)
+        self.button_layout.addWidget(self.snapshot_button)
+        self.button_layout.addWidget(self.diff_button)
+        self.layout.addLayout(self.button_layout)
+
+        self.refresh_button.clicked.connect(self.refresh)
+        self.snapshot_button.clicked.connect(self.snapshot)
+        self.diff_button.clicked.connect(self.diff)
+        self.refresh()
+
+    def refresh(self):
+        from diagnostics import format_report, memory_report
+        text = format_report(memory_report(self.main_window))
+        if self.tracker.tracing():
+            text += "\n\n" + self.tracker.traced()
+        else:
+            text += "\n\nPython allocations are not traced, start with --memory or take a snapshot to trace them from now on"
+        self.show_text(text)
+
+    def snapshot(self):
+        # tracing only sees allocations made after it started, --memory starts it before the window is created
+        self.tracker.start()
+        self.show_text(self.tracker.snapshot() + "\n\nSnapshot taken, do the import / export / edits to check and compare")
+        self.diff_button.setEnabled(True)
+
+    def diff(self):
+        self.show_text(self.tracker.diff())
+
+    def show_text(self, text):
+        self.report_view.setPlainText(text)
+
+
 class AnswerField(QWidget):
     def __init__(self):
         super().__init__()
@@ -343,6 +332,12 @@ class SettingsDialog(QDialog):
         self.model_input = QLineEdit(self.llm.model)
         self.count_label = QLabel("Answer count:")
         self.count_input = QLineEdit(self.llm.count)
+        self.batch_tokens_label = QLabel("Batch token budget:")
+        self.batch_tokens_input = QLineEdit(self.llm.batch_tokens)
+        self.prefetch_checkbox = QCheckBox("Prefetch answers of edited questions while idle, so ✨ applies them at once")
+        self.prefetch_checkbox.setChecked(self.llm.prefetch)
+        self.prefetch_tokens_label = QLabel("Prefetch token budget per session:")
+        self.prefetch_tokens_input = QLineEdit(self.llm.prefetch_tokens)
         
         self.llm_layout.addWidget(self.url_label)
         self.llm_layout.addWidget(self.url_input)
@@ -352,6 +347,11 @@ class SettingsDialog(QDialog):
         self.llm_layout.addWidget(self.model_input)
         self.llm_layout.addWidget(self.count_label)
         self.llm_layout.addWidget(self.count_input)
+        self.llm_layout.addWidget(self.batch_tokens_label)
+        self.llm_layout.addWidget(self.batch_tokens_input)
+        self.llm_layout.addWidget(self.prefetch_checkbox)
+        self.llm_layout.addWidget(self.prefetch_tokens_label)
+        self.llm_layout.addWidget(self.prefetch_tokens_input)
 
         self.imgbb_group = QGroupBox("ImgBB Settings")
         self.imgbb_layout = QVBoxLayout()
@@ -380,13 +380,16 @@ class SettingsDialog(QDialog):
         self.llm.key = self.key_input.text().strip()
         self.llm.model = self.model_input.text().strip()
         self.llm.count = self.count_input.text().strip()
+        self.llm.batch_tokens = self.batch_tokens_input.text().strip()
+        self.llm.prefetch = self.prefetch_checkbox.isChecked()
+        self.llm.prefetch_tokens = self.prefetch_tokens_input.text().strip()
         self.llm.save_json()
         super().accept()
 
 
 
 class TestownikCreator(QMainWindow):
-    def __init__(self):
+    def __init__(self, restore=True):
         super().__init__()
         self.setWindowTitle("Testownik Creator")
         self.setWindowIcon(QIcon(":logo.png"))
@@ -397,8 +400,40 @@ class TestownikCreator(QMainWindow):
         self.images = {}
         self.llm = LLM()
         self.llm.load_json()
+        self.jobs = JobManager(self)
+        self.prefetcher = Prefetcher(self.llm, self.questions_list, self, on_ready=self._prefetch_ready,
+                                     busy=lambda question_id: self.jobs.is_running(('llm', question_id)) or self.jobs.is_running(('llm', 'all')))
         self.imgbb_api_key = ""
         
+        self.similarity = SimilarityIndex()
+        self.search = SearchIndex()
+        self.history = EditHistory()
+        self.project = None
+        self.project_dirty = set()
+        self.zip_dirty = set()
+        self.last_zip_export = None  # (path, mtime, size) of the archive the last export wrote
+        
+        self.journal = EditJournal()
+        self.journal_pending = set()
+        self.compact_retry_pending = False
+        self.journal_timer = QTimer(self)
+        self.journal_timer.setSingleShot(True)
+        self.journal_timer.timeout.connect(self.flush_journal)
+        self.compact_timer = QTimer(self)
+        self.compact_timer.timeout.connect(self.compact_journal)
+        self.compact_timer.start(journal_compact_interval_ms)
+        
+        self.save_shortcut = QShortcut(QKeySequence.Save, self)
+        self.save_shortcut.activated.connect(self.save_project)
+        # text fields keep their own undo while they have focus
+        self.undo_shortcut = QShortcut(QKeySequence.Undo, self)
+        self.undo_shortcut.activated.connect(self.undo)
+        self.redo_shortcut = QShortcut(QKeySequence.Redo, self)
+        self.redo_shortcut.activated.connect(self.redo)
+        self.memory_dialog = None
+        self.memory_shortcut = QShortcut(QKeySequence("Ctrl+Shift+M"), self)
+        self.memory_shortcut.activated.connect(self.show_memory)
+
         
         
 
@@ -425,7 +460,22 @@ class TestownikCreator(QMainWindow):
         self.import_button.clicked.connect(self.import_test)
         self.left_layout.addWidget(self.import_button)
         
+        self.merge_button = QPushButton("Merge tests")
+        self.merge_button.setToolTip("Add the questions of other tests to this one, skipping duplicates")
+        self.merge_button.clicked.connect(self.merge_tests)
+        self.left_layout.addWidget(self.merge_button)
+        
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search questions and answers...")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_input.textChanged.connect(self.search_changed)
+        self.left_layout.addWidget(self.search_input)
+        
         self.question_list = QListWidget()
+        self.question_list.setUniformItemSizes(True)  # otherwise hiding rows while searching lays out all of them again
+        self.question_items = {}  # question id -> item of every row, for filtering without reading the items back
+        self.hidden_questions = set()
+        self.shown_questions = set()  # ids added or edited since the search changed, shown whether they match or not
         self.add_question_button = QPushButton("New Question")
         self.left_layout.addWidget(self.question_list)
         self.left_layout.addWidget(self.add_question_button)
@@ -433,6 +483,15 @@ class TestownikCreator(QMainWindow):
         self.remove_question_button = QPushButton("Remove Question")
         self.left_layout.addWidget(self.remove_question_button)
         
+        history_layout = QHBoxLayout()
+        self.undo_button = QPushButton("Undo")
+        self.undo_button.clicked.connect(self.undo)
+        history_layout.addWidget(self.undo_button)
+        self.redo_button = QPushButton("Redo")
+        self.redo_button.clicked.connect(self.redo)
+        history_layout.addWidget(self.redo_button)
+        self.left_layout.addLayout(history_layout)
+        
         self.download_button = QPushButton("Download test")
         self.download_button.clicked.connect(self.download_file)
         self.left_layout.addWidget(self.download_button)
@@ -456,6 +515,8 @@ class TestownikCreator(QMainWindow):
         self.image_drop_area.setFixedWidth(200)
         self.image_drop_area.setMinimumHeight(100)
         self.image_drop_area.update_image = self.update_answer_field
+        self.image_drop_area.files_dropped = self.add_image_questions
+        self.image_drop_area.image_added = self.share_image
         image_layout.addWidget(self.image_drop_area)
 
         self.delete_button = QPushButton("Delete\nImage")
@@ -478,6 +539,12 @@ class TestownikCreator(QMainWindow):
         self.llm_fill_button.clicked.connect(self.llm_click)
         image_layout.addWidget(self.llm_fill_button)
 
+        self.llm_fill_all_button = QPushButton("✨ All")
+        self.llm_fill_all_button.setFixedSize(60, 30)
+        self.llm_fill_all_button.setToolTip("Fill incorrect answers of every question using batched requests")
+        self.llm_fill_all_button.clicked.connect(self.llm_fill_all_click)
+        image_layout.addWidget(self.llm_fill_all_button)
+
         self.multiline_paste_toggle = QPushButton("Multiline Paste: OFF")
         self.multiline_paste_toggle.setFixedSize(120, 30)
         self.multiline_paste_toggle.setCheckable(True)
@@ -503,6 +570,9 @@ class TestownikCreator(QMainWindow):
         self.layout.addLayout(self.right_layout)
         
         self.connect_signals()
+        
+        if restore and self.journal.has_session():
+            QTimer.singleShot(0, self.restore_session)
 
     def toggle_multiline_paste(self):
         self.multiline_paste = not self.multiline_paste
@@ -512,61 +582,142 @@ class TestownikCreator(QMainWindow):
             self.multiline_paste_toggle.setText("Multiline Paste: OFF")
 
 
-    def _check_llm_status(self):
-        if self.llm_status:
-            self.polling_timer.stop()
-            self.reselect_question()
-            self.llm_fill_button.setText('✨')
-        if type(self.llm_status) != str: return
-        if self.llm_status == "Please enter a question first":
-            QMessageBox.warning(self, "Warning", "Please enter a question first")
-        else:
-            QMessageBox.warning(self, "LLM Error", self.llm_status)
-            
+    def update_llm_button(self):
+        waiting = self.jobs.is_running(('llm', self.question_no)) or self.prefetcher.is_waiting(self.question_no)
+        self.llm_fill_button.setText('💭' if waiting else '✨')
+
 
     def llm_click(self):
-        self.llm_status = False
-        self.llm_fill_button.setText('💭')
+        key = ('llm', self.question_no)
+        # clicking again while a request is in flight cancels it
+        if self.jobs.cancel(key) or self.prefetcher.stop_waiting(self.question_no):
+            self.update_llm_button()
+            return
         
-        self.llm_thread = Thread(target=self.fill_answers_with_llm)
-        self.llm_thread.start()
+        question = list(self.questions_list.get(self.question_no, {'': []}).keys())[0]
+        answers_list: list = self.questions_list.get(self.question_no, {'': []})[question]
+        strip_answers_list(answers_list)
+        
+        if not self.question_input.text().strip() or len(answers_list) < 1:
+            QMessageBox.warning(self, "Warning", "Please enter a question first, and at least one answer")
+            return
         
-        self.polling_timer = QTimer(self)
-        self.polling_timer.timeout.connect(self._check_llm_status)
-        self.polling_timer.start(100)  # Check every 100ms
+        is_true = False
+        for index, i in enumerate(answers_list):
+            if i[1]: is_true = True
+        if not is_true:
+            for i in range(len(answers_list)):
+                answers_list[i] = (answers_list[i][0], True)
+        
+        # answers generated while idle are applied at once, or waited for if they are on the way
+        prefetched = self.prefetcher.take(self.question_no, question, answers_list)
+        if prefetched is not None:
+            self._llm_finished(key, prefetched, prefetched=True)
+            return
+        if not self.prefetcher.wait_for(self.question_no, question, answers_list):
+            self.start_llm(self.question_no, question, answers_list)
+        self.update_llm_button()
+
+
+    def start_llm(self, question_id, question, answers_list):
+        # the worker only gets a copy, results are applied back on the GUI thread
+        self.jobs.start(('llm', question_id), self.llm.generate_answers, question, list(answers_list),
+                        on_finished=self._llm_finished, on_failed=self._llm_failed)
+
+
+    def _prefetch_ready(self, question_id, answers):
+        if answers is not None:
+            self._llm_finished(('llm', question_id), answers, prefetched=True)
+        elif question_id in self.questions_list:
+            # the prefetch failed or the question changed meanwhile
+            question, answers_list = list(self.questions_list[question_id].items())[0]
+            self.start_llm(question_id, question, answers_list)
+        self.update_llm_button()
+
+
+    def _llm_finished(self, key, answers, prefetched=False):
+        question_id = key[1]
+        if question_id in self.questions_list:
+            answers_list: list = list(self.questions_list[question_id].values())[0]
+            strip_answers_list(answers_list)
+            for answer in answers:
+                answers_list.append((answer, False))
+            self.question_edited(question_id)
+            self.update_question_list()
+            if question_id == self.question_no:
+                self.reselect_question()
+        if prefetched: self.statusBar().showMessage(f"LLM: answers prefetched while idle ({self.prefetcher.describe()})", 10000)
+        else: self.statusBar().showMessage(f"LLM: {self.llm.stats.summary(len(self.llm.stats.calls) - 1)}", 10000)
+        self.update_llm_button()
 
 
-    def fill_answers_with_llm(self):
-        """Generate answers using the LLM"""
-        if not self.question_input.text().strip():
-            self.llm_status = "Please enter a question first, and at least one answer"
+    def _llm_failed(self, key, error):
+        self.update_llm_button()
+        QMessageBox.warning(self, "LLM Error", error)
+
+
+    def llm_fill_all_click(self):
+        if self.jobs.cancel(('llm', 'all')):
+            self.llm_fill_all_button.setText("✨ All")
             return
+        
         try:
-            question = list(self.questions_list[self.question_no].keys())[0]
-            answers_list: list = self.questions_list[self.question_no][question]
+            count = int(self.llm.count)
+        except ValueError:
+            count = 0
+        if count < 1:
+            QMessageBox.warning(self, "Warning", "Set the answer count in settings first")
+            return
+        
+        questions = {}
+        for question_id, question_data in self.questions_list.items():
+            question, answers_list = list(question_data.items())[0]
             strip_answers_list(answers_list)
-            
-            if len(answers_list) < 1:
-                self.llm_status = "Please enter a question first, and at least one answer"
-                return
-            
-            is_true = False
-            for index, i in enumerate(answers_list):
-                if i[1]: is_true = True
-            if not is_true:
+            if not question.strip() or len(answers_list) < 1: continue
+            if self.jobs.is_running(('llm', question_id)): continue
+            if not any(correct for _, correct in answers_list):
                 for i in range(len(answers_list)):
                     answers_list[i] = (answers_list[i][0], True)
-            
-            answers = self.llm.generate_answers(question, answers_list)
-            
-            for answer in answers:
-                answers_list.append((answer, False))
-            
-            
-        except Exception as e:
-            self.llm_status = traceback.format_exc()
+            missing = count - sum(1 for _, correct in answers_list if not correct)
+            if missing > 0:
+                questions[question_id] = (question, list(answers_list), missing)
+        
+        if not questions:
+            QMessageBox.information(self, "LLM Fill", "All questions already have enough incorrect answers")
             return
-        self.llm_status = True
+        
+        self.llm_stats_since = len(self.llm.stats.calls)
+        self.jobs.start(('llm', 'all'), self.llm.fill_many, questions, pass_job=True,
+                        on_finished=self._llm_fill_all_finished, on_failed=self._llm_fill_all_failed,
+                        on_progress=lambda key, done, total, stage: self.llm_fill_all_button.setText(f"💭 {done}/{total}"))
+        self.llm_fill_all_button.setText(f"💭 0/{len(questions)}")
+
+
+    def _llm_fill_all_finished(self, key, result):
+        self.llm_fill_all_button.setText("✨ All")
+        results, errors = result
+        with self.history.group():
+            for question_id, answers in results.items():
+                if question_id not in self.questions_list: continue
+                answers_list: list = list(self.questions_list[question_id].values())[0]
+                strip_answers_list(answers_list)
+                for answer in answers:
+                    answers_list.append((answer, False))
+                self.question_edited(question_id)
+        self.update_question_list()
+        if self.question_no in results:
+            self.reselect_question()
+        message = f"LLM filled {len(results)} questions: {self.llm.stats.summary(self.llm_stats_since)}"
+        print(message)
+        self.statusBar().showMessage(message, 10000)
+        if errors:
+            details = '\n'.join(f"[{question_id}]: {error}" for question_id, error in errors.items())
+            QMessageBox.warning(self, "LLM Error", f"Failed to fill {len(errors)} questions:\n{details}")
+
+
+    def _llm_fill_all_failed(self, key, error):
+        self.llm_fill_all_button.setText("✨ All")
+        QMessageBox.warning(self, "LLM Error", error)
 
 
     def show_settings(self):
@@ -592,7 +743,7 @@ class TestownikCreator(QMainWindow):
             self,
             "Download test",
             "",
-            "Zip Files (*.zip);;JSON Files (*.json)"
+            f"Zip Files (*.zip);;JSON Files (*.json);;Zip and JSON (*.zip *.json);;Sharded Zip / JSON with a manifest (*.manifest.json);;Testownik Creator Project (*{project_extension})"
         )
 
         if filename:
@@ -600,144 +751,137 @@ class TestownikCreator(QMainWindow):
                 self.export_as_zip(filename)
             elif ext == "JSON Files (*.json)":
                 self.export_as_json(filename)
+            elif ext == "Zip and JSON (*.zip *.json)":
+                self.export_as_zip_and_json(filename)
+            elif ext.startswith("Sharded"):
+                self.export_as_shards(filename)
+            elif ext.startswith("Testownik Creator Project"):
+                self.save_project_as(filename)
         else:
             print("Export cancelled")
 
 
-    def export_as_zip(self, filename):
-        try:
-            # Ensure the filename ends with .zip
-            if not filename.lower().endswith('.zip'):
-                filename += '.zip'
+    def start_export(self, filename, kind, function, *args, on_done=None, on_abort=None):
+        """Run an export on the job pool, with a non-modal progress dialog"""
+        key = ('export', os.path.abspath(filename))
+        if self.jobs.is_running(key):
+            if on_abort: on_abort()
+            QMessageBox.warning(self, "Export", f"{os.path.basename(filename)} is already being exported")
+            return
+        
+        import exporter
+        bank = exporter.snapshot_bank(self.questions_list, self.images)
+        started = time.perf_counter()
+        
+        dialog = QProgressDialog(f"Exporting {os.path.basename(filename)}...", "Cancel", 0, max(len(bank), 1), self)
+        dialog.setWindowTitle(f"{kind} Export")
+        dialog.setWindowModality(Qt.NonModal)
+        dialog.setMinimumDuration(300)
+        dialog.setValue(0)
+        
+        def run(job):
+            progress = exporter.ExportProgress(job, len(bank))
+            result = function(filename, bank, *args, progress=progress)
+            return result, progress
+        
+        def finished(key, result):
+            dialog.reset()
+            result, progress = result
+            if on_done: on_done(result)
+            message = f"Exported {os.path.basename(filename)} in {time.perf_counter() - started:.2f} s ({progress.summary()})"
+            print(message)
+            self.statusBar().showMessage(message, 10000)
+        
+        def failed(key, error):
+            dialog.reset()
+            if on_abort: on_abort()
+            traceback_lines = error.strip().split('\n')
+            QMessageBox.critical(self, f"{kind} Creation Error", f"Error creating {kind} file: {traceback_lines[-1]}")
+        
+        def cancel():
+            self.jobs.cancel(key)
+            if on_abort: on_abort()
+            self.statusBar().showMessage(f"Export of {os.path.basename(filename)} cancelled", 10000)
+        
+        dialog.canceled.connect(cancel)
+        self.jobs.start(key, run, pass_job=True, on_finished=finished, on_failed=failed,
+                        on_progress=lambda key, done, total, stage: dialog.setValue(done))
 
-            # Create the zip file
-            with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Process each question
-                
-                folder_name = os.path.basename(filename).split('.')[0]
-
-                for question_number, question_data in self.questions_list.items():
-                    question, answers = list(question_data.items())[0]
-                    
-                    # skip if question is empty or there are no answers, unless there is an image
-                    if (len(question) < 2 and question_number not in self.images) or len(answers) < 1: continue
-                    
-                    image_name = ''
-                    
-                    if question_number in self.images:
-                        image = self.images[question_number]
-                        
-                        image_name = f"{question_number}.png"
-                        zip_file_name = os.path.join(folder_name, image_name)
-                        
-                        # Add text to image and write directly to zip
-                        if question.strip() != '':  # Only add text if the question is not empty
-                            self.image_drop_area.pil_image = image
-                            image_data = self.image_drop_area.add_text_to_image(question)
-                            self.image_drop_area.pil_image = None
-                        else:
-                            # Save image without text
-                            buffer = io.BytesIO()
-                            image.save(buffer, format='PNG')
-                            image_data = buffer.getvalue()
-                            buffer.close()
-                        
-                        zipf.writestr(zip_file_name, image_data)
-
-                    num_answers = 0
-                    for answer, _ in answers:
-                        if answer.strip() != '':
-                            num_answers += 1
-                    
-                    content = []
-                    correct_answers = [i for i, (_, is_correct) in enumerate(answers) if is_correct]
-                    if len(correct_answers) == 0:
-                        raise ValueError(f'Question [{question_number}] ({question}) contains no correct answers!')
-                    
-                    correct_line = f"X{''.join(str(int(i in correct_answers)) for i in range(num_answers))}"
-                    content.append(correct_line + "\n")  # Correct answers line
-                    if image_name != '':
-                        content.append(f'[img]{image_name}[/img] ')
-                    content.append(f"{question}\n")  # The question itself
-                    
-                    # Process answers
-                    for answer, _ in answers:
-                        if answer.strip() != '':
-                            content.append(f"{answer}\n")
-                    
-                    # Join the content and encode it
-                    file_content = "".join(content).encode('utf-8')
-                    
-                    # Write the content to the zip file
-                    zip_file_name = os.path.join(folder_name, f"{question_number}.txt")
-                    zipf.writestr(zip_file_name, file_content)
-
-
-                print(f"Zip file saved successfully: {filename}")
-        except Exception as e:
-            error_message = f"Error creating zip file: {str(e)}"
-            QMessageBox.critical(self.parent(), "Zip Creation Error", error_message)
+
+    def export_as_zip(self, filename, incremental=True):
+        import exporter
+        # Ensure the filename ends with .zip
+        if not filename.lower().endswith('.zip'):
+            filename += '.zip'
+        
+        # Re-exporting to the same file only rewrites questions edited since then
+        previous_state = self.last_zip_export if incremental else None
+        # edits made while exporting land in the fresh set, so they stay dirty for the next export
+        dirty, self.zip_dirty = self.zip_dirty, set()
+        
+        def done(result):
+            self.last_zip_export, reused = result
+            print(f"Zip file saved successfully: {filename} ({reused} unchanged questions reused)")
+        
+        def abort():
+            self.zip_dirty |= dirty
+        
+        self.start_export(filename, "Zip", exporter.export_zip, previous_state, dirty, on_done=done, on_abort=abort)
 
 
     def export_as_json(self, filename):
+        import exporter
+        # Ensure the filename ends with .json
+        if not filename.lower().endswith('.json'):
+            filename += '.json'
+        
+        self.start_export(filename, "JSON", exporter.export_json, self.imgbb_api_key,
+                          on_done=lambda result: print(f"JSON file saved successfully: {filename}"))
+
+
+    def export_as_zip_and_json(self, filename):
+        """Both files from one pass over the bank, every image is decoded and scaled once for both"""
+        import exporter
+        base = os.path.splitext(filename)[0] if filename.lower().endswith(('.zip', '.json')) else filename
+        zip_name, json_name = base + '.zip', base + '.json'
+        
+        dirty, self.zip_dirty = self.zip_dirty, set()
+        targets = [exporter.ZipTarget(zip_name, self.last_zip_export, dirty), exporter.JsonTarget(json_name, self.imgbb_api_key)]
+        
+        def done(results):
+            self.last_zip_export, reused = results[0]
+            print(f"Zip and JSON files saved successfully: {zip_name} ({reused} unchanged questions reused), {json_name}")
+        
+        def abort():
+            self.zip_dirty |= dirty
+        
+        self.start_export(zip_name, "Zip and JSON", lambda filename, bank, progress: exporter.export_bank(bank, targets, progress),
+                          on_done=done, on_abort=abort)
+
+
+    def export_as_shards(self, filename):
+        """Several smaller files for banks too big for one archive, written in parallel processes, with a manifest to import them back"""
+        import shards
+        dialog = ShardDialog(self)
+        if not dialog.exec(): return
         try:
-            # Ensure the filename ends with .json
-            if not filename.lower().endswith('.json'):
-                filename += '.json'
-
-            quiz_data = {
-                "title": os.path.basename(filename).split('.')[0],
-                "description": "Made with Testownik Creator by *Matszwe02*",
-                "questions": []
-            }
-
-            for question_number, question_data in self.questions_list.items():
-                question_image_url = None
-                if question_number in self.images:
-                    image = self.images[question_number]
-                    img_byte_arr = io.BytesIO()
-                    image.save(img_byte_arr, format='PNG')
-                    img_byte_arr = img_byte_arr.getvalue()
-                    question_image_url = upload_image_to_imgbb(img_byte_arr, self.imgbb_api_key)
-
-                for question, answers in question_data.items():
-                    if len(question) < 2 or len(answers) < 1: continue
-                    
-                    correct_count = sum(corr for _, corr in answers)
-                    
-                    question_data = {
-                        "question": question,
-                        "answers": [],
-                        "multiple": True
-                    }
-                    
-                    if question_image_url:
-                        question_data["image"] = question_image_url
-                    
-                    for ans, corr in answers:
-                        if ans.strip() != "":
-                            answer_data = {"answer": ans, "correct": corr}
-                            question_data["answers"].append(answer_data)
-                    
-                    quiz_data["questions"].append(question_data)
-
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(quiz_data, f, ensure_ascii=False, indent=4)
-
-            print(f"JSON file saved successfully: {filename}")
-        except Exception as e:
-            error_message = f"Error creating JSON file: {str(e)}"
-            QMessageBox.critical(self.parent(), "JSON Creation Error", error_message)
+            split, value, kinds = dialog.options()
+        except ValueError as e:
+            QMessageBox.warning(self, "Sharded Export", f"Invalid shard size: {str(e)}")
+            return
+        if not filename.lower().endswith(shards.manifest_suffix):
+            filename = os.path.splitext(filename)[0] if filename.lower().endswith(('.zip', '.json')) else filename
+            filename += shards.manifest_suffix
+        
+        def done(result):
+            manifest, count = result
+            print(f"{count} shards saved successfully, manifest: {manifest}")
+        
+        self.start_export(filename, "Sharded", shards.export_sharded, split, value, kinds, self.imgbb_api_key, on_done=done)
 
 
     def update_similar_question(self, current_question):
-        similar_questions = []
-        for qid, data in self.questions_list.items():
-            for question, _ in data.items():
-                if qid != self.question_no:
-                    similarity = string_similarity(current_question.lower(), question.lower())
-                    if similarity >= similarity_limit:
-                        similar_questions.append((qid, question, similarity))
+        similar_questions = self.similarity.similar(current_question, similarity_limit, exclude=self.question_no)
 
         if similar_questions:
             html_output = "<p>Similar questions:</p><ul>"
@@ -770,12 +914,19 @@ class TestownikCreator(QMainWindow):
             self,
             "Import Test",
             "",
-            "Zip Files (*.zip)"
+            f"Tests (*.zip *.json *.txt *{project_extension});;Zip Files (*.zip);;JSON Files (*.json);;Text Documents (*.txt);;Testownik Creator Project (*{project_extension})"
         )
 
         if filename:
             try:
-                self.import_from_zip(filename)
+                if filename.lower().endswith(project_extension):
+                    self.open_project(filename)
+                elif filename.lower().endswith('.json'):
+                    self.import_from_json(filename)
+                elif filename.lower().endswith('.txt'):
+                    self.import_from_text(filename)
+                else:
+                    self.import_from_zip(filename)
             except Exception as e:
                 error_message = f"Error importing test: {traceback.format_exc()}"
                 QMessageBox.critical(self, "Import Error", error_message)
@@ -783,80 +934,212 @@ class TestownikCreator(QMainWindow):
 
 
     def import_from_zip(self, filename):
+        import importer
+        questions_list, images, errors = importer.import_zip(filename)
+        for error in errors:
+            print(f"Error processing {error}")
+
+        self.jobs.cancel_all()
+        self.close_project()
         self.questions_list.clear()
-        self.images.clear()
+        self.questions_list.update(questions_list)
+        self.images = images
         self.question_list.clear()
 
-        with zipfile.ZipFile(filename, 'r') as zip_ref:
-            # First pass: Process text files to get questions and answers
-            for file_info in zip_ref.infolist():
-                if file_info.filename.endswith('.txt'):
-                    try:
-                        # Get question ID from filename (assuming format like "1.txt")
-                        base_name = os.path.basename(file_info.filename)
-                        question_id = int(os.path.splitext(base_name)[0])
-                        
-                        with zip_ref.open(file_info) as file:
-                            # Try to decode with utf-8 and fallback to iso-8859-1
-                            content = file.read()
-                            try:
-                                decoded_content = content.decode('utf-8').strip()
-                            except UnicodeDecodeError:
-                                try:
-                                    decoded_content = content.decode('windows-1250').strip()
-                                except UnicodeDecodeError:
-                                    decoded_content = content.decode('iso-8859-1').strip()
-                            lines = decoded_content.split('\n')
-                            if len(lines) < 3: continue
-                            
-                            # Extract correct answers
-                            correct_answers = []
-                            if lines[0].startswith('X'):
-                                correct_answers = [int(x) for x in (lines[0][1:]).strip()]
-                            
-                            # Find the question line and check for image reference
-                            question = lines[1].split('[/img]')[-1].strip()
-                            
-                            # Extract answers
-                            answers = []
-                            for i, line in enumerate(lines[2:]):
-                                if line.strip():
-                                    answers.append((line.strip(), (correct_answers[i] == 1) if (len(correct_answers) >= i+1) else False))
-                            
-                            self.questions_list[question_id] = {question: answers}
-                            # self.question_list.addItem(f"{question_id}: {question}")
-                    except Exception as e:
-                        print(f"Error processing text file {file_info.filename}: {str(e)}")
-            
-            # Second pass: Process image files
-            for file_info in zip_ref.infolist():
-                if file_info.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                    try:
-                        # Get question ID from filename (assuming format like "1.png")
-                        base_name = os.path.basename(file_info.filename)
-                        question_id = int(os.path.splitext(base_name)[0])
-                        
-                        # Read image data and create PIL Image
-                        with zip_ref.open(file_info) as image_file:
-                            image_data = image_file.read()
-                            image = Image.open(io.BytesIO(image_data))
-                            
-                            # If this question has text, remove the text area from the image
-                            if question_id in self.questions_list:
-                                question = list(self.questions_list[question_id].keys())[0]
-                                if question.strip():
-                                    image = self.image_drop_area.remove_text_area(image, question)
-                            
-                            self.images[question_id] = image
-                    except Exception as e:
-                        print(f"Error processing image {file_info.filename}: {str(e)}")
-
         self.question_no = list(self.questions_list.keys())[0] or 0
+        self.bank_replaced()
         self.update_question_list()
 
+        print(f"Imported {len(questions_list)} questions and {self.image_summary()}")
         QMessageBox.information(self, "Import Success", "Test imported successfully!")
 
 
+    def image_summary(self):
+        with_image, unique, size = image_usage(self.images)
+        return f"{with_image} images ({unique} distinct, {size / 2**20:.1f} MB decoded)"
+
+
+    def import_from_text(self, filename):
+        """Add the questions of a text document to the bank"""
+        import importer
+        started = time.perf_counter()
+        questions_list, _, _ = importer.import_text(filename)
+        if not questions_list:
+            QMessageBox.warning(self, "Import Error", "No questions found in the file")
+            return
+        self.add_questions(list(question_data.items())[0] for question_data in questions_list.values())
+        print(f"Added {len(questions_list)} questions from {os.path.basename(filename)} in {time.perf_counter() - started:.2f} s")
+        QMessageBox.information(self, "Import Success", f"Added {len(questions_list)} questions")
+
+
+    def add_questions(self, questions, images=()):
+        """Append (question, answers) pairs after the last question, with a single update of the list, `images` go with them in order"""
+        images = list(images)
+        first = question_id = max(self.questions_list.keys(), default=0) + 1
+        with self.history.group():
+            for i, (question, answers) in enumerate(questions):
+                self.questions_list[question_id] = {question: answers}
+                if i < len(images) and images[i] is not None: self.images[question_id] = images[i]
+                self.question_edited(question_id)
+                question_id += 1
+        self.update_question_list()
+        return range(first, question_id)
+
+
+    def add_image_questions(self, paths):
+        """New question for every image among the dropped files and folders, decoded on the job pool"""
+        import importer
+        key = ('images',)
+        if self.jobs.is_running(key): return
+        started = time.perf_counter()
+        
+        dialog = QProgressDialog("Loading images...", "Cancel", 0, 0, self)
+        dialog.setWindowTitle("Add Images")
+        dialog.setWindowModality(Qt.NonModal)
+        dialog.setMinimumDuration(300)
+        dialog.setValue(0)
+        
+        def finished(key, result):
+            dialog.reset()
+            loaded, errors = result
+            if loaded:
+                added = self.add_questions((("", []) for _ in loaded), (image for _, image in loaded))
+                self.question_no = added[0]
+                self.reselect_question()
+                print(f"Added {len(loaded)} image questions in {time.perf_counter() - started:.2f} s")
+            if errors:
+                QMessageBox.warning(self, "Add Images", f"{len(errors)} files could not be loaded:\n" + "\n".join(errors[:10]))
+            elif not loaded:
+                QMessageBox.warning(self, "Add Images", "No images found among the dropped files")
+        
+        def failed(key, error):
+            dialog.reset()
+            traceback_lines = error.strip().split('\n')
+            QMessageBox.critical(self, "Add Images", f"Error loading images: {traceback_lines[-1]}")
+        
+        def progress(key, done, total, stage):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+        
+        dialog.canceled.connect(lambda: self.jobs.cancel(key))
+        # the worker also writes the images to the autosave journal, encoding hundreds of them would freeze the window
+        self.jobs.start(key, importer.import_images, paths, prepare=self.journal.prepare_image,
+                        pass_job=True, on_finished=finished, on_failed=failed, on_progress=progress)
+
+
+    def import_from_json(self, filename):
+        """Import web Testownik JSON on the job pool, images are downloaded while the file is parsed"""
+        import importer
+        key = ('import', os.path.abspath(filename))
+        if self.jobs.is_running(key): return
+        started = time.perf_counter()
+        
+        dialog = QProgressDialog(f"Importing {os.path.basename(filename)}...", "Cancel", 0, 0, self)
+        dialog.setWindowTitle("JSON Import")
+        dialog.setWindowModality(Qt.NonModal)
+        dialog.setMinimumDuration(300)
+        dialog.setValue(0)
+        
+        def finished(key, result):
+            dialog.reset()
+            questions_list, images, errors = result
+            if not questions_list:
+                QMessageBox.warning(self, "Import Error", "No questions found in the file")
+                return
+            
+            self.jobs.cancel_all()
+            self.close_project()
+            self.questions_list.clear()
+            self.questions_list.update(questions_list)
+            self.images = images
+            self.question_list.clear()
+            self.question_no = list(self.questions_list.keys())[0]
+            self.bank_replaced()
+            self.update_question_list()
+            self.reselect_question()
+            
+            print(f"Imported {len(questions_list)} questions and {self.image_summary()} in {time.perf_counter() - started:.2f} s")
+            if errors:
+                QMessageBox.warning(self, "Import", f"Test imported, but {len(errors)} images could not be downloaded:\n" + "\n".join(errors[:10]))
+            else:
+                QMessageBox.information(self, "Import Success", "Test imported successfully!")
+        
+        def failed(key, error):
+            dialog.reset()
+            traceback_lines = error.strip().split('\n')
+            QMessageBox.critical(self, "Import Error", f"Error importing test: {traceback_lines[-1]}")
+        
+        def progress(key, done, total, stage):
+            dialog.setLabelText(f"Downloading images of {os.path.basename(filename)}..." if stage == 'images'
+                                else f"Importing {os.path.basename(filename)}... ({done} questions)")
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+        
+        dialog.canceled.connect(lambda: self.jobs.cancel(key))
+        # a shard manifest is JSON too, import_bank reads the shards it lists
+        self.jobs.start(key, importer.import_bank, filename, pass_job=True, on_finished=finished, on_failed=failed, on_progress=progress)
+
+
+    def merge_tests(self):
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Merge Tests", "", "Tests (*.zip *.json *.txt);;Zip Files (*.zip);;JSON Files (*.json);;Text Documents (*.txt)")
+        if filenames: self.merge_from_files(filenames)
+
+
+    def merge_from_files(self, filenames):
+        """Merge other banks into this one on the job pool, duplicates of questions already here are skipped"""
+        import importer
+        key = ('merge',)
+        if self.jobs.is_running(key): return
+        started = time.perf_counter()
+        
+        existing = [(question_id, *list(question_data.items())[0], self.similarity.grams(question_id))
+                    for question_id, question_data in self.questions_list.items()]
+        existing_images = set(self.images.keys())
+        next_id = max(self.questions_list.keys(), default=0) + 1
+        
+        dialog = QProgressDialog("Merging tests...", "Cancel", 0, len(filenames), self)
+        dialog.setWindowTitle("Merge Tests")
+        dialog.setWindowModality(Qt.NonModal)
+        dialog.setMinimumDuration(300)
+        dialog.setValue(0)
+        
+        def finished(key, merger):
+            dialog.reset()
+            # questions edited meanwhile are kept as they are now, the merge only adds
+            with self.history.group():
+                for question_id, question_data in merger.questions_list.items():
+                    new_id = question_id if question_id not in self.questions_list else max(self.questions_list.keys()) + 1
+                    self.questions_list[new_id] = question_data
+                    if question_id in merger.images: self.images[new_id] = merger.images.pop(question_id)
+                    self.question_edited(new_id)
+                for question_id, image in merger.images.items():
+                    if question_id in self.questions_list and question_id not in self.images:
+                        self.images[question_id] = image
+                        self.question_edited(question_id)
+            if self.question_no not in self.questions_list and self.questions_list:
+                self.question_no = list(self.questions_list.keys())[0]
+            self.update_question_list()
+            self.reselect_question()
+            
+            report = merger.report()
+            print(f"Merged {len(filenames)} tests in {time.perf_counter() - started:.2f} s\n{report}")
+            message = QMessageBox(QMessageBox.Information, "Merge Tests", report.split('\n')[0] + (f", {len(merger.errors)} errors" if merger.errors else ""), parent=self)
+            if len(report.split('\n')) > 1: message.setDetailedText(report)
+            message.exec()
+        
+        def failed(key, error):
+            dialog.reset()
+            traceback_lines = error.strip().split('\n')
+            QMessageBox.critical(self, "Merge Error", f"Error merging tests: {traceback_lines[-1]}")
+        
+        def progress(key, done, total, stage):
+            if stage == 'files': dialog.setValue(done)
+        
+        dialog.canceled.connect(lambda: self.jobs.cancel(key))
+        self.jobs.start(key, importer.merge_banks, filenames, existing, existing_images, next_id,
+                        pass_job=True, on_finished=finished, on_failed=failed, on_progress=progress)
+
+
     def update_answer_inputs(self):
         while len(self.answer_fields) > 1 and all(field.text_edit.text().strip() == '' for field in self.answer_fields[-2:]):
             widget = self.answer_container.takeAt(len(self.answer_fields) - 1).widget()
@@ -884,6 +1167,17 @@ class TestownikCreator(QMainWindow):
         return new_field
 
 
+    def share_image(self, image):
+        """Swap a dropped image for the one in use with the same pixels, hashing them on a worker instead of the GUI"""
+        def finished(key, shared):
+            if shared is image: return
+            if self.image_drop_area.pil_image is image: self.image_drop_area.pil_image = shared
+            for question_id in list(self.images):
+                if peek_image(self.images, question_id) is image: self.images[question_id] = shared
+
+        self.jobs.start(('share', id(image)), shared_images.share, image, on_finished=finished)
+
+
     def delete_image(self):
         self.image_drop_area.reset()
         self.update_answer_field()
@@ -904,9 +1198,10 @@ class TestownikCreator(QMainWindow):
                 
                 
                 if question_id in self.images:
+                    thumbnail = self.images.thumbnail(question_id) if isinstance(self.images, ProjectImages) else None
                     image = self.images[question_id]
                     self.image_drop_area.pil_image = image
-                    self.image_drop_area.load_image()
+                    self.image_drop_area.load_image(thumbnail)
                 else:
                     self.image_drop_area.reset()
 
@@ -924,8 +1219,9 @@ class TestownikCreator(QMainWindow):
                     id += 1
                     new_field = self.add_answer_field(answer, is_correct)
 
-            self.update_similar_question(current.text())
+            self.update_similar_question(list(question_data.keys())[0])
             self.update_answer_inputs()
+            self.update_llm_button()
         self.is_changing = False
 
 
@@ -949,9 +1245,14 @@ class TestownikCreator(QMainWindow):
     def update_question_list(self):
         if self.question_list.count() != len(self.questions_list):
             self.question_list.clear()
+            self.question_items = {}
+            self.hidden_questions = set()
             for key, value in self.questions_list.items():
                 for question, answers in value.items():
-                    self.question_list.addItem(self.update_question_item(QListWidgetItem(), key, question, answers))
+                    item = self.update_question_item(QListWidgetItem(), key, question, answers)
+                    self.question_list.addItem(item)
+                    self.question_items[key] = item
+            self.filter_question_list()
         else:
             for i in range(self.question_list.count()):
                 item = self.question_list.item(i)
@@ -961,14 +1262,35 @@ class TestownikCreator(QMainWindow):
                 self.update_question_item(item, key, question, answers)
 
 
+    def search_changed(self):
+        self.shown_questions = set()
+        self.filter_question_list()
+
+
+    def filter_question_list(self):
+        """Hide the questions not matching the search box, the edited ones stay visible until the search changes"""
+        if len(self.question_items) != self.question_list.count(): return  # the list is being rebuilt
+        matches = self.search.search(self.search_input.text())
+        hidden = self.question_items.keys() - matches - self.shown_questions if matches is not None else set()
+        # typing one more letter only changes a few rows, leave the others alone
+        for key in hidden ^ self.hidden_questions:
+            self.question_items[key].setHidden(key in hidden)
+        self.hidden_questions = hidden
+
+
     def update_questions_dict(self):
         if self.is_changing: return
         text = self.question_input.text()
         lines = text.split('\n')
 
         if self.multiline_paste and len(lines) > 1:
-            question = strip_str(lines[0])
-            answers = [(strip_str(line), False) for line in lines[1:] if line.strip()]
+            import importer
+            if importer.many_questions(lines):
+                # a pasted document of numbered questions, this one gets the first and the rest are added after the last
+                pasted = list(importer.parse_text_questions(lines)) or [("", [])]
+            else:
+                pasted = [(strip_str(lines[0]), [(strip_str(line), False) for line in lines[1:] if line.strip()])]
+            question, answers = pasted[0]
 
             # Clear existing answer fields
             while self.answer_fields:
@@ -986,6 +1308,7 @@ class TestownikCreator(QMainWindow):
             self.is_changing = False
 
             self.questions_list[self.question_no] = {question: answers}
+            if len(pasted) > 1: self.add_questions(pasted[1:])
             self.update_question_list()
 
         else:
@@ -1000,12 +1323,16 @@ class TestownikCreator(QMainWindow):
         elif self.question_no in self.images:
             del self.images[self.question_no]
 
+        self.question_edited(self.question_no)
         self.update_similar_question(question)
 
 
     def remove_question(self):
         self.is_changing = True
+        self.jobs.cancel(('llm', self.question_no))
         self.questions_list.pop(self.question_no, None)
+        self.images.pop(self.question_no, None)
+        self.question_edited(self.question_no)
         last_id = 0
         for i in self.questions_list.keys():
             if int(i) > last_id: last_id = i
@@ -1031,6 +1358,7 @@ class TestownikCreator(QMainWindow):
         self.question_hint.setText(f"Enter your question: [{self.question_no}]")
         # Add the new question to questions_list
         self.questions_list[self.question_no] = {question: answers}
+        self.question_edited(self.question_no)
         self.update_question_list()
         
         # Clear inputs
@@ -1055,28 +1383,316 @@ class TestownikCreator(QMainWindow):
 
         if self.question_no in self.images:
             del self.images[self.question_no]
+            self.question_edited(self.question_no)
         self.is_changing = False
 
-    # def save_to_json(self):
+    def question_edited(self, question_id):
+        """Call after changing (or removing) a question or its image"""
+        if question_id in self.questions_list:
+            question, answers = list(self.questions_list[question_id].items())[0]
+            self.similarity.set(question_id, question)
+            self.search.set(question_id, question, answers)
+        else:
+            self.similarity.remove(question_id)
+            self.search.remove(question_id)
+        self.history.changed(question_id, self.questions_list, self.images)
+        if self.search_input.text(): self.shown_questions.add(question_id)
+        self.zip_dirty.add(question_id)
+        was_saved = not self.project_dirty
+        self.project_dirty.add(question_id)
+        if self.project and was_saved: self.update_title()
+        self.journal_pending.add(question_id)
+        self.journal_timer.start(journal_delay_ms)
+        self.prefetcher.edited(question_id)
+
+
+    def undo(self):
+        self.apply_history(self.history.undo(), "undo")
+
+
+    def redo(self):
+        self.apply_history(self.history.redo(), "redo")
+
+
+    def apply_history(self, states, action):
+        if states is None:
+            self.statusBar().showMessage(f"Nothing to {action}", 3000)
+            return
+        for question_id, state in states.items():
+            if state is None:
+                self.jobs.cancel(('llm', question_id))
+                self.questions_list.pop(question_id, None)
+            else:
+                question, answers, _ = state
+                self.questions_list[question_id] = {question: list(answers)}
+            try:
+                restore_image(self.images, question_id, state[2] if state else None)
+            except Exception as e:
+                print(f"Failed to restore image of question {question_id}: {str(e)}")
+            self.question_edited(question_id)
+
+        # show the first question the step changed
+        present = [question_id for question_id in states if question_id in self.questions_list]
+        if present: self.question_no = present[0]
+        elif self.question_no not in self.questions_list: self.question_no = next(iter(self.questions_list), 0)
+        self.update_question_list()
+        if self.question_no in self.questions_list:
+            self.reselect_question()
+        else:
+            self.clear_inputs()
+        self.statusBar().showMessage(f"{action.capitalize()}: {len(states)} question{'s' if len(states) != 1 else ''}", 3000)
+
+
+    def show_memory(self):
+        """Ctrl+Shift+M, memory taken by the bank and the caches, for finding what makes big banks grow"""
+        if self.memory_dialog is None:
+            self.memory_dialog = MemoryDialog(self)
+        else:
+            self.memory_dialog.refresh()
+        self.memory_dialog.show()
+        self.memory_dialog.raise_()
+
+
+    def bank_replaced(self, grams=None):
+        """Call after replacing the whole bank, e.g. on import"""
+        self.last_zip_export = None
+        self.prefetcher.clear()
+        self.shown_questions = set()
+        self.similarity.clear()
+        self.search.clear()
+        for question_id, question_data in self.questions_list.items():
+            question, answers = list(question_data.items())[0]
+            self.similarity.set(question_id, question, grams.get(question_id) if grams else None)
+            self.search.set(question_id, question, answers)
+        self.history.reset(self.questions_list, self.images)
+        self.compact_journal(force=True)
+
+
+    def flush_journal(self):
+        self.journal_timer.stop()
+        if not self.journal_pending: return
+        try:
+            self.journal.record(self.questions_list, self.images, sorted(self.journal_pending))
+        except Exception as e:
+            print(f"Failed to write autosave journal: {str(e)}")
+        self.journal_pending.clear()
+        if self.journal.entries >= journal_compact_entries:
+            self.compact_journal()
+
+
+    def compact_journal(self, force=False):
+        if not force and not self.journal_pending and self.journal.entries == 0: return
+        if self.journal.compacting:
+            # one compaction at a time, try again once the running one is done
+            if not self.compact_retry_pending:
+                self.compact_retry_pending = True
+                QTimer.singleShot(200, self.retry_compaction)
+            return
+        self.journal_timer.stop()
+        try:
+            # pending edits go to the journal first, so they are safe even if the snapshot never gets written
+            if self.journal_pending:
+                self.journal.record(self.questions_list, self.images, sorted(self.journal_pending))
+            self.journal_pending.clear()
+            captured = self.journal.start_compaction(self.questions_list, self.images, self.project_dirty if self.project else None)
+        except Exception as e:
+            self.journal.compacting = False
+            print(f"Failed to write autosave snapshot: {str(e)}")
+            return
+        # encoding the images and writing the snapshot takes time proportional to the bank, so it runs on the pool
+        self.jobs.start(('journal', 'compact'), self.journal.write_snapshot, captured, self.question_no, self.project.path if self.project else None,
+                        cancellable=False, on_failed=self._compaction_failed)
+
+
+    def _compaction_failed(self, key, error):
+        print(f"Failed to write autosave snapshot:\n{error}")
+
+
+    def retry_compaction(self):
+        self.compact_retry_pending = False
+        self.compact_journal(force=True)
+
+
+    def restore_session(self):
+        missing_base = []
+        
+        def open_base(path):
+            if not os.path.exists(path):
+                missing_base.append(path)
+                return {}, {}
+            self.project = ProjectFile(path)
+            questions_list, images, _, _ = self.project.load()
+            return questions_list, images
+        
+        try:
+            questions_list, images, question_no, base = self.journal.replay(open_base)
+        except Exception:
+            self.close_project()
+            QMessageBox.critical(self, "Restore Error", f"Error restoring previous session: {traceback.format_exc()}")
+            return
+        
+        if missing_base:
+            QMessageBox.warning(self, "Restore session", f"The project {missing_base[0]} of your previous session was moved or deleted, "
+                                "only the questions changed since it was last saved can be restored.")
+        
+        # after a clean exit the session just continues, only a crash asks first
+        was_clean = self.journal.was_clean()
+        self.journal.set_clean(False)
+        has_content = any(question.strip() or answers for question_data in questions_list.values() for question, answers in question_data.items())
+        if not has_content or (not was_clean and QMessageBox.question(self, "Restore session", "Restore the questions from your previous session?") != QMessageBox.Yes):
+            self.close_project()
+            self.journal.discard()
+            return
+        
+        self.questions_list.clear()
+        self.questions_list.update(questions_list)
+        self.images = images
+        self.question_no = question_no
+        self.similarity.clear()
+        self.search.clear()
+        for question_id, question_data in self.questions_list.items():
+            question, answers = list(question_data.items())[0]
+            self.similarity.set(question_id, question)
+            self.search.set(question_id, question, answers)
+        self.history.reset(self.questions_list, self.images)
+        if self.project:
+            # everything that differs from the project on disk is still unsaved
+            self.project_dirty = set(self.journal.replayed_ids)
+            self.update_title()
+        self.update_question_list()
+        self.reselect_question()
+
+
+    def update_title(self):
+        title = "Testownik Creator"
+        if self.project:
+            title += f" - {os.path.basename(self.project.path)}{' *' if self.project_dirty else ''}"
+        self.setWindowTitle(title)
+
+
+    def close_project(self):
+        if self.project:
+            self.project.close()
+        self.project = None
+        self.project_dirty = set()
+        self.update_title()
+
+
+    def open_project(self, filename):
+        self.jobs.cancel_all()
+        self.close_project()
+        self.project = ProjectFile(filename)
+        questions_list, images, grams, question_no = self.project.load()
         
-    #     with open('test.json', 'w') as f:
-    #         json.dump(self.questions_list, f, indent=4)
+        self.questions_list.clear()
+        self.questions_list.update(questions_list)
+        self.images = images
+        self.question_no = question_no
+        self.question_list.clear()
+        self.bank_replaced(grams)
+        self.update_title()
+        self.update_question_list()
+        self.reselect_question()
+
+
+    def save_project(self):
+        if not self.project:
+            filename, _ = QFileDialog.getSaveFileName(self, "Save project", "", f"Testownik Creator Project (*{project_extension})")
+            if filename: self.save_project_as(filename)
+            return
+        try:
+            self.flush_journal()
+            self.project.save(self.questions_list, self.images, self.project_dirty, self.similarity, self.question_no,
+                              self.history.stored_hashes(self.project.path))
+        except Exception:
+            QMessageBox.critical(self, "Save Error", f"Error saving project: {traceback.format_exc()}")
+            return
+        self.project_dirty = set()
+        self.compact_journal(force=True)
+        self.update_title()
+
+
+    def save_project_as(self, filename):
+        if not filename.lower().endswith(project_extension):
+            filename += project_extension
+        try:
+            self.flush_journal()
+            if self.project and os.path.abspath(self.project.path) == os.path.abspath(filename):
+                self.project.save(self.questions_list, self.images, list(self.questions_list.keys()), self.similarity, self.question_no,
+                                  self.history.stored_hashes(self.project.path))
+            else:
+                project = ProjectFile.create(filename, self.questions_list, self.images, self.similarity, self.question_no)
+                if isinstance(self.images, ProjectImages):
+                    # the new file holds all the images now, load the remaining ones from there
+                    self.images.project = project
+                if self.project: self.project.close()
+                self.project = project
+        except Exception:
+            QMessageBox.critical(self, "Save Error", f"Error saving project: {traceback.format_exc()}")
+            return
+        self.project_dirty = set()
+        self.compact_journal(force=True)
+        self.update_title()
+
 
     def closeEvent(self, event):
-        # self.save_to_json()
+        self.jobs.cancel_all()
+        self.prefetcher.stop()
+        self.flush_journal()
+        # a running compaction is safe to cut short, the journal it replaces is only dropped at its end
+        self.jobs.wait(5000)
+        self.journal.close()
+        self.journal.set_clean()
         event.accept()
 
-def main():
+def main(measure_startup=False, watchdog_ms=None, trace_memory=False):
+    imports_done = time.perf_counter()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
     app = QApplication(sys.argv)
-    window = TestownikCreator()
+    window = TestownikCreator(restore=not measure_startup)
+    window_created = time.perf_counter()
     window.show()
+    if trace_memory:
+        window.show_memory()
+    
+    if watchdog_ms:
+        from stalls import StallWatchdog
+        watchdog = StallWatchdog(watchdog_ms, parent=app)
+        watchdog.start()
+    
+    if measure_startup:
+        def report():
+            # runs once the event loop went idle, so the first window was painted by then
+            shown = time.perf_counter()
+            print(f"imports:      {(imports_done - startup_started) * 1000:.0f} ms")
+            print(f"QApplication + window: {(window_created - imports_done) * 1000:.0f} ms")
+            print(f"first paint:  {(shown - window_created) * 1000:.0f} ms")
+            print(f"total:        {(shown - startup_started) * 1000:.0f} ms (since main.py started, add interpreter and unpacking time on top)")
+            print(f"loaded modules: {len(sys.modules)}, heavy ones: {[name for name in ('PIL.Image', 'openai', 'requests') if name in sys.modules]}")
+            app.quit()
+        QTimer.singleShot(0, report)
+    
     sys.exit(app.exec())
 
 
 if __name__ == '__main__':
+    # sharded exports run in spawned processes, which a frozen build has to hand over to multiprocessing
+    import multiprocessing
+    multiprocessing.freeze_support()
     if '--build' in sys.argv:
         subprocess.run(shlex.split('pyinstaller --onefile --clean --name=testownik-creator -y main.py --icon ./logo.png --noconsole --exclude-module "**/*.git" --exclude-module "**/__cache__" --exclude-module "**/dist" --exclude-module "**/build"'))
+    elif '--startup-time' in sys.argv:
+        main(measure_startup=True)
+    elif len(sys.argv) == 2 and sys.argv[1].split('=')[0] == '--watchdog':
+        from stalls import default_threshold_ms
+        main(watchdog_ms=int(sys.argv[1].split('=')[1]) if '=' in sys.argv[1] else default_threshold_ms)
+    elif '--memory' in sys.argv:
+        main(trace_memory=True)
     elif len(sys.argv) > 1:
-        print('Testownik Creator help page\n\n--build     to build project\n\nyeah thats all')
+        print('Testownik Creator help page\n\n--build            to build project\n--startup-time     to print how long it takes to show the window, then quit\n'
+              '--watchdog[=ms]    to log freezes of the window longer than ms (default 500) with the code that caused them to stalls.log\n'
+              '--memory           to trace Python allocations from the start and open the memory view (also Ctrl+Shift+M)\n\nyeah thats all')
     else:
         main()
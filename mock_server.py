@@ -0,0 +1,261 @@
+"""
+Local stand-in for an OpenAI compatible API, used to test and benchmark LLM filling for free.
+
+    python mock_server.py --port 8000 --latency 0.3 --error-rate 0.05 --rate-limit 20
+
+Then set the API URL in settings to http://127.0.0.1:8000/v1 (any key and model will do).
+
+It also serves generated images on GET /images/<name>.png, and with `--bank 5000 --bank-file bank.json`
+writes a web Testownik JSON bank referencing them, to test JSON import without touching the internet.
+"""
+import argparse, io, json, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOptions():
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0.0, stream_chunk_delay=0.01, slow_rate=0.0, slow_latency=3.0):
+        self.latency = latency                        # base response time in seconds
+        self.jitter = jitter                          # random extra response time in seconds
+        self.slow_rate = slow_rate                    # fraction of completions taking slow_latency more, the tail real APIs have
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate                  # fraction of requests answered with HTTP 500
+        self.rate_limit = rate_limit                  # requests per second, 0 disables, excess gets HTTP 429
+        self.stream_chunk_delay = stream_chunk_delay  # delay between streamed chunks
+
+
+
+class MockStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.streamed = 0
+        self.images = 0
+
+
+    def add(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+
+class RateLimiter():
+    """Token bucket allowing `rate` requests per second with bursts of the same size"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def allow(self):
+        if self.rate <= 0: return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1: return False
+            self.tokens -= 1
+            return True
+
+
+
+def mock_completion(messages):
+    """Build an answer in the format the prompts from llm.py ask for"""
+    system_prompt = next((m['content'] for m in messages if m.get('role') == 'system'), '')
+    user_prompt = next((m['content'] for m in messages if m.get('role') == 'user'), '')
+
+    # batched prompt: one JSON object keyed by question id
+    batch = re.findall(r'^# id: (\S+), generate (\d+) answers', user_prompt, re.MULTILINE)
+    if 'JSON' in system_prompt and batch:
+        result = {question_id: [f"Mock answer {i + 1} for {question_id}" for i in range(int(count))] for question_id, count in batch}
+        return f"```json\n{json.dumps(result, ensure_ascii=False)}\n```"
+
+    match = re.search(r'Generate (\d+) new answers', system_prompt)
+    count = int(match.group(1)) if match else 3
+    return "```\n" + "".join(f"[x] Mock answer {i + 1}\n" for i in range(count)) + "```"
+
+
+def mock_image(name):
+    """Small PNG, different for every name"""
+    from PIL import Image
+    seed = sum(name.encode('utf-8'))
+    image = Image.new('RGB', (320, 240), ((seed * 37) % 256, (seed * 91) % 256, (seed * 13) % 256))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def write_json_bank(path, count, base_url, image_every=2):
+    """Web Testownik JSON bank with `count` questions, every `image_every`-th one with an image from the server"""
+    base_url = base_url.rsplit('/v1', 1)[0]
+    questions = []
+    for i in range(1, count + 1):
+        question = {"question": f"Mock question {i}", "answers": [{"answer": f"Answer {j}", "correct": j == 1} for j in range(1, 5)], "multiple": True}
+        if image_every and i % image_every == 0:
+            question["image"] = f"{base_url}/images/{i}.png"
+        questions.append(question)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"title": "Mock bank", "description": "Generated by mock_server.py", "questions": questions}, f, ensure_ascii=False)
+
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are separate writes, keep-alive would stall on delayed ACKs
+    options: MockOptions = None
+    stats: MockStats = None
+    limiter: RateLimiter = None
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        match = re.fullmatch(r'/images/([\w\-]+)\.png', self.path)
+        if not match:
+            return self.send_json(404, {"error": {"message": f"Unknown route {self.path}"}})
+
+        self.stats.add('images')
+        time.sleep(self.options.latency + random.random() * self.options.jitter)
+        body = mock_image(match.group(1))
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            return self.send_json(400, {"error": {"message": "Invalid JSON body"}})
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self.send_json(404, {"error": {"message": f"Unknown route {self.path}"}})
+
+        self.stats.add('requests')
+        if not self.limiter.allow():
+            self.stats.add('rate_limited')
+            return self.send_json(429, {"error": {"message": "Rate limit exceeded"}}, {'Retry-After': '1'})
+
+        time.sleep(self.options.latency + random.random() * self.options.jitter)
+        if random.random() < self.options.slow_rate:
+            time.sleep(self.options.slow_latency)
+
+        if random.random() < self.options.error_rate:
+            self.stats.add('errors')
+            return self.send_json(500, {"error": {"message": "Mock server error"}})
+
+        messages = request.get('messages', [])
+        content = mock_completion(messages)
+        model = request.get('model', 'mock')
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        created = int(time.time())
+
+        if request.get('stream'):
+            self.stats.add('streamed')
+            return self.send_stream(content, model, created)
+
+        self.send_json(200, {
+            "id": f"chatcmpl-mock-{created}",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+
+    def send_stream(self, content, model, created):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None):
+            data = {
+                "id": f"chatcmpl-mock-{created}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": ""})
+        for i in range(0, len(content), 16):
+            chunk({"content": content[i:i + 16]})
+            time.sleep(self.options.stream_chunk_delay)
+        chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+
+def start_server(host='127.0.0.1', port=0, options: MockOptions = None):
+    """Start the mock server on a background thread, returns the server (use `server.server_address` for the port)"""
+    options = options or MockOptions()
+    handler = type('BoundMockHandler', (MockHandler,), {
+        'options': options,
+        'stats': MockStats(),
+        'limiter': RateLimiter(options.rate_limit),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.stats = handler.stats
+    server.options = options
+    server.url = f"http://{host}:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI compatible stand-in server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="base response time in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra response time in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests failing with HTTP 500")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="requests per second before HTTP 429, 0 disables")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="fraction of completions taking --slow-latency longer")
+    parser.add_argument('--slow-latency', type=float, default=3.0)
+    parser.add_argument('--bank', type=int, default=0, help="write a JSON bank with this many questions for import tests")
+    parser.add_argument('--bank-file', default='mock_bank.json')
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, MockOptions(args.latency, args.jitter, args.error_rate, args.rate_limit,
+                                                            slow_rate=args.slow_rate, slow_latency=args.slow_latency))
+    print(f"Mock server running, set API URL to {server.url}")
+    if args.bank:
+        write_json_bank(args.bank_file, args.bank, server.url)
+        print(f"Wrote {args.bank} questions to {args.bank_file}")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        stats = server.stats
+        print(f"\n{stats.requests} requests, {stats.errors} errors, {stats.rate_limited} rate limited, {stats.streamed} streamed, {stats.images} images")
+
+
+if __name__ == '__main__':
+    main()
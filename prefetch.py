@@ -0,0 +1,216 @@
+"""
+Idle-time prefetch of incorrect answers.
+
+Once nothing was edited for a few seconds, the questions edited last that have answers but fewer incorrect ones
+than the answer count get their answers generated in the background, so clicking ✨ on them applies the answers
+right away. Runs on a pool of its own with a single low priority thread, so it never holds up jobs the user
+started, and within a number of requests per minute and a token budget per session.
+"""
+import collections, json, time
+
+from PySide6.QtCore import QObject, QThread, QTimer
+
+from jobs import JobManager
+from llm import estimate_tokens
+
+
+idle_ms = 4000             # without edits before prefetching
+requests_per_minute = 4
+max_cached = 50            # questions with answers waiting for a click
+recent_questions = 20      # edited questions looked at, the most recent first
+failure_pause = 60         # seconds without prefetching after a failed request
+
+
+
+def prompt_answers(answers):
+    """Answers as ✨ sends them, without empty ones and with all of them correct if none is"""
+    answers = [(answer.strip(), correct) for answer, correct in answers if answer.strip()]
+    if not any(correct for _, correct in answers):
+        answers = [(answer, True) for answer, _ in answers]
+    return answers
+
+
+def new_answers(generated, answers):
+    """Generated answers the question does not have yet"""
+    present = {answer.strip().lower() for answer, _ in answers}
+    return [answer for answer in generated if answer.lower() not in present]
+
+
+def signature(question, answers):
+    """What the prefetched answers depend on, incorrect answers added since only make some of them duplicates"""
+    return question.strip(), tuple(answer for answer, correct in prompt_answers(answers) if correct)
+
+
+
+class Prefetcher(QObject):
+    def __init__(self, llm, questions_list, parent=None, on_ready=None, busy=None):
+        """
+        `on_ready(question_id, answers)` gets the answers for a ✨ click made while they were on the way, None if
+        the request failed, `busy(question_id)` tells questions with a ✨ request of their own to leave alone
+        """
+        super().__init__(parent)
+        self.llm = llm
+        self.questions_list = questions_list
+        self.on_ready = on_ready
+        self.busy = busy or (lambda question_id: False)
+        self.jobs = JobManager(self, max_threads=1)
+        self.jobs.pool.setThreadPriority(QThread.LowestPriority)
+        self.cache = collections.OrderedDict()       # question id -> (signature, answers)
+        self.recent = collections.OrderedDict()      # question id -> None, the most recently edited last
+        self.running = None                          # (question id, signature) on the way
+        self.waiting = set()                         # question ids clicked while their answers are on the way
+        self.failed = set()                          # signatures not tried again
+        self.started = collections.deque()           # monotonic times of the requests of the last minute
+        self.paused_until = 0.0
+        self.tokens = 0                              # estimated tokens spent this session
+        self.requests = 0
+        self.used = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+
+
+    def enabled(self):
+        return self.llm.prefetch and self.budget() > 0
+
+
+    def budget(self):
+        try:
+            return int(self.llm.prefetch_tokens) - self.tokens
+        except ValueError:
+            return 0
+
+
+    def edited(self, question_id):
+        """Call on every edit, restarts the idle countdown"""
+        self.recent.pop(question_id, None)
+        self.recent[question_id] = None
+        while len(self.recent) > recent_questions:
+            self.recent.popitem(last=False)
+        if self.llm.prefetch: self.timer.start(idle_ms)
+
+
+    def candidate(self):
+        """Recently edited question worth prefetching, as (id, question, answers, signature)"""
+        try:
+            count = int(self.llm.count)
+        except ValueError:
+            return None
+        if count < 1: return None
+        for question_id in reversed(self.recent):
+            if question_id in self.cache or question_id not in self.questions_list or self.busy(question_id): continue
+            question, answers = list(self.questions_list[question_id].items())[0]
+            answers = prompt_answers(answers)
+            if not question.strip() or not answers: continue
+            if sum(1 for _, correct in answers if not correct) >= count: continue
+            key = signature(question, answers)
+            if key in self.failed: continue
+            return question_id, question, answers, key
+        return None
+
+
+    def tick(self):
+        if not self.enabled() or self.running: return
+        now = time.monotonic()
+        while self.started and now - self.started[0] > 60:
+            self.started.popleft()
+        wait = max(self.paused_until - now, 60 - (now - self.started[0]) if len(self.started) >= requests_per_minute else 0)
+        if wait > 0:
+            self.timer.start(int(wait * 1000) + 100)
+            return
+        found = self.candidate()
+        if found is None: return
+        question_id, question, answers, key = found
+        messages, max_tokens = self.llm.single_prompt(question, answers, int(self.llm.count))
+        cost = estimate_tokens(json.dumps(messages)) + max_tokens
+        if cost > self.budget():
+            print(f"Prefetch token budget used up, {self.tokens} tokens spent")
+            return
+        self.tokens += cost
+        self.requests += 1
+        self.started.append(now)
+        self.running = (question_id, key)
+        self.jobs.start(('prefetch', question_id), self.llm.generate_answers, question, answers,
+                        on_finished=self._finished, on_failed=self._failed)
+
+
+    def _finished(self, key, answers):
+        question_id, answers_key = self.running
+        self.running = None
+        if question_id in self.waiting:
+            self.waiting.discard(question_id)
+            # edited since, the click gets a request of its own
+            if not self.current(question_id, answers_key): answers = None
+            else:
+                self.used += 1
+                answers = new_answers(answers, list(self.questions_list[question_id].values())[0])
+            if self.on_ready: self.on_ready(question_id, answers)
+        else:
+            self.cache.pop(question_id, None)
+            self.cache[question_id] = (answers_key, answers)
+            while len(self.cache) > max_cached:
+                self.cache.popitem(last=False)
+        # the rest of the recent questions, while still idle
+        if not self.timer.isActive(): self.timer.start(idle_ms)
+
+
+    def _failed(self, key, error):
+        question_id, answers_key = self.running
+        self.running = None
+        self.failed.add(answers_key)
+        self.paused_until = time.monotonic() + failure_pause
+        # the traceback is of no use here, the click that needs these answers shows its own error
+        print(f"Prefetch for question {question_id} failed, pausing prefetch for {failure_pause} s: {error.strip().splitlines()[-1]}")
+        if question_id in self.waiting:
+            self.waiting.discard(question_id)
+            # the click falls back to a request of its own
+            if self.on_ready: self.on_ready(question_id, None)
+
+
+    def current(self, question_id, answers_key):
+        if question_id not in self.questions_list: return False
+        return signature(*list(self.questions_list[question_id].items())[0]) == answers_key
+
+
+    def take(self, question_id, question, answers):
+        """Prefetched answers of the question as it is now, None if there are none"""
+        entry = self.cache.pop(question_id, None)
+        if entry is None or entry[0] != signature(question, answers): return None
+        self.used += 1
+        return new_answers(entry[1], answers)
+
+
+    def wait_for(self, question_id, question, answers):
+        """Lets a ✨ click wait for the prefetch on the way instead of asking again, True if there is one"""
+        if not self.running or self.running != (question_id, signature(question, answers)): return False
+        self.waiting.add(question_id)
+        return True
+
+
+    def is_waiting(self, question_id):
+        return question_id in self.waiting
+
+
+    def stop_waiting(self, question_id):
+        if question_id not in self.waiting: return False
+        self.waiting.discard(question_id)
+        return True
+
+
+    def describe(self):
+        return f"{self.used} of {self.requests} prefetches used, ~{self.tokens} tokens spent"
+
+
+    def clear(self):
+        """Call when the bank is replaced"""
+        if self.running: self.jobs.cancel(('prefetch', self.running[0]))
+        self.running = None
+        self.waiting.clear()
+        self.cache.clear()
+        self.recent.clear()
+        self.timer.stop()
+
+
+    def stop(self):
+        self.clear()
+        self.jobs.wait(1000)
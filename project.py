@@ -0,0 +1,332 @@
+import hashlib, io, json, os, sqlite3, threading, weakref
+from pathlib import Path
+from collections.abc import MutableMapping
+
+
+project_extension = '.tcproj'
+thumbnail_width = 200
+ingest_size = 1200  # dropped images are kept at most this big, twice what exports scale them to
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answers TEXT NOT NULL,
+    image TEXT,
+    trigrams TEXT
+);
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    thumbnail BLOB,
+    width INTEGER,
+    height INTEGER
+);
+"""
+
+
+def encode_image(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    data = buffer.getvalue()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def make_thumbnail(image):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_width, thumbnail_width * 4))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+
+def ingest_image(image):
+    """
+    Decode a dropped or pasted image at no more than `ingest_size`, upright and in a mode PNG can store.
+
+    JPEGs are decoded in draft mode straight at 1/2 to 1/8 scale, so a phone photo never gets decoded at full size.
+    """
+    from PIL import ImageOps
+    if image.format == 'JPEG':
+        # the draft scale keeps both sides at least as big as asked, so ask with the photo's own proportions
+        scale = ingest_size / max(image.size)
+        if scale < 1: image.draft('RGB', (int(image.width * scale), int(image.height * scale)))
+    image.load()
+    if max(image.size) > ingest_size:
+        image.thumbnail((ingest_size, ingest_size), reducing_gap=2.0)
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('1', 'L', 'LA', 'RGB', 'RGBA', 'P'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    return image
+
+
+def content_hash(image):
+    """Hash of the decoded pixels, the same for one picture however it was encoded"""
+    digest = hashlib.blake2b(f"{image.mode} {image.width}x{image.height}".encode(), digest_size=16)
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+
+class ImagePool():
+    """
+    Hands out one image object per distinct picture, so a diagram used by several questions
+    is kept in memory, stored and exported only once.
+
+    Images of the bank are never modified in place, which is what makes sharing them safe.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()  # importers share images from worker threads
+        self.images = weakref.WeakValueDictionary()  # content hash -> image
+
+
+    def share(self, image):
+        """The image already in use with the same pixels, or this one (decoded) if it is new"""
+        if image is None: return None
+        image.load()
+        key = content_hash(image)
+        with self.lock:
+            existing = self.images.get(key)
+            if existing is not None: return existing
+            self.images[key] = image
+        return image
+
+
+shared_images = ImagePool()
+
+
+def image_usage(images):
+    """
+    Distinct images of a bank and the memory their pixels take, images of a project that
+    were not opened yet are counted once per stored hash and take no memory.
+
+    Returns:
+        tuple[int, int, int]: questions with an image, distinct images, bytes of decoded pixels
+    """
+    pending = set(images.pending.values()) if isinstance(images, ProjectImages) else set()
+    loaded = images.loaded.values() if isinstance(images, ProjectImages) else images.values()
+    unique = {id(image): image for image in loaded if image is not None}
+    return len(images), len(pending) + len(unique), sum(len(image.getbands()) * image.width * image.height for image in unique.values())
+
+
+
+class StoredImage():
+    """Image row of a project file that was not decoded yet, can be read on any thread"""
+    def __init__(self, path, image_hash):
+        self.path = path
+        self.hash = image_hash
+
+
+    def data(self):
+        # own connection, sqlite connections can't be shared between threads
+        connection = sqlite3.connect(f"{Path(self.path).absolute().as_uri()}?mode=ro", uri=True)
+        try:
+            row = connection.execute("SELECT data FROM images WHERE hash = ?", (self.hash,)).fetchone()
+        finally:
+            connection.close()
+        if row is None: raise KeyError(f"Image {self.hash} is no longer in {self.path}")
+        return row[0]
+
+
+    def load(self):
+        from PIL import Image
+        image = Image.open(io.BytesIO(self.data()))
+        image.load()
+        return image
+
+
+
+def peek_image(images, key):
+    """Image of a question without decoding it here: a PIL image, a StoredImage or None"""
+    if isinstance(images, ProjectImages) and key in images.pending:
+        return StoredImage(images.project.path, images.pending[key])
+    return images[key] if key in images else None
+
+
+
+class ProjectImages(MutableMapping):
+    """
+    Images of an opened project, decoded only when a question actually needs them.
+
+    Behaves like the plain `{question id: PIL image}` dict used everywhere else.
+    """
+    def __init__(self, project, image_hashes: dict):
+        self.project = project
+        self.pending = dict(image_hashes)  # question id -> hash, not loaded yet
+        self.loaded = {}                   # question id -> image
+        self.decoded = weakref.WeakValueDictionary()  # hash -> image, questions sharing a picture decode it once
+
+
+    def __getitem__(self, key):
+        if key in self.loaded: return self.loaded[key]
+        image_hash = self.pending.pop(key)
+        image = self.decoded.get(image_hash)
+        if image is None:
+            image = shared_images.share(self.project.load_image(image_hash))
+            self.decoded[image_hash] = image
+        self.project.known_hashes[key] = (image, image_hash)
+        self.loaded[key] = image
+        return image
+
+
+    def __setitem__(self, key, image):
+        self.pending.pop(key, None)
+        self.loaded[key] = image
+
+
+    def __delitem__(self, key):
+        if key in self.pending: del self.pending[key]
+        else: del self.loaded[key]
+
+
+    def __contains__(self, key):
+        return key in self.loaded or key in self.pending
+
+
+    def __iter__(self):
+        yield from list(self.loaded.keys()) + list(self.pending.keys())
+
+
+    def __len__(self):
+        return len(self.loaded) + len(self.pending)
+
+
+    # the MutableMapping versions of these would decode every image on the way
+    def pop(self, key, *default):
+        if key in self.pending:
+            self.pending.pop(key)
+            return None
+        return self.loaded.pop(key, *default)
+
+
+    def clear(self):
+        self.pending.clear()
+        self.loaded.clear()
+
+
+    def thumbnail(self, key):
+        """PNG thumbnail of a question image, as long as it was not replaced since opening"""
+        if key in self.pending:
+            return self.project.load_thumbnail(self.pending[key])
+        known = self.project.known_hashes.get(key)
+        if known and known[0] is self.loaded.get(key):
+            return self.project.load_thumbnail(known[1])
+        return None
+
+
+
+class ProjectFile():
+    """
+    Native project file: a SQLite database with one row per question.
+
+    Images are stored once per content hash together with a thumbnail, so opening
+    a project only reads the question texts, and saving writes only changed rows.
+    """
+    def __init__(self, path, create=False):
+        self.path = path
+        if create:
+            self.connection = sqlite3.connect(path)
+        else:
+            # a plain connect would quietly create an empty project where the file went missing
+            if not os.path.exists(path): raise FileNotFoundError(f"Project file {path} does not exist")
+            self.connection = sqlite3.connect(f"{Path(path).absolute().as_uri()}?mode=rw", uri=True)
+        self.connection.executescript(schema)
+        self.known_hashes = {}  # question id -> (image object, hash) of images already in the database
+        self.object_hashes = {}  # id(image) -> (image object, hash), for images shared between questions
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def load(self):
+        """
+        Returns:
+            tuple[dict, ProjectImages, dict, int]: questions_list, images, trigrams by question id and the selected question id
+        """
+        questions_list = {}
+        image_hashes = {}
+        grams = {}
+        for question_id, question, answers, image_hash, trigrams in self.connection.execute(
+                "SELECT id, question, answers, image, trigrams FROM questions ORDER BY position, id"):
+            questions_list[question_id] = {question: [(answer, bool(correct)) for answer, correct in json.loads(answers)]}
+            if image_hash: image_hashes[question_id] = image_hash
+            if trigrams is not None: grams[question_id] = json.loads(trigrams)
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'question_no'").fetchone()
+        question_no = int(row[0]) if row and int(row[0]) in questions_list else next(iter(questions_list), 0)
+        return questions_list, ProjectImages(self, image_hashes), grams, question_no
+
+
+    def load_image(self, image_hash):
+        from PIL import Image
+        row = self.connection.execute("SELECT data FROM images WHERE hash = ?", (image_hash,)).fetchone()
+        image = Image.open(io.BytesIO(row[0]))
+        # decoded right away, so worker threads reading it later never race to decode the same object
+        image.load()
+        return image
+
+
+    def load_thumbnail(self, image_hash):
+        row = self.connection.execute("SELECT thumbnail FROM images WHERE hash = ?", (image_hash,)).fetchone()
+        return row[0] if row else None
+
+
+    def store_image(self, question_id, image):
+        for known in (self.known_hashes.get(question_id), self.object_hashes.get(id(image))):
+            if known and known[0] is image:
+                self.known_hashes[question_id] = known
+                return known[1]
+        data, image_hash = encode_image(image)
+        exists = self.connection.execute("SELECT 1 FROM images WHERE hash = ?", (image_hash,)).fetchone()
+        if not exists:
+            self.connection.execute("INSERT INTO images (hash, data, thumbnail, width, height) VALUES (?, ?, ?, ?, ?)",
+                                    (image_hash, data, make_thumbnail(image), image.width, image.height))
+        self.known_hashes[question_id] = self.object_hashes[id(image)] = (image, image_hash)
+        return image_hash
+
+
+    def image_hash(self, question_id, images):
+        if question_id not in images: return None
+        if isinstance(images, ProjectImages) and question_id in images.pending:
+            # never decoded, so it is unchanged: at most copy the stored row over
+            image_hash = images.pending[question_id]
+            if images.project is not self:
+                row = images.project.connection.execute("SELECT data, thumbnail, width, height FROM images WHERE hash = ?", (image_hash,)).fetchone()
+                self.connection.execute("INSERT OR IGNORE INTO images (hash, data, thumbnail, width, height) VALUES (?, ?, ?, ?, ?)", (image_hash, *row))
+            return image_hash
+        return self.store_image(question_id, images[question_id])
+
+
+    def save(self, questions_list: dict, images, question_ids, similarity=None, question_no=0, keep_images=()):
+        """Write the given questions (or their removal) in one transaction, `keep_images` are hashes to keep even if unused"""
+        positions = {question_id: i for i, question_id in enumerate(questions_list.keys())}
+        with self.connection:
+            for question_id in question_ids:
+                if question_id not in questions_list:
+                    self.connection.execute("DELETE FROM questions WHERE id = ?", (question_id,))
+                    self.known_hashes.pop(question_id, None)
+                    continue
+                question, answers = list(questions_list[question_id].items())[0]
+                image_hash = self.image_hash(question_id, images)
+                grams = similarity.grams(question_id) if similarity else None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO questions (id, position, question, answers, image, trigrams) VALUES (?, ?, ?, ?, ?, ?)",
+                    (question_id, positions[question_id], question, json.dumps(answers, ensure_ascii=False), image_hash,
+                     json.dumps(sorted(grams), ensure_ascii=False) if grams is not None else None))
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('question_no', ?)", (str(question_no),))
+            unused = self.connection.execute("SELECT hash FROM images WHERE hash NOT IN (SELECT image FROM questions WHERE image IS NOT NULL)").fetchall()
+            self.connection.executemany("DELETE FROM images WHERE hash = ?", [row for row in unused if row[0] not in keep_images])
+        # let go of images no question uses anymore
+        self.object_hashes = {id(image): (image, image_hash) for image, image_hash in self.known_hashes.values()}
+
+
+    @staticmethod
+    def create(path, questions_list: dict, images, similarity=None, question_no=0):
+        """Write a whole bank into a new project file"""
+        if os.path.exists(path): os.remove(path)
+        project = ProjectFile(path, create=True)
+        project.save(questions_list, images, list(questions_list.keys()), similarity, question_no)
+        return project
@@ -0,0 +1,80 @@
+import bisect, re, unicodedata
+
+
+# letters NFKD does not split into a base letter and a diacritic
+folded_letters = str.maketrans({'ł': 'l', 'đ': 'd', 'ø': 'o', 'ß': 'ss', 'æ': 'ae', 'œ': 'oe'})
+combining_marks = re.compile(r"[̀-ͯ]")
+word_pattern = re.compile(r"\w+")
+
+
+def fold(text: str):
+    """Lower case text without diacritics, 'Źdźbło' -> 'zdzblo'"""
+    return combining_marks.sub('', unicodedata.normalize('NFKD', text.lower().translate(folded_letters)))
+
+
+def words(text: str):
+    return word_pattern.findall(fold(text))
+
+
+class SearchIndex():
+    """
+    Inverted index of the words of questions and their answers, for filtering the question list as you type.
+
+    Every word of the query has to match the beginning of some word of the question, ignoring case and diacritics.
+    """
+    def __init__(self):
+        self.postings = {}         # word -> set of ids
+        self.entries = {}          # id -> frozenset of words
+        self.sorted_words = None   # vocabulary in order for prefix lookups, sorted again on the next search after bulk changes
+
+
+    def set(self, key, question: str, answers=()):
+        new = frozenset(words(" ".join([question, *(answer for answer, _ in answers)])))
+        old = self.entries.get(key, frozenset())
+        if new == old and key in self.entries: return
+        self.entries[key] = new
+        self._discard(key, old - new)
+        for word in new - old:
+            if word not in self.postings:
+                self.postings[word] = set()
+                if self.sorted_words is not None: bisect.insort(self.sorted_words, word)
+            self.postings[word].add(key)
+
+
+    def remove(self, key):
+        self._discard(key, self.entries.pop(key, ()))
+
+
+    def _discard(self, key, old_words):
+        for word in old_words:
+            ids = self.postings.get(word)
+            if ids is None: continue
+            ids.discard(key)
+            if not ids:
+                del self.postings[word]
+                if self.sorted_words is not None:
+                    del self.sorted_words[bisect.bisect_left(self.sorted_words, word)]
+
+
+    def clear(self):
+        self.postings.clear()
+        self.entries.clear()
+        self.sorted_words = None
+
+
+    def search(self, query: str):
+        """Ids of the questions matching every word of the query, None for a query without words"""
+        tokens = sorted(set(words(query)), key=len, reverse=True)  # longer words match fewer questions
+        if not tokens: return None
+        if self.sorted_words is None: self.sorted_words = sorted(self.postings)
+
+        result = None
+        for token in tokens:
+            ids = set()
+            i = bisect.bisect_left(self.sorted_words, token)
+            while i < len(self.sorted_words) and self.sorted_words[i].startswith(token):
+                ids |= self.postings[self.sorted_words[i]]
+                i += 1
+            result = ids if result is None else result & ids
+            if not result: break
+        return result
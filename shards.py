@@ -0,0 +1,275 @@
+"""
+Sharded export of very large banks.
+
+Splits a bank into several ZIP and / or JSON files, by number of questions, by size or by the first #tag of the
+question, and writes the shards in parallel worker processes. A manifest next to them lists the shards with their
+checksums, importing the manifest reads all of them back as one bank (see importer.import_manifest).
+
+Shards are written under a `.part` name first and only renamed once every shard is done, so a cancelled or failed
+export leaves the shards of the previous export as they were.
+"""
+import hashlib, io, json, multiprocessing, os, queue, re, time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from exporter import ExportProgress, JsonTarget, ZipTarget, export_bank, image_size_limits
+from project import StoredImage
+
+
+manifest_suffix = '.manifest.json'
+manifest_format = 'testownik-creator-shards'
+manifest_version = 1
+
+split_modes = ['count', 'size', 'tag']
+image_bytes_per_pixel = 1.5   # rough PNG size of exported images, screenshots compress better and photos worse
+untagged = 'no-tag'   # has a dash, which no #tag can
+
+
+def question_tag(question):
+    """First #tag of the question, lower case"""
+    match = re.search(r'#(\w+)', question)
+    return match.group(1).lower() if match else None
+
+
+def exported_image_bytes(image):
+    """Estimated PNG size of an image scaled like the ZIP export does, without decoding it"""
+    if isinstance(image, StoredImage):
+        from PIL import Image
+        # only reads the header
+        width, height = Image.open(io.BytesIO(image.data())).size
+    else:
+        width, height = image.size
+    low, high = image_size_limits
+    if width < low or height < low:
+        scale = max(low / width, low / height)
+        width, height = int(width * scale), int(height * scale)
+    if width > high or height > high:
+        scale = min(high / width, high / height)
+        width, height = int(width * scale), int(height * scale)
+    return int(width * height * image_bytes_per_pixel)
+
+
+def question_bytes(question, answers, image, kinds, image_sizes: dict):
+    size = 100 + len(question.encode('utf-8')) + sum(len(answer.encode('utf-8')) + 20 for answer, _ in answers)
+    # JSON only links to the uploaded images, the ZIP holds every question's image
+    if image is not None and 'zip' in kinds:
+        key = image.hash if isinstance(image, StoredImage) else id(image)
+        if key not in image_sizes: image_sizes[key] = exported_image_bytes(image)
+        size += image_sizes[key]
+    return size
+
+
+def plan_shards(bank, split='count', value=1000, kinds=('zip',)):
+    """
+    Split a bank from `snapshot_bank` into shards, keeping the order of the questions.
+
+    `value` is questions per shard for 'count' and megabytes per shard for 'size' (estimated, a shard
+    holds at least one question), 'tag' makes one shard per #tag, questions without one go together.
+
+    Returns:
+        list[tuple[str | None, list]]: (tag, bank of the shard)
+    """
+    if split not in split_modes: raise ValueError(f"Unknown split mode {split}")
+    if split == 'tag':
+        shards = {}
+        for item in bank:
+            shards.setdefault(question_tag(item[1]), []).append(item)
+        return list(shards.items())
+
+    if value <= 0: raise ValueError("Shard size has to be above 0")
+    if split == 'count':
+        count = max(1, int(value))
+        return [(None, bank[start:start + count]) for start in range(0, len(bank), count)]
+
+    limit = value * 2**20
+    image_sizes = {}
+    shards = []
+    shard = []
+    used = 0
+    for item in bank:
+        size = question_bytes(item[1], item[2], item[3], kinds, image_sizes)
+        if shard and used + size > limit:
+            shards.append((None, shard))
+            shard = []
+            used = 0
+        shard.append(item)
+        used += size
+    if shard: shards.append((None, shard))
+    return shards
+
+
+def shard_names(base, shards, split):
+    """File names of the shards without extension, numbered or named after their tag"""
+    if split == 'tag':
+        names = []
+        used = set()
+        for tag, _ in shards:
+            name = f"{base}-{tag or untagged}"
+            # tags are lower case already, but file systems may also fold cases lower() does not
+            n = 1
+            while name.casefold() in used:
+                n += 1
+                name = f"{base}-{tag or untagged}-{n}"
+            used.add(name.casefold())
+            names.append(name)
+        return names
+    digits = max(3, len(str(len(shards))))
+    return [f"{base}-{n:0{digits}d}" for n in range(1, len(shards) + 1)]
+
+
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+class WorkerJob():
+    """Stands in for the Job in a worker process, cancellation and progress go through the pool's event and queue"""
+    report_every = 20
+
+    def __init__(self, cancel_event, progress_queue):
+        self.cancel_event = cancel_event
+        self.progress_queue = progress_queue
+        self.sent = 0
+
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+    def report(self, done, total, stage=''):
+        if done - self.sent >= self.report_every or done == total:
+            self.progress_queue.put(done - self.sent)
+            self.sent = done
+
+
+worker_job = None
+
+
+def init_worker(cancel_event, progress_queue):
+    global worker_job
+    worker_job = WorkerJob(cancel_event, progress_queue)
+
+
+def export_shard(filenames: dict, bank, imgbb_api_key=''):
+    """
+    Runs in a worker process, writes the shard to `filename + '.part'` for every {kind: filename}.
+
+    Returns:
+        tuple[dict, dict]: {kind: (bytes, sha256)} and the stage timings
+    """
+    worker_job.sent = 0
+    progress = ExportProgress(worker_job, len(bank))
+    targets = []
+    for kind, filename in filenames.items():
+        if kind == 'zip': targets.append(ZipTarget(filename + '.part'))
+        else: targets.append(JsonTarget(filename + '.part', imgbb_api_key))
+    export_bank(bank, targets, progress)
+    with progress.stage('checksum'):
+        files = {kind: (os.path.getsize(filename + '.part'), file_digest(filename + '.part')) for kind, filename in filenames.items()}
+    return files, progress.timings
+
+
+def remove_parts(filenames):
+    for filename in filenames:
+        for leftover in (filename + '.part', filename + '.part.tmp'):
+            try:
+                if os.path.exists(leftover): os.remove(leftover)
+            except OSError as e:
+                print(f"Failed to remove {leftover}: {str(e)}")
+
+
+def export_sharded(filename, bank, split='count', value=1000, kinds=('zip',), imgbb_api_key='', workers=None, progress: ExportProgress = None):
+    """
+    Write the bank as shards next to `filename`, with `filename` as the manifest (its name gets `manifest_suffix`).
+
+    Returns:
+        tuple[str, int]: path of the manifest and the number of shards
+    """
+    progress = progress or ExportProgress(total=len(bank))
+    folder = os.path.dirname(os.path.abspath(filename))
+    base = os.path.basename(filename)
+    for suffix in (manifest_suffix, '.json', '.zip'):
+        if base.lower().endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+    manifest_name = os.path.join(folder, base + manifest_suffix)
+
+    with progress.stage('plan'):
+        shards = plan_shards(bank, split, value, kinds)
+    names = shard_names(base, shards, split)
+    files = [{kind: os.path.join(folder, f"{name}.{kind}") for kind in kinds} for name in names]
+    all_files = [path for shard_files in files for path in shard_files.values()]
+
+    # spawned instead of forked, a fork of the running app would carry its Qt threads along
+    context = multiprocessing.get_context('spawn')
+    cancel_event = context.Event()
+    progress_queue = context.Queue()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(shards)))
+    executor = ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(cancel_event, progress_queue))
+    results = [None] * len(shards)
+    committed = False
+    try:
+        with progress.stage('shards'):
+            futures = {executor.submit(export_shard, shard_files, shard, imgbb_api_key): index
+                       for index, (shard_files, (_, shard)) in enumerate(zip(files, shards))}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                try:
+                    while True:
+                        progress.advance(progress_queue.get_nowait(), 'shards')
+                except queue.Empty:
+                    pass
+                progress.check()
+                for future in done:
+                    files_written, timings = future.result()
+                    results[futures[future]] = files_written
+                    for name, seconds in timings.items():
+                        progress.timings[f"{name} (workers)"] = progress.timings.get(f"{name} (workers)", 0.0) + seconds
+
+        with progress.stage('finalize'):
+            manifest = {
+                "format": manifest_format,
+                "version": manifest_version,
+                "title": base,
+                "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "split": {"by": split, "value": value if split != 'tag' else None},
+                "questions": len(bank),
+                "shards": []
+            }
+            for (tag, shard), shard_files, written in zip(shards, files, results):
+                manifest["shards"].append({
+                    "files": {kind: os.path.basename(path) for kind, path in shard_files.items()},
+                    "questions": len(shard),
+                    "first": shard[0][0],
+                    "last": shard[-1][0],
+                    "tag": tag,
+                    "bytes": {kind: size for kind, (size, _) in written.items()},
+                    "sha256": {kind: digest for kind, (_, digest) in written.items()},
+                })
+            for path in all_files:
+                os.replace(path + '.part', path)
+            with open(manifest_name + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=4)
+            os.replace(manifest_name + '.tmp', manifest_name)
+            committed = True
+        return manifest_name, len(shards)
+    finally:
+        # a cancelled or failed export stops the other workers and drops what they wrote
+        if not committed: cancel_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        if not committed: remove_parts(all_files)
+
+
+def read_manifest(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or manifest.get('format') != manifest_format:
+        raise ValueError(f"{os.path.basename(filename)} is not a shard manifest")
+    if manifest.get('version', 0) > manifest_version:
+        raise ValueError(f"{os.path.basename(filename)} was written by a newer version (manifest version {manifest['version']})")
+    return manifest
@@ -0,0 +1,77 @@
+"""
+Watchdog for freezes of the GUI thread.
+
+A timer on the GUI thread keeps a heartbeat, a background thread notices when it stops for longer than
+the threshold and takes the GUI thread's Python stack at that moment. Once the GUI thread is back, the
+stall is reported with its duration and the handler the event loop was stuck in.
+"""
+import os, sys, threading, time, traceback
+
+from PySide6.QtCore import QObject, QTimer
+
+
+default_threshold_ms = 500
+heartbeat_ms = 50
+
+
+
+class StallWatchdog(QObject):
+    def __init__(self, threshold_ms=default_threshold_ms, log_path='stalls.log', parent=None):
+        super().__init__(parent)
+        self.threshold = threshold_ms / 1000
+        self.log_path = log_path
+        self.main_thread = threading.main_thread().ident
+        self.beat = time.monotonic()
+        self.stall = None   # (started, stack) of the stall in progress
+        self.loop_depth = 0
+        self.stopped = threading.Event()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.heartbeat)
+        self.thread = threading.Thread(target=self.watch, name='stall-watchdog', daemon=True)
+
+
+    def start(self):
+        """Call from the function that runs the event loop, right before it does"""
+        # frames below the caller's are handlers the event loop called into
+        self.loop_depth = len(traceback.extract_stack()) - 1
+        self.beat = time.monotonic()
+        self.timer.start(heartbeat_ms)
+        self.thread.start()
+
+
+    def stop(self):
+        self.timer.stop()
+        self.stopped.set()
+
+
+    def heartbeat(self):
+        now = time.monotonic()
+        stall = self.stall
+        if stall:
+            self.stall = None
+            self.report(now - stall[0], stall[1])
+        self.beat = now
+
+
+    def watch(self):
+        while not self.stopped.wait(self.threshold / 4):
+            started = self.beat
+            if self.stall is None and time.monotonic() - started > self.threshold:
+                frame = sys._current_frames().get(self.main_thread)
+                if frame is not None:
+                    self.stall = (started, traceback.extract_stack(frame))
+
+
+    def report(self, duration, stack):
+        handler = stack[self.loop_depth] if len(stack) > self.loop_depth else stack[-1]
+        lines = [f"{time.strftime('%Y-%m-%d %H:%M:%S')} GUI thread stalled for {duration:.2f} s in "
+                 f"{handler.name} ({os.path.basename(handler.filename)}:{handler.lineno}), stack when it was noticed:"]
+        lines += [line.rstrip('\n') for line in traceback.format_list(stack[self.loop_depth:])]
+        report = "\n".join(lines)
+        print(report, file=sys.stderr)
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(report + "\n\n")
+            except OSError as e:
+                print(f"Failed to write stall report: {str(e)}", file=sys.stderr)
@@ -0,0 +1,20 @@
+import os, sys
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# the modules live next to main.py, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    from PySide6.QtWidgets import QApplication
+    import main
+    monkeypatch.chdir(tmp_path)
+    app = QApplication.instance() or QApplication([])
+    window = main.TestownikCreator(restore=False)
+    yield window
+    window.close()
+    app.processEvents()
@@ -0,0 +1,43 @@
+import zipfile
+
+import pytest
+from PIL import Image
+
+import exporter
+
+
+def read_zip(filename):
+    with zipfile.ZipFile(filename) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_incremental_zip_export_matches_a_full_one(tmp_path):
+    picture = Image.effect_noise((64, 48), 40).convert('RGB')
+    questions = {i: {f"Question {i}?" if i % 3 else "": [(f"answer {i}", True), ("other", False)]} for i in range(1, 31)}
+    images = {i: picture for i in range(3, 31, 3)}
+    filename = str(tmp_path / 'bank.zip')
+    state, reused = exporter.export_zip(filename, exporter.snapshot_bank(questions, images))
+    assert reused == 0
+
+    questions[4] = {"Question 4, edited?": [("answer 4", True)]}
+    state, reused = exporter.export_zip(filename, exporter.snapshot_bank(questions, images), state, {4})
+    assert reused == 29
+    (tmp_path / 'full').mkdir()
+    exporter.export_zip(str(tmp_path / 'full' / 'bank.zip'), exporter.snapshot_bank(questions, images))
+    assert read_zip(filename) == read_zip(str(tmp_path / 'full' / 'bank.zip'))
+
+
+def test_import_scales_upscaled_images_back_to_their_size():
+    import io
+    from PIL import ImageFont
+    try:
+        ImageFont.truetype("arial.ttf", 20)
+    except OSError:
+        pytest.skip("captions need arial.ttf")
+    small = Image.effect_noise((64, 48), 40).convert('RGB')
+    restored = exporter.remove_text_area(Image.open(io.BytesIO(exporter.add_text_to_image(small, "Small picture?"))), "Small picture?")
+    assert restored.size == (64, 48)
+
+    large = Image.effect_noise((1000, 800), 40).convert('RGB')
+    restored = exporter.remove_text_area(Image.open(io.BytesIO(exporter.add_text_to_image(large, "Large picture?"))), "Large picture?")
+    assert restored.size == exporter.scale_image(large).size
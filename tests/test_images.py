@@ -0,0 +1,24 @@
+from PIL import Image
+
+
+def wait_for_jobs(window):
+    from PySide6.QtWidgets import QApplication
+    window.jobs.wait()
+    QApplication.processEvents()
+
+
+def test_dropped_image_is_shared_after_hashing_on_a_worker(window):
+    window.image_drop_area.set_image(Image.new('RGB', (300, 200), 'red'))
+    window.update_answer_field()
+    first = window.question_no
+    wait_for_jobs(window)
+
+    window.add_question_to_list()
+    window.image_drop_area.set_image(Image.new('RGB', (300, 200), 'red'))
+    dropped = window.image_drop_area.pil_image
+    window.update_answer_field()
+    assert window.images[window.question_no] is dropped
+
+    wait_for_jobs(window)
+    assert window.images[window.question_no] is window.images[first]
+    assert window.image_drop_area.pil_image is window.images[first]
@@ -0,0 +1,36 @@
+import importer
+
+
+def parse(text):
+    return list(importer.parse_text_questions(text.split('\n')))
+
+
+def test_abbreviations_are_not_answer_letters():
+    questions = parse("1. Which of these are bacteria?\n- E. coli\n- S. aureus\n2. And these?\na. B. subtilis\nb. E. coli\nc) S. aureus")
+    assert questions == [
+        ("Which of these are bacteria?", [("E. coli", False), ("S. aureus", False)]),
+        ("And these?", [("B. subtilis", False), ("E. coli", False), ("S. aureus", False)]),
+    ]
+
+
+def test_lettered_answers_in_order():
+    assert parse("1. Capital of France?\na. Paris\nb. Rome\nc. [v] Lyon") == [("Capital of France?", [("Paris", False), ("Rome", False), ("Lyon", True)])]
+
+
+def test_single_question_paste_is_not_split():
+    assert not importer.many_questions("What is 2+2?\n\n4\n5".split('\n'))
+    assert importer.many_questions("1. What is 2+2?\n4\n2. What is 3+3?\n6".split('\n'))
+
+
+def test_multiline_paste_of_one_question(window):
+    window.add_question_to_list()
+    window.multiline_paste = True
+    window.question_input.setText("What is 2+2?\n\n4\n5\nE. coli")
+    assert list(window.questions_list.items()) == [(window.question_no, {"What is 2+2?": [("4", False), ("5", False), ("E. coli", False)]})]
+
+
+def test_multiline_paste_of_a_document(window):
+    window.add_question_to_list()
+    window.multiline_paste = True
+    window.question_input.setText("1. What is 2+2?\na) 4\nb) 5\n2. What is 3+3?\na) 6")
+    assert [list(question_data.keys())[0] for question_data in window.questions_list.values()] == ["What is 2+2?", "What is 3+3?"]
@@ -0,0 +1,22 @@
+import llm
+
+
+def words(count, word):
+    return ' '.join(f"{word}{n}" for n in range(count))
+
+
+def test_fit_prompt_keeps_every_correct_answer():
+    question = words(500, 'q')
+    answers = [(words(80, f'c{n}x'), True) for n in range(15)] + [(words(80, 'wrong'), False)]
+    assert llm.estimate_tokens(question) > llm.question_token_limit
+    fitted, kept, left_out = llm.fit_prompt(question, answers)
+    assert [correct for _, correct in kept] == [True] * 15
+    # only incorrect answers are reported as not shown
+    assert left_out == 1
+    used = llm.estimate_tokens(fitted) + sum(llm.estimate_tokens(answer) + 2 for answer, _ in kept)
+    assert used <= llm.prompt_token_budget
+
+
+def test_fit_prompt_keeps_short_answers_as_they_are():
+    answers = [("Paris", True), ("Rome", False), ("Berlin", False)]
+    assert llm.fit_prompt("Capital of France?", answers) == ("Capital of France?", answers, 0)
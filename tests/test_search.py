@@ -0,0 +1,26 @@
+def visible(window):
+    return {key for key, item in window.question_items.items() if not item.isHidden()}
+
+
+def test_added_and_edited_questions_stay_visible_while_searching(window):
+    window.questions_list.update({1: {"Capital of France?": [("Paris", True)]}, 2: {"Largest planet?": [("Jupiter", True)]}})
+    window.bank_replaced()
+    window.update_question_list()
+    window.search_input.setText("capital")
+    assert visible(window) == {1}
+
+    window.add_question_to_list()
+    assert visible(window) == {1, window.question_no}
+
+    window.questions_list[1] = {"Capital of Spain?": [("Madrid", True)]}
+    window.question_edited(1)
+    window.search_input.setText("capital of f")
+    assert visible(window) == set()
+    window.search_input.setText("capital")
+    window.questions_list[1] = {"Biggest city of Spain?": [("Madrid", True)]}
+    window.question_edited(1)
+    window.add_question_to_list()
+    assert 1 in visible(window)
+
+    window.search_input.setText("planet")
+    assert visible(window) == {2}
@@ -0,0 +1,28 @@
+import pytest
+
+import exporter, importer, shards
+
+
+def sample_bank():
+    tags = ['#bio', '#Chem', '', '#untagged', '#BIO']
+    questions = {i: {f"Question {i} {tags[i % len(tags)]}?": [(f"answer {i} {k}", k == 0) for k in range(3)]} for i in range(1, 13)}
+    return questions, exporter.snapshot_bank(questions, {})
+
+
+def test_shard_names_do_not_collide():
+    bank = sample_bank()[1]
+    names = shards.shard_names('bank', shards.plan_shards(bank, 'tag'), 'tag')
+    assert len({name.casefold() for name in names}) == len(names)
+    assert 'bank-untagged' in names and 'bank-no-tag' in names
+    assert shards.shard_names('bank', [('k', []), ('K', [])], 'tag') == ['bank-k', 'bank-K-2']
+
+
+@pytest.mark.parametrize('split, value', [('count', 5), ('size', 0.001), ('tag', None)])
+def test_export_and_import_back(tmp_path, split, value):
+    questions, bank = sample_bank()
+    manifest, count = shards.export_sharded(str(tmp_path / 'bank.zip'), bank, split, value, workers=2)
+    assert count > 1
+    imported, images, errors = importer.import_bank(manifest)
+    assert errors == []
+    assert imported == questions
+    assert not [name for name in tmp_path.iterdir() if name.suffix in ('.part', '.tmp')]
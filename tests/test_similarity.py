@@ -0,0 +1,31 @@
+import random
+
+import similarity
+
+
+def scrambled(text, rng, share):
+    """Text with `share` of its characters replaced, mostly breaking up every trigram"""
+    chars = list(text)
+    for i in rng.sample(range(len(chars)), int(len(chars) * share)):
+        chars[i] = rng.choice('qxzjk')
+    return ''.join(chars)
+
+
+def test_small_banks_find_every_similar_question():
+    rng = random.Random(3)
+    index = similarity.SimilarityIndex()
+    base = "Which of the following statements about photosynthesis in plants are true?"
+    texts = [scrambled(base, rng, 0.4) for _ in range(200)]
+    for key, text in enumerate(texts):
+        index.set(key, text)
+    expected = {key for key, text in enumerate(texts) if similarity.string_similarity(base, text) >= 0.6}
+    assert expected
+    assert {key for key, _, _ in index.similar(base, 0.6)} == expected
+
+
+def test_big_banks_use_the_trigram_index():
+    index = similarity.SimilarityIndex()
+    for key in range(similarity.exact_compare_limit + 1):
+        index.set(key, f"Question number {key} about a completely unrelated topic {key * 7919}")
+    index.set('same', "Which of the following statements about photosynthesis are true?")
+    assert [key for key, _, _ in index.similar("Which of the following statements about photosynthesis is true?", 0.6)] == ['same']